@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from starlette.responses import JSONResponse
+
+from backend.settings import settings
+
+# route classes, see `route_class`
+AUTH = "auth"
+ADMIN = "admin"
+READS = "reads"
+WRITES = "writes"
+
+# per worker, overridden per class by the [admission.<class>] tables of
+# db-config.toml. bcrypt runs on the event loop, so few password checks at
+# once; the admin rosters and bulk emails are shed first, as soon as the
+# worker is busy (`shed_when_busy`)
+DEFAULT_LIMITS = {
+    AUTH: {"limit": 4, "queue": 32, "timeout": 5, "retry_after": 2},
+    ADMIN: {
+        "limit": 4,
+        "queue": 8,
+        "timeout": 10,
+        "retry_after": 10,
+        "shed_when_busy": True,
+    },
+    READS: {"limit": 64, "queue": 256, "timeout": 2, "retry_after": 1},
+    WRITES: {"limit": 16, "queue": 64, "timeout": 5, "retry_after": 2},
+}
+
+# routes that hash or check a password
+AUTH_PATHS = frozenset(
+    [
+        "/token",
+        "/student/register",
+        "/student/update_password",
+        "/student/reset_password",
+    ]
+)
+# POST routes that only read
+READ_PATHS = frozenset(["/student/get_meetings"])
+
+
+def route_class(method: str, path: str) -> str:
+    if path in AUTH_PATHS:
+        return AUTH
+    if path.startswith("/admin/"):
+        return ADMIN
+    if method in ("GET", "HEAD") or path in READ_PATHS:
+        return READS
+    return WRITES
+
+
+class AdmissionQueue:
+    """
+    At most `limit` requests of a route class run at once, up to `queue`
+    more wait in arrival order for at most `timeout` seconds. A request
+    that finds the queue full, or waits too long, is turned away
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        queue: int,
+        timeout: float,
+        retry_after: int = 1,
+        shed_when_busy: bool = False,
+    ):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        # no waiting while `is_busy` says the worker is overloaded
+        self.shed_when_busy = shed_when_busy
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_waiting = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, busy: bool = False) -> bool:
+        """True once the request may run, then `release` must be called"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        queue = 0 if busy and self.shed_when_busy else self.queue
+        if len(self._waiters) >= queue:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_waiting = max(self.max_waiting, len(self._waiters))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self._forget(waiter)
+            self.timed_out += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the client went away
+                self.release()
+            else:
+                self._forget(waiter)
+            raise
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+        self.admitted += 1
+        return True
+
+    def _forget(self, waiter: asyncio.Future):
+        # `release` may have dropped it already, it skips cancelled waiters
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def release(self):
+        # the slot goes straight to the longest waiting request
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "average_wait_ms": round(self.wait_seconds / self.queued * 1000, 1)
+            if self.queued
+            else 0.0,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits HTTP requests through the `AdmissionQueue` of
+    their route class, so a burst of one kind of request, e.g. admins
+    loading rosters, cannot starve the others. Turned away requests get a
+    503 with Retry-After. `is_busy`, e.g. `LoadMonitor.is_high`, lets the
+    classes with `shed_when_busy` turn requests away rather than queue them.
+    `exclude_paths` are never limited, e.g. event streams that stay open
+    for hours and the route reporting these queues
+    """
+
+    def __init__(
+        self,
+        app,
+        queues: Optional[Dict[str, AdmissionQueue]] = None,
+        classify: Callable[[str, str], str] = route_class,
+        is_busy: Optional[Callable[[], bool]] = None,
+        exclude_paths: Iterable[str] = (),
+    ):
+        self.app = app
+        self.queues = queues
+        self.classify = classify
+        self.is_busy = is_busy
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        queues = self.queues or get_admission_queues()
+        queue = queues[self.classify(scope["method"], scope["path"])]
+        busy = queue.shed_when_busy and self.is_busy is not None and self.is_busy()
+        if not await queue.acquire(busy):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "The server is busy, try again shortly"},
+                headers={"Retry-After": str(queue.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            queue.release()
+
+
+@lru_cache(maxsize=None)
+def get_admission_queues() -> Dict[str, AdmissionQueue]:
+    """This worker's queues, limits from db-config.toml"""
+    overrides = settings.get("admission", {})
+    return {
+        name: AdmissionQueue(**{**defaults, **overrides.get(name, {})})
+        for name, defaults in DEFAULT_LIMITS.items()
+    }
+
+
+def admission_stats() -> Dict[str, dict]:
+    return {name: queue.stats() for name, queue in get_admission_queues().items()}
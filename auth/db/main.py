@@ -1,21 +1,44 @@
+from datetime import datetime
+from typing import List, Optional
+
 import motor.motor_asyncio
 from pydantic import UUID4, EmailStr
 
 
 from backend.auth.db.models.users import UserInDB
+from backend.auth.db.models.tokens import RefreshTokenInDB, RevokedTokenInDB
+from backend.mongo_clients import get_async_client
 
 client: motor.motor_asyncio.AsyncIOMotorClient
 database: motor.motor_asyncio.AsyncIOMotorDatabase
 users_collection: motor.motor_asyncio.AsyncIOMotorCollection
+refresh_tokens_collection: motor.motor_asyncio.AsyncIOMotorCollection
+revoked_tokens_collection: motor.motor_asyncio.AsyncIOMotorCollection
 
 
 def connect_to_db(uri: str):
     global client
     global database
     global users_collection
-    client = motor.motor_asyncio.AsyncIOMotorClient(uri, uuidRepresentation="standard")
+    global refresh_tokens_collection
+    global revoked_tokens_collection
+    # shares the pool with any other Motor user of the same cluster
+    client = get_async_client(uri)
     database = client.auth_db
     users_collection = database.users
+    refresh_tokens_collection = database.refresh_tokens
+    revoked_tokens_collection = database.revoked_tokens
+
+
+async def create_indexes():
+    await refresh_tokens_collection.create_index("token_hash", unique=True)
+    await refresh_tokens_collection.create_index("user_id")
+    # TTL index, MongoDB removes refresh tokens once `expires_at` has passed
+    await refresh_tokens_collection.create_index("expires_at", expireAfterSeconds=0)
+    await revoked_tokens_collection.create_index("key", unique=True)
+    await revoked_tokens_collection.create_index("revoked_at")
+    # revocations are only needed until the revoked access tokens expire
+    await revoked_tokens_collection.create_index("expires_at", expireAfterSeconds=0)
 
 
 async def add_user(user: UserInDB):
@@ -56,3 +79,66 @@ async def update_disabled_by_id(id: UUID4, new_disabled: bool):
     await users_collection.update_one({"id": id}, {"$set": {"disabled": new_disabled}})
     updated_user = await get_user_by_id(id)
     return updated_user
+
+
+async def update_student_ids_by_id(id: UUID4, student_ids: List[str]):
+    await users_collection.update_one(
+        {"id": id}, {"$set": {"student_ids": student_ids}}
+    )
+
+
+async def add_refresh_token(token: RefreshTokenInDB):
+    await refresh_tokens_collection.insert_one(token.dict())
+
+
+async def get_refresh_token(token_hash: str):
+    token = await refresh_tokens_collection.find_one({"token_hash": token_hash})
+    if token:
+        return RefreshTokenInDB(**token)
+    return False
+
+
+async def use_refresh_token(token_hash: str):
+    """
+    Atomically marks an unused, unexpired refresh token as used and returns it.
+    Returns False if no such token exists, so a token can only be exchanged once.
+    """
+    token = await refresh_tokens_collection.find_one_and_update(
+        {
+            "token_hash": token_hash,
+            "used": False,
+            "expires_at": {"$gt": datetime.utcnow()},
+        },
+        {"$set": {"used": True}},
+    )
+    if token:
+        return RefreshTokenInDB(**token)
+    return False
+
+
+async def delete_refresh_token_family(family_id: UUID4):
+    await refresh_tokens_collection.delete_many({"family_id": family_id})
+
+
+async def delete_refresh_tokens_by_user_id(user_id: UUID4):
+    await refresh_tokens_collection.delete_many({"user_id": user_id})
+
+
+async def add_revocation(revocation: RevokedTokenInDB):
+    # upsert so revoking a user twice moves `revoked_at` forward
+    await revoked_tokens_collection.update_one(
+        {"key": revocation.key}, {"$set": revocation.dict()}, upsert=True
+    )
+
+
+async def get_revocation(key: str):
+    revocation = await revoked_tokens_collection.find_one({"key": key})
+    if revocation:
+        return RevokedTokenInDB(**revocation)
+    return False
+
+
+async def get_revocations_since(since: Optional[datetime]):
+    query = {"revoked_at": {"$gte": since}} if since else {}
+    cursor = revoked_tokens_collection.find(query, {"_id": 0})
+    return [RevokedTokenInDB(**revocation) async for revocation in cursor]
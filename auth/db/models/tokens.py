@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field, UUID4
+
+
+class RefreshTokenInDB(BaseModel):
+    # only the sha256 hash of the refresh token is stored
+    token_hash: str = Field()
+    user_id: UUID4 = Field()
+    # every refresh token issued from one login shares a `family_id`
+    # so the whole chain can be revoked if reuse is detected
+    family_id: UUID4 = Field()
+    expires_at: datetime = Field()
+    used: bool = False
+
+
+class RevokedTokenInDB(BaseModel):
+    # either "jti:<token id>" for a single access token
+    # or "user:<user id>" for every token issued to a user before `revoked_at`
+    key: str = Field()
+    revoked_at: datetime = Field()
+    expires_at: datetime = Field()
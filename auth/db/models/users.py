@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from uuid import uuid4
 from pydantic import BaseModel, Field, EmailStr, UUID4, validator
@@ -34,8 +34,21 @@ class UserUpdate(BaseModel):
     disabled: Optional[bool] = None
 
 
+class PasswordReset(BaseModel):
+    token: str
+    password: str
+
+    @validator("password")
+    def valid_password(cls, v: str):
+        if len(v) < 6:
+            raise ValueError("Password should be at least 6 characters")
+        return v
+
+
 class UserInDB(User):
     hashed_password: str
+    # ids of the StudentDocuments on this account's profile, copied into tokens
+    student_ids: List[str] = []
 
     class Config:
         orm_mode = True
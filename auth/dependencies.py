@@ -1,11 +1,11 @@
-from pathlib import Path
-
+import hashlib
+import secrets
 from datetime import datetime, timedelta
-from typing import Optional
+from enum import Enum
+from functools import lru_cache
+from typing import List, Optional
+from uuid import uuid4
 
-import toml
-import boto3
-from botocore.exceptions import ClientError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -13,35 +13,57 @@ from passlib.context import CryptContext
 from pydantic import BaseModel, UUID4
 
 from backend.auth.db.models.users import UserInDB, UserCreate, User, UserRole
-
-from backend.auth.db.main import get_user_by_email, add_user, get_user_by_id
-
-# get the config file path
-CONFIG_PATH = Path(__file__).resolve().parent.joinpath("db-config.toml")
-print("Using CONFIG_PATH:", CONFIG_PATH)
-config = toml.load(str(CONFIG_PATH))
-SECRET_KEY = config["secret"]
-
-# aws s3 config stuff
-AWS_CONFIG_PATH = Path(__file__).resolve().parent.joinpath("aws-config.toml")
-if AWS_CONFIG_PATH.exists():
-    aws_config = toml.load(str(AWS_CONFIG_PATH))
-    AWS_ACCESS_KEY_ID = aws_config["aws-access-key-id"]
-    AWS_SECRET_ACCESS_KEY = aws_config["aws-secret-access-key"]
-    AWS_BUCKET_NAME = aws_config["aws-bucket-name"]
+from backend.auth.db.models.tokens import RefreshTokenInDB, RevokedTokenInDB
+
+from backend.auth.db.main import (
+    get_user_by_email,
+    add_user,
+    get_user_by_id,
+    add_refresh_token,
+    get_refresh_token,
+    use_refresh_token,
+    delete_refresh_token_family,
+    add_revocation,
+)
+from backend.auth.presigner import S3Presigner
+from backend.auth.revocation import revocation_list, jti_key, user_key
+from backend.settings import settings
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MIN = 240
+REFRESH_TOKEN_EXPIRE_DAYS = 30
+EMAIL_VERIFICATION_EXPIRE_HOURS = 48
+PASSWORD_RESET_EXPIRE_MIN = 30
+
+
+class TokenPurpose(str, Enum):
+    email_verification = "email_verification"
+    password_reset = "password_reset"
+    # links to the local storage backend, see main/storage/local_storage.py
+    file_download = "file_download"
+    file_upload = "file_upload"
+    file_upload_part = "file_upload_part"
 
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     id: UUID4
     role: UserRole
+    # tokens issued before `jti` was added do not carry these claims
+    jti: Optional[str] = None
+    issued_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    # ids of the account's students, None if the token does not carry them
+    student_ids: Optional[List[str]] = None
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -62,7 +84,17 @@ def authenticate_user(user: UserInDB, password: str):
     return user
 
 
-# s3 presigned url helpers
+@lru_cache(maxsize=None)
+def get_presigner() -> S3Presigner:
+    """The SigV4 presigner for the configured bucket's credentials and region"""
+    return S3Presigner(
+        settings.aws["aws-access-key-id"],
+        settings.aws["aws-secret-access-key"],
+        settings.aws.get("aws-region", "us-east-1"),
+    )
+
+
+# s3 presigned url helpers, signed locally by `S3Presigner`
 # based on "https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-presigned-urls.html"
 def create_presigned_url(object_name, expiration=3600):
     """Generate a presigned URL to share an S3 object
@@ -73,19 +105,12 @@ def create_presigned_url(object_name, expiration=3600):
     """
 
     # Generate a presigned URL for the S3 object
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    )
     try:
-        response = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": AWS_BUCKET_NAME, "Key": object_name},
-            ExpiresIn=expiration,
+        response = get_presigner().generate_presigned_url(
+            settings.aws["aws-bucket-name"], object_name, expiration
         )
-    except ClientError as e:
-        print("ERROR:", e)
+    except KeyError as e:
+        print("ERROR: missing AWS setting", e)
         return None
 
     # The response contains the presigned URL
@@ -107,27 +132,146 @@ def create_presigned_post(object_name, fields=None, conditions=None, expiration=
     """
 
     # Generate a presigned S3 POST URL
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    )
     try:
-        response = s3_client.generate_presigned_post(
-            AWS_BUCKET_NAME,
+        response = get_presigner().generate_presigned_post(
+            settings.aws["aws-bucket-name"],
             object_name,
-            Fields=fields,
-            Conditions=conditions,
-            ExpiresIn=expiration,
+            fields,
+            conditions,
+            expiration,
         )
-    except ClientError as e:
-        print("ERROR:", e)
+    except KeyError as e:
+        print("ERROR: missing AWS setting", e)
         return None
 
     # The response contains the presigned URL and required fields
     return response
 
 
+# multipart uploads, the parts are uploaded by the browser straight to S3
+# see "https://docs.aws.amazon.com/AmazonS3/latest/userguide/mpuoverview.html"
+MULTIPART_MAX_PARTS = 10000
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """
+    The boto3 S3 client for the calls that are not presigned (starting,
+    completing and aborting multipart uploads), created on first use
+    """
+    import boto3
+
+    return boto3.client(
+        "s3",
+        region_name=settings.aws.get("aws-region", "us-east-1"),
+        aws_access_key_id=settings.aws["aws-access-key-id"],
+        aws_secret_access_key=settings.aws["aws-secret-access-key"],
+    )
+
+
+def create_multipart_upload(object_name, content_type=None):
+    """Start a multipart upload of an S3 object
+
+    :param object_name: string
+    :param content_type: Content-Type stored with the object, optional
+    :return: The upload id as string. If error, returns None.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    extra_args = {"ContentType": content_type} if content_type else {}
+    try:
+        response = get_s3_client().create_multipart_upload(
+            Bucket=settings.aws["aws-bucket-name"], Key=object_name, **extra_args
+        )
+    except (BotoCoreError, ClientError, KeyError) as e:
+        print("ERROR:", e)
+        return None
+
+    return response["UploadId"]
+
+
+def create_presigned_upload_part_urls(
+    object_name, upload_id, part_numbers, expiration=3600
+):
+    """Generate presigned URLs to PUT the parts of a multipart upload
+
+    :param object_name: string
+    :param upload_id: The id returned by `create_multipart_upload`
+    :param part_numbers: Part numbers between 1 and 10000
+    :param expiration: Time in seconds for the presigned URLs to remain valid
+    :return: List of dictionaries with the keys part_number and url.
+        If error, returns None.
+    """
+    try:
+        presigner = get_presigner()
+        bucket = settings.aws["aws-bucket-name"]
+    except KeyError as e:
+        print("ERROR: missing AWS setting", e)
+        return None
+
+    return [
+        {
+            "part_number": part_number,
+            "url": presigner.generate_presigned_upload_part_url(
+                bucket, object_name, upload_id, part_number, expiration
+            ),
+        }
+        for part_number in part_numbers
+    ]
+
+
+def complete_multipart_upload(object_name, upload_id, parts):
+    """Assemble the uploaded parts into the S3 object
+
+    :param object_name: string
+    :param upload_id: The id returned by `create_multipart_upload`
+    :param parts: List of dictionaries with the keys part_number and etag,
+        the ETag header S3 returned for each uploaded part
+    :return: True if the object was assembled, False if error.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        get_s3_client().complete_multipart_upload(
+            Bucket=settings.aws["aws-bucket-name"],
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                    for part in sorted(parts, key=lambda part: part["part_number"])
+                ]
+            },
+        )
+    except (BotoCoreError, ClientError, KeyError) as e:
+        print("ERROR:", e)
+        return False
+
+    return True
+
+
+def abort_multipart_upload(object_name, upload_id):
+    """Abort a multipart upload, S3 deletes the parts uploaded so far
+
+    :param object_name: string
+    :param upload_id: The id returned by `create_multipart_upload`
+    :return: True if the upload was aborted, False if error.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    try:
+        get_s3_client().abort_multipart_upload(
+            Bucket=settings.aws["aws-bucket-name"],
+            Key=object_name,
+            UploadId=upload_id,
+        )
+    except (BotoCoreError, ClientError, KeyError) as e:
+        print("ERROR:", e)
+        return False
+
+    return True
+
+
 async def create_user(user: UserCreate) -> User:
     """
     Accepts a UserCreate model and returns a User
@@ -202,17 +346,76 @@ async def create_admin(user: UserCreate) -> User:
     return User(**user.dict())
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+def create_access_token(
+    data: dict,
+    expires_delta: Optional[timedelta] = None,
+    student_ids: Optional[List[str]] = None,
+):
     to_encode = data.copy()
+    if student_ids is not None:
+        to_encode["students"] = student_ids
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
+    # `jti` identifies this token in the revocation list
+    to_encode.update({"exp": expire, "iat": now, "jti": uuid4().hex})
+    encoded_jwt = jwt.encode(to_encode, settings["secret"], algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def hash_refresh_token(refresh_token: str) -> str:
+    # refresh tokens are long random strings, so a fast hash is enough here
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+async def create_refresh_token(user: User, family_id: Optional[UUID4] = None) -> str:
+    """
+    Creates a new refresh token for `user` and stores its hash.
+    Pass the `family_id` of the token being rotated to keep the chain together.
+    """
+    refresh_token = secrets.token_urlsafe(32)
+    db_token = RefreshTokenInDB(
+        token_hash=hash_refresh_token(refresh_token),
+        user_id=user.id,
+        family_id=family_id or uuid4(),
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    await add_refresh_token(db_token)
+    return refresh_token
+
+
+async def rotate_refresh_token(refresh_token: str):
+    """
+    Exchanges `refresh_token` for the user it was issued to and a new refresh token.
+    A refresh token which was already used revokes its whole family.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_hash = hash_refresh_token(refresh_token)
+    db_token = await use_refresh_token(token_hash)
+    if not db_token:
+        existing_token = await get_refresh_token(token_hash)
+        if existing_token and existing_token.used:
+            # an old token in the chain was replayed, assume it was stolen
+            await delete_refresh_token_family(existing_token.family_id)
+        raise credentials_exception
+
+    user = await get_user_by_id(id=db_token.user_id)
+    if not user:
+        raise credentials_exception
+    if user.disabled:
+        await delete_refresh_token_family(db_token.family_id)
+        raise HTTPException(status_code=400, detail="Account is disabled")
+
+    new_refresh_token = await create_refresh_token(user, family_id=db_token.family_id)
+    return user, new_refresh_token
+
+
 async def get_current_token_data(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -220,18 +423,166 @@ async def get_current_token_data(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings["secret"], algorithms=[ALGORITHM])
         uuid = payload.get("sub")
-        if uuid is None:
+        # signed link tokens are not access tokens
+        if uuid is None or "purpose" in payload:
             raise credentials_exception
         role = payload.get("role")
-        token_data = TokenData(id=UUID4(uuid), role=role)
+        issued_at = payload.get("iat")
+        expires_at = payload.get("exp")
+        token_data = TokenData(
+            id=UUID4(uuid),
+            role=role,
+            jti=payload.get("jti"),
+            issued_at=datetime.utcfromtimestamp(issued_at) if issued_at else None,
+            expires_at=datetime.utcfromtimestamp(expires_at) if expires_at else None,
+            student_ids=payload.get("students"),
+        )
     except JWTError:
         raise credentials_exception
 
+    # only hits the DB when the in-memory filter says the token might be revoked
+    if await revocation_list.is_revoked(
+        token_data.id, token_data.jti, token_data.issued_at
+    ):
+        raise credentials_exception
+
     return token_data
 
 
+def get_token_subject(authorization: str) -> Optional[str]:
+    """
+    The user id of the access token in an `Authorization: Bearer` header, None
+    when there is none or it does not verify. Only checks the signature and
+    expiry, not revocation, so it is no replacement for `get_current_token_data`
+    """
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings["secret"], algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if "purpose" in payload:
+        return None
+    return payload.get("sub")
+
+
+def token_owns_student(token_data: TokenData, student_id: str) -> bool:
+    """
+    Returns True if the token's `students` claim lists `student_id`.
+    False means "unknown", the claim may be missing or older than the profile,
+    so callers should fall back to the StudentDocument's `profile_uuid`
+    """
+    return (
+        token_data.student_ids is not None and str(student_id) in token_data.student_ids
+    )
+
+
+def create_user_access_token(user: UserInDB) -> str:
+    """Creates an access token for `user`, students also get their student ids"""
+    student_ids = user.student_ids if user.role == UserRole.student else None
+    return create_access_token(
+        data={"sub": str(user.id), "role": user.role},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN),
+        student_ids=student_ids,
+    )
+
+
+async def revoke_access_token(token_data: TokenData):
+    """Revokes the single access token described by `token_data`"""
+    if not token_data.jti:
+        return
+    key = jti_key(token_data.jti)
+    await add_revocation(
+        RevokedTokenInDB(
+            key=key,
+            revoked_at=datetime.utcnow(),
+            expires_at=token_data.expires_at
+            or datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN),
+        )
+    )
+    revocation_list.add(key)
+
+
+async def revoke_user_tokens(user_id: UUID4):
+    """Revokes every access token issued to `user_id` up to now"""
+    key = user_key(user_id)
+    # whole seconds like the `iat` of the tokens, a login right after this
+    # must not be revoked along with the tokens before it
+    now = datetime.utcnow().replace(microsecond=0)
+    await add_revocation(
+        RevokedTokenInDB(
+            key=key,
+            revoked_at=now,
+            # no token issued before now can outlive this
+            expires_at=now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN),
+        )
+    )
+    revocation_list.add(key)
+
+
+def create_signed_token(
+    purpose: TokenPurpose,
+    subject: str,
+    expires_delta: timedelta,
+    claims: Optional[dict] = None,
+) -> str:
+    """
+    Creates a signed token for links sent by email or handed out in place of
+    presigned urls. Everything needed to check it is in the token, so nothing is stored per token
+    """
+    to_encode = {
+        **(claims or {}),
+        "sub": subject,
+        "purpose": purpose,
+        "exp": datetime.utcnow() + expires_delta,
+    }
+    return jwt.encode(to_encode, settings["secret"], algorithm=ALGORITHM)
+
+
+def verify_signed_token(token: str, purpose: TokenPurpose) -> dict:
+    """
+    Checks the signature, expiry and purpose of a token made by `create_signed_token`
+    and returns its claims
+    """
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid or expired link",
+    )
+    try:
+        payload = jwt.decode(token, settings["secret"], algorithms=[ALGORITHM])
+    except JWTError:
+        raise invalid_exception
+    if payload.get("purpose") != purpose or payload.get("sub") is None:
+        raise invalid_exception
+    return payload
+
+
+def password_fingerprint(hashed_password: str) -> str:
+    # changes whenever the password does, so a reset token only works once
+    return hashlib.sha256(hashed_password.encode()).hexdigest()[:16]
+
+
+def create_email_verification_token(profile_uuid: UUID4, email: str) -> str:
+    return create_signed_token(
+        TokenPurpose.email_verification,
+        str(profile_uuid),
+        timedelta(hours=EMAIL_VERIFICATION_EXPIRE_HOURS),
+        {"email": email},
+    )
+
+
+def create_password_reset_token(user: UserInDB) -> str:
+    return create_signed_token(
+        TokenPurpose.password_reset,
+        str(user.id),
+        timedelta(minutes=PASSWORD_RESET_EXPIRE_MIN),
+        {"pwd": password_fingerprint(user.hashed_password)},
+    )
+
+
 async def get_student_token_data(
     token_data: TokenData = Depends(get_current_token_data),
 ):
@@ -1,46 +1,53 @@
-# hack to add project directory to path and make modules work nicely
-import sys
-from pathlib import Path
+from typing import Optional
 
-PROJECTS_DIR = Path(__file__).resolve().parents[2]
-print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
-sys.path.append(str(PROJECTS_DIR))
-
-from datetime import timedelta
-
-import toml
 from fastapi import FastAPI, Depends, HTTPException, status, Body
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import UUID4
 import uvicorn
 
+from backend.admission import AdmissionMiddleware
 from backend.auth.dependencies import (
     Token,
-    create_access_token,
+    TokenData,
+    TokenRefresh,
+    create_user_access_token,
+    create_refresh_token,
+    rotate_refresh_token,
+    hash_refresh_token,
+    revoke_access_token,
+    revoke_user_tokens,
+    get_current_token_data,
+    verify_signed_token,
+    password_fingerprint,
+    TokenPurpose,
     get_password_hash,
     authenticate_user,
     create_student,
     # create_admin,
     get_current_student,
     get_current_admin,
-    ACCESS_TOKEN_EXPIRE_MIN,
 )
 from backend.auth.db.main import (
     connect_to_db,
+    create_indexes,
+    delete_refresh_tokens_by_user_id,
+    delete_refresh_token_family,
+    get_refresh_token,
     add_user,
+    get_user_by_id,
     get_user_by_email,
     update_email_by_id,
     update_password_by_id,
     update_disabled_by_id,
 )
-from backend.auth.db.models.users import User, UserInDB, UserUpdate
-
-# get the config file path
-CONFIG_PATH = Path(__file__).resolve().parent.joinpath("db-config.toml")
-print("Using CONFIG_PATH:", CONFIG_PATH)
-
-config = toml.load(str(CONFIG_PATH))
-
+from backend.auth.db.models.users import User, UserInDB, UserUpdate, PasswordReset
+from backend.mongo_clients import close_clients, cluster_uri, warm_pools
+from backend.settings import settings
+from backend.auth.revocation import (
+    start_revocation_refresher,
+    stop_revocation_refresher,
+)
 
 app = FastAPI()
 
@@ -52,6 +59,8 @@ origins = [
     "*",
 ]
 
+# password hashing runs on the event loop, so few at once, see `admission.py`
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -76,13 +85,17 @@ async def startup():
     """
     Connects to the Auth DB using Motor
     """
-    db_username = config["atlas-username"]
-    db_password = config["atlas-password"]
-    db_uri = config["connection-uri"]
-    auth_db = config["auth-db"]
-    connect_to_db(
-        db_uri.format(username=db_username, password=db_password, database=auth_db)
-    )
+    connect_to_db(cluster_uri(settings["auth-db"]))
+    await warm_pools()
+    await create_indexes()
+    await start_revocation_refresher()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # runs after the server has drained in-flight requests
+    await stop_revocation_refresher()
+    close_clients()
 
 
 @app.post("/token", response_model=Token)
@@ -100,12 +113,42 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
-    access_token = create_access_token(
-        data={"sub": str(user.id), "role": user.role},
-        expires_delta=access_token_expires,
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_user_access_token(user)
+    refresh_token = await create_refresh_token(user)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh_access_token(refresh: TokenRefresh):
+    # no password hashing here, the refresh token is exchanged for a new pair
+    user, refresh_token = await rotate_refresh_token(refresh.refresh_token)
+    access_token = create_user_access_token(user)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+
+@app.post("/token/revoke")
+async def revoke_token(
+    refresh: Optional[TokenRefresh] = Body(None),
+    token_data: TokenData = Depends(get_current_token_data),
+):
+    """
+    Logs out by revoking the access token used for this request, and the refresh
+    token family of `refresh` if one is given
+    """
+    await revoke_access_token(token_data)
+    if refresh:
+        db_token = await get_refresh_token(hash_refresh_token(refresh.refresh_token))
+        if db_token and db_token.user_id == token_data.id:
+            await delete_refresh_token_family(db_token.family_id)
+    return {"details": "Token revoked"}
 
 
 # Student GET endpoints
@@ -165,9 +208,32 @@ async def update_password(
 
     hashed_password = get_password_hash(updates.password)
 
+    # log out other devices, they have to log in with the new password
+    await delete_refresh_tokens_by_user_id(current_user.id)
     return await update_password_by_id(current_user.id, hashed_password)
 
 
+@app.put("/student/reset_password", response_model=User)
+async def reset_password(reset: PasswordReset):
+    """Sets a new password using the token from a password reset email"""
+    payload = verify_signed_token(reset.token, TokenPurpose.password_reset)
+    user = await get_user_by_id(UUID4(payload["sub"]))
+    # the fingerprint no longer matches once the password has been changed
+    if not user or payload.get("pwd") != password_fingerprint(user.hashed_password):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid or expired link",
+        )
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Account is disabled")
+
+    hashed_password = get_password_hash(reset.password)
+    # whoever had the account loses both its refresh and access tokens
+    await delete_refresh_tokens_by_user_id(user.id)
+    await revoke_user_tokens(user.id)
+    return await update_password_by_id(user.id, hashed_password)
+
+
 # NOTE: Disabling cannot currently be undone by the student
 @app.put("/student/update_disabled", response_model=User)
 async def update_disabled(
@@ -179,6 +245,9 @@ async def update_disabled(
             detail="Disabled is required",
         )
 
+    await delete_refresh_tokens_by_user_id(current_user.id)
+    # access tokens which are already out stop working right away
+    await revoke_user_tokens(current_user.id)
     return await update_disabled_by_id(current_user.id, updates.disabled)
 
 
@@ -196,5 +265,7 @@ async def admin_me(current_user: User = Depends(get_current_admin)):
 
 # TODO: Add Admin PUT endpoints that allow modifying student accounts
 
+# local development only, production runs gunicorn, see gunicorn.conf.py.
+# Run from the directory containing the checkout: python -m backend.auth.main
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
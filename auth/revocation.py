@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import math
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pydantic import UUID4
+
+from backend.auth.db.main import get_revocation, get_revocations_since
+
+# how often each worker pulls new revocations from the DB
+REFRESH_INTERVAL_SEC = 5
+# the filter is rebuilt from scratch this often so expired entries fall out of it
+REBUILD_INTERVAL = timedelta(hours=1)
+BLOOM_CAPACITY = 100_000
+BLOOM_ERROR_RATE = 0.001
+
+
+def jti_key(jti: str) -> str:
+    return f"jti:{jti}"
+
+
+def user_key(user_id: UUID4) -> str:
+    return f"user:{user_id}"
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter, `might_contain` never gives a false negative and gives a
+    false positive with probability around `error_rate` while under `capacity` items
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # double hashing, two 64 bit halves of one digest give all `num_hashes` bits
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def might_contain(self, key: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+
+class RevocationList:
+    """
+    Per worker view of the `revoked_tokens` collection.
+    The Bloom filter answers "definitely not revoked" without any I/O,
+    only a filter hit is confirmed against the DB.
+    """
+
+    def __init__(self):
+        self.filter = BloomFilter()
+        self.last_refresh: Optional[datetime] = None
+        self.last_rebuild: Optional[datetime] = None
+        self.filter_hits = 0
+
+    async def refresh(self):
+        now = datetime.utcnow()
+        if self.last_rebuild is None or now - self.last_rebuild > REBUILD_INTERVAL:
+            new_filter = BloomFilter()
+            for revocation in await get_revocations_since(None):
+                new_filter.add(revocation.key)
+            self.filter = new_filter
+            self.last_rebuild = now
+        else:
+            # overlap by one interval so revocations written with a skewed clock
+            # by another worker are still picked up
+            since = self.last_refresh - timedelta(seconds=REFRESH_INTERVAL_SEC)
+            for revocation in await get_revocations_since(since):
+                self.filter.add(revocation.key)
+        self.last_refresh = now
+
+    def add(self, key: str):
+        # revocations made by this worker take effect here immediately
+        self.filter.add(key)
+
+    async def is_revoked(self, user_id: UUID4, jti: Optional[str], issued_at) -> bool:
+        keys = [user_key(user_id)]
+        if jti:
+            keys.append(jti_key(jti))
+        for key in keys:
+            if not self.filter.might_contain(key):
+                continue
+            self.filter_hits += 1
+            revocation = await get_revocation(key)
+            if not revocation:
+                continue
+            if key.startswith("jti:"):
+                return True
+            # a user revocation only applies to tokens issued before it, both
+            # have whole seconds, so one issued in the same second stays valid
+            if issued_at is None or revocation.revoked_at > issued_at:
+                return True
+        return False
+
+    async def run_refresher(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL_SEC)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print("ERROR: could not refresh revocation list:", e)
+
+
+revocation_list = RevocationList()
+_refresher_task: Optional[asyncio.Task] = None
+
+
+async def start_revocation_refresher():
+    """Loads the revocation list and keeps it up to date in the background"""
+    global _refresher_task
+    await revocation_list.refresh()
+    _refresher_task = asyncio.get_event_loop().create_task(
+        revocation_list.run_refresher()
+    )
+
+
+async def stop_revocation_refresher():
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        _refresher_task = None
@@ -0,0 +1,167 @@
+"""
+Email throughput in messages per second, sending to a local aiosmtpd server.
+
+At each concurrency level three senders deliver the same messages:
+  per message  a new SMTP connection for every email, as sending each one
+               through a fresh FastMail did
+  pooled       `SMTPPool` connections kept open between emails
+  outbox       `OutboxWorker` draining the outbox, claims and status updates
+               included (mongomock unless --mongo-uri is given)
+--latency delays every DATA reply, to stand in for a remote server like Gmail:
+
+    python benchmarks/email_outbox.py --messages 2000 --latency 20
+"""
+import argparse
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT.parent))
+
+import aiosmtplib  # noqa: E402
+from mongoengine import connect, disconnect_all  # noqa: E402
+
+from backend.main.db.docs.outbox_doc import OutboxEmailDocument  # noqa: E402
+from backend.main.db.repositories import outbox_repo  # noqa: E402
+from backend.main.db.repositories.async_collection import (  # noqa: E402
+    clear_databases,
+    register_database,
+)
+from backend.main.email_handler.outbox_worker import (  # noqa: E402
+    OutboxWorker,
+    SMTPPool,
+    build_message,
+)
+
+HOST = "127.0.0.1"
+SENDER = "admin@email.com"
+BODY = "<html><body><p>" + "A new meeting has been posted. " * 20 + "</p></body></html>"
+
+# the server runs in its own process so it does not compete for the GIL
+SERVER = """
+import asyncio, sys
+from aiosmtpd.controller import Controller
+
+
+class Handler:
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep({latency})
+        return "250 OK"
+
+
+controller = Controller(Handler(), hostname="{host}", port={port})
+controller.start()
+print("ready", flush=True)
+sys.stdin.read()
+controller.stop()
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def email(i: int) -> dict:
+    return {"_id": i, "receivers": [f"s{i}@email.com"], "subject": "s", "body": BODY}
+
+
+async def per_message(port: int, count: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int):
+        async with semaphore:
+            smtp = aiosmtplib.SMTP(hostname=HOST, port=port)
+            await smtp.connect()
+            await smtp.send_message(build_message(email(i), SENDER))
+            await smtp.quit()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(count)))
+    return time.perf_counter() - start, count
+
+
+async def pooled(port: int, count: int, concurrency: int):
+    pool = SMTPPool(HOST, port, start_tls=False, size=concurrency)
+
+    async def send(i: int):
+        async with pool.connection() as smtp:
+            await smtp.send_message(build_message(email(i), SENDER))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return elapsed, pool.connections_opened
+
+
+async def outbox(port: int, count: int, concurrency: int, batch_size: int):
+    await outbox_repo.outbox_collection().delete_many({})
+    for i in range(count):
+        await outbox_repo.enqueue_email([f"s{i}@email.com"], "s", BODY)
+    pool = SMTPPool(HOST, port, start_tls=False, size=concurrency)
+    worker = OutboxWorker(pool, SENDER, batch_size=batch_size)
+    start = time.perf_counter()
+    while await worker.drain_once():
+        pass
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return elapsed, pool.connections_opened
+
+
+async def main(args, port: int):
+    if args.mongo_uri:
+        import motor.motor_asyncio
+
+        client = motor.motor_asyncio.AsyncIOMotorClient(args.mongo_uri)
+        register_database("admin-db", client["email_outbox_benchmark"])
+    print(f"{'sender':>12} {'concurrency':>11} {'connections':>11} {'msg/s':>8}")
+    for concurrency in args.concurrency:
+        runs = {
+            "per message": per_message(port, args.messages, concurrency),
+            "pooled": pooled(port, args.messages, concurrency),
+            "outbox": outbox(port, args.messages, concurrency, args.batch_size),
+        }
+        for name, run in runs.items():
+            elapsed, connections = await run
+            print(
+                f"{name:>12} {concurrency:>11} {connections:>11}"
+                f" {args.messages / elapsed:>8.0f}"
+            )
+    clear_databases()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0, help="ms per DATA reply")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--mongo-uri", help="real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            SERVER.format(host=HOST, port=port, latency=args.latency / 1000),
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        server.stdout.readline()
+        disconnect_all()
+        connect(host="mongomock://localhost", db="benchmark", alias="admin-db")
+        OutboxEmailDocument.drop_collection()
+        asyncio.run(main(args, port))
+    finally:
+        server.stdin.close()
+        server.wait()
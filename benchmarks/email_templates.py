@@ -0,0 +1,90 @@
+"""
+Renders the personalized new meeting email for many recipients.
+
+  compile each   a Jinja2 template compiled from source for every message
+  no cache       compiled once, the meeting details rendered for every message
+  registry       `TemplateRegistry.render_each`, details rendered once with
+                 `render_shared`, what send_new_meeting_email does
+
+    python benchmarks/email_templates.py --recipients 10000
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT.parent))
+
+from markupsafe import Markup  # noqa: E402
+
+from backend.main.email_handler.email_templates import (  # noqa: E402
+    TEMPLATES_DIR,
+    TemplateRegistry,
+)
+
+DETAILS = {
+    "start": datetime(2021, 3, 20, 18, 0),
+    "end": datetime(2021, 3, 20, 19, 0),
+    "topic": "Graph coloring",
+    "zoom_link": "https://zoom.us/j/123456789",
+    "password": "abc123",
+    "miro_link": "https://miro.com/app/board/o9J_123",
+    "session_level": "junior_a",
+}
+
+
+def recipients(count: int):
+    return [
+        {"guardian_name": f"Guardian {i}", "student_names": [f"Ann {i}", f"Bo {i}"]}
+        for i in range(count)
+    ]
+
+
+def compile_each(people):
+    environment = TemplateRegistry().environment
+    source = TEMPLATES_DIR.joinpath("new_meeting.html").read_text()
+    details = TEMPLATES_DIR.joinpath("meeting_details.html").read_text()
+    for person in people:
+        shared = environment.from_string(details).render(DETAILS)
+        environment.from_string(source).render(person, meeting_details=shared)
+
+
+def no_cache(people):
+    registry = TemplateRegistry().load()
+    for person in people:
+        details = Markup(registry.render("meeting_details.html", **DETAILS))
+        registry.render("new_meeting.html", meeting_details=details, **person)
+
+
+def with_registry(people):
+    registry = TemplateRegistry().load()
+    details = registry.render_shared("meeting_details.html", **DETAILS)
+    for _ in registry.render_each("new_meeting.html", people, meeting_details=details):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--recipients", type=int, default=10000)
+    args = parser.parse_args()
+
+    people = recipients(args.recipients)
+    print(f"{'renderer':>13} {'seconds':>8} {'us/msg':>8} {'msg/s':>8}")
+    # compiling is slow enough that a tenth of the messages shows the rate,
+    # its seconds are scaled up to all of them
+    runs = [
+        ("compile each", compile_each, people[: max(1, len(people) // 10)]),
+        ("no cache", no_cache, people),
+        ("registry", with_registry, people),
+    ]
+    for name, render, batch in runs:
+        start = time.perf_counter()
+        render(batch)
+        elapsed = time.perf_counter() - start
+        per_message = elapsed / len(batch)
+        print(
+            f"{name:>13} {elapsed * len(people) / len(batch):>8.2f}"
+            f" {per_message * 1e6:>8.1f} {1 / per_message:>8.0f}"
+        )
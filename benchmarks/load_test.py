@@ -0,0 +1,103 @@
+"""
+Measures the throughput of a running server under concurrent requests.
+
+Example, comparing a single worker before and after a change:
+
+    python benchmarks/load_test.py \\
+        --url http://127.0.0.1:9000/student/get_meetings \\
+        --method POST --json '{"session_levels": ["junior_a", "junior_b"]}' \\
+        --token <student access token> --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def measure(
+    url: str,
+    method: str = "GET",
+    body=None,
+    token: str = None,
+    requests: int = 1000,
+    concurrency: int = 50,
+    timeout: float = 30.0,
+) -> dict:
+    headers = {}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(headers=headers, timeout=timeout) as client:
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, url, json=body)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    stats = {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": requests / elapsed,
+        "p50": statistics.median(latencies),
+    }
+    for pct in (95, 99):
+        stats[f"p{pct}"] = latencies[
+            min(len(latencies) - 1, int(len(latencies) * pct / 100))
+        ]
+    return stats
+
+
+def report(stats: dict):
+    print(f"requests:    {stats['requests']} ({stats['errors']} errors)")
+    print(f"concurrency: {stats['concurrency']}")
+    print(f"elapsed:     {stats['elapsed']:.2f} s")
+    print(f"throughput:  {stats['throughput']:.1f} req/s")
+    for pct in ("p50", "p95", "p99"):
+        print(f"latency {pct}: {stats[pct] * 1000:.1f} ms")
+
+
+async def run(args):
+    body = json.loads(args.json) if args.json else None
+    report(
+        await measure(
+            args.url,
+            args.method,
+            body,
+            args.token,
+            args.requests,
+            args.concurrency,
+            args.timeout,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--json", default=None, help="JSON request body")
+    parser.add_argument("--token", default=None, help="bearer access token")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(run(parser.parse_args()))
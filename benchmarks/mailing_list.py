@@ -0,0 +1,139 @@
+"""
+Builds the recipient list of a new meeting email for one session level.
+
+  profiles      the profiles on the list with their guardians, then their
+                students with one `$in` query, what send_new_meeting_email did
+  materialized  `mailing_list_repo.get_recipients`, one (level, email) index range
+
+Half of the families are on the measured level (mongomock unless --mongo-uri
+is given):
+
+    python benchmarks/mailing_list.py --families 5000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT.parent))
+
+from mongoengine import connect, disconnect_all  # noqa: E402
+
+from backend.main.db.docs.mailing_list_doc import (  # noqa: E402
+    MailingListRecipientDocument,
+)
+from backend.main.db.docs.student_doc import StudentDocument  # noqa: E402
+from backend.main.db.docs.student_profile_doc import (  # noqa: E402
+    StudentProfileDocument,
+)
+from backend.main.db.repositories import mailing_list_repo  # noqa: E402
+from backend.main.db.repositories.async_collection import (  # noqa: E402
+    clear_databases,
+    get_collection,
+    register_database,
+)
+from backend.main.db.repositories.student_repo import (  # noqa: E402
+    get_students_by_ids,
+)
+
+LEVELS = ["junior_a", "junior_b"]
+
+
+async def populate(families: int):
+    students = get_collection(StudentDocument)
+    profiles = get_collection(StudentProfileDocument)
+    for start in range(0, families, 500):
+        batch = range(start, min(start + 500, families))
+        result = await students.insert_many(
+            [
+                {"first_name": f"{name} {i}", "last_name": "L", "age": 10}
+                for i in batch
+                for name in ("Ann", "Bo")
+            ]
+        )
+        ids = result.inserted_ids
+        await profiles.insert_many(
+            [
+                {
+                    "uuid": uuid4(),
+                    "email": f"family{i}@email.com",
+                    "guardians": [
+                        {
+                            "first_name": f"Guardian {i}",
+                            "last_name": "L",
+                            "email": f"family{i}@email.com",
+                        },
+                        {
+                            "first_name": f"Other {i}",
+                            "last_name": "L",
+                            "email": f"other{i}@email.com",
+                        },
+                    ],
+                    "students": ids[2 * n : 2 * n + 2],  # noqa: E203
+                    "mailing_lists": [LEVELS[i % 2]],
+                }
+                for n, i in enumerate(batch)
+            ]
+        )
+    await mailing_list_repo.rebuild()
+
+
+async def from_profiles(level: str):
+    cursor = get_collection(StudentProfileDocument).find(
+        {"mailing_lists": level}, {"email": 1, "guardians": 1, "students": 1}
+    )
+    profiles = await cursor.to_list(None)
+    students = await get_students_by_ids(
+        [sid for profile in profiles for sid in profile.get("students", [])],
+        ["first_name"],
+    )
+    return [
+        {
+            "email": profile["email"],
+            "guardian_name": profile["guardians"][0].get("first_name"),
+            "student_names": [
+                students[str(sid)]["first_name"] for sid in profile["students"]
+            ],
+        }
+        for profile in profiles
+    ]
+
+
+async def main(args):
+    if args.mongo_uri:
+        import motor.motor_asyncio
+
+        client = motor.motor_asyncio.AsyncIOMotorClient(args.mongo_uri)
+        register_database("student-db", client["mailing_list_benchmark"])
+    for document in (
+        StudentDocument,
+        StudentProfileDocument,
+        MailingListRecipientDocument,
+    ):
+        await get_collection(document).delete_many({})
+    await populate(args.families)
+
+    print(f"{'lookup':>12} {'recipients':>10} {'ms':>8}")
+    runs = {"profiles": from_profiles, "materialized": mailing_list_repo.get_recipients}
+    for name, lookup in runs.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            recipients = await lookup(LEVELS[0])
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{name:>12} {len(recipients):>10} {elapsed * 1000:>8.1f}")
+    clear_databases()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--families", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mongo-uri", help="real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    disconnect_all()
+    connect(host="mongomock://localhost", db="benchmark", alias="student-db")
+    asyncio.run(main(args))
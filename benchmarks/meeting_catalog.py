@@ -0,0 +1,126 @@
+"""
+Serves bursts of identical student/get_meetings listings at once.
+
+  per request   the meetings query and their encoding for every request, what
+                get_meetings did
+  single-flight `MeetingCatalog.get` without its cache, requests that arrive
+                together share one query and encoding, only the registrations
+                are added per family
+  cached        `MeetingCatalog.get` as get_meetings uses it, from the cache
+                and refreshed in the background after the soft TTL
+
+Every request of a burst asks for the same levels (mongomock unless
+--mongo-uri is given):
+
+    python benchmarks/meeting_catalog.py --meetings 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT.parent))
+
+from bson import ObjectId  # noqa: E402
+from mongoengine import connect, disconnect_all  # noqa: E402
+
+from backend.main.db.docs.meeting_doc import MeetingDocument  # noqa: E402
+from backend.main.db.repositories import meeting_repo  # noqa: E402
+from backend.main.db.repositories.async_collection import (  # noqa: E402
+    clear_databases,
+    get_collection,
+    register_database,
+)
+from backend.main.src.meeting_catalog import (  # noqa: E402
+    MeetingCatalog,
+    load_catalog,
+)
+
+LEVELS = ["junior_a", "junior_b"]
+STUDENTS = [
+    {"_id": ObjectId(), "first_name": name, "last_name": "L"} for name in ("Ann", "Bo")
+]
+
+
+async def populate(count: int):
+    start = datetime(2021, 3, 20, 18, 0)
+    await get_collection(MeetingDocument).insert_many(
+        [
+            {
+                "uuid": uuid4(),
+                "date_and_time": start + timedelta(days=i),
+                "duration": 60,
+                "zoom_link": f"https://zoom.us/j/{i}",
+                "topic": f"Topic {i}",
+                "session_level": LEVELS[i % 2],
+                "miro_link": f"https://miro.com/app/board/{i}",
+                "password": "abc123",
+                "students": [{"student_id": str(ObjectId())} for _ in range(20)],
+                "updated_seq": i,
+                "updated_at": start,
+            }
+            for i in range(count)
+        ]
+    )
+
+
+async def per_request():
+    # load_catalog is the query and encoding get_meetings did for each request
+    catalog = await load_catalog(LEVELS)
+    return catalog.listing(STUDENTS)
+
+
+def from_catalog(catalog: MeetingCatalog):
+    async def listing():
+        catalog_, _, _ = await catalog.get(LEVELS)
+        return catalog_.listing(STUDENTS)
+
+    return listing
+
+
+async def main(args):
+    if args.mongo_uri:
+        import motor.motor_asyncio
+
+        client = motor.motor_asyncio.AsyncIOMotorClient(args.mongo_uri)
+        register_database("meeting-db", client["meeting_catalog_benchmark"])
+    await meeting_repo.meetings_collection().delete_many({})
+    await populate(args.meetings)
+
+    uncached = MeetingCatalog(soft_ttl=0, hard_ttl=0)
+    cached = MeetingCatalog()
+    print(f"{'listing':>13} {'requests/s':>10} {'ms/burst':>9} {'queries':>8}")
+    for name, listing, catalog in (
+        ("per request", per_request, None),
+        ("single-flight", from_catalog(uncached), uncached),
+        ("cached", from_catalog(cached), cached),
+    ):
+        start = time.perf_counter()
+        for _ in range(args.bursts):
+            await asyncio.gather(*(listing() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        requests = args.bursts * args.concurrency
+        queries = requests if catalog is None else catalog.flight.runs
+        print(
+            f"{name:>13} {requests / elapsed:>10.0f}"
+            f" {elapsed / args.bursts * 1000:>9.1f} {queries:>8}"
+        )
+    print("coalescing", uncached.flight.stats())
+    clear_databases()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--meetings", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--mongo-uri", help="real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    disconnect_all()
+    connect(host="mongomock://localhost", db="benchmark", alias="meeting-db")
+    asyncio.run(main(args))
@@ -0,0 +1,88 @@
+"""
+Measures cold start: import time of each app and time to its first response.
+
+Every run is a fresh interpreter, like a restarted dyno. The first request is
+sent in-process to a route that needs no database, so no server or MongoDB is
+required and the numbers can be tracked in CI (--json prints one line):
+
+    python benchmarks/startup_time.py --runs 10
+    python benchmarks/startup_time.py --json >> startup.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+APPS = {
+    "main": "backend.main.src.app",
+    "auth": "backend.auth.main",
+}
+
+# runs in the child, the client library is imported before the clock starts
+CHILD = """
+import asyncio, importlib, json, sys, time
+import httpx
+
+start = time.perf_counter()
+app = importlib.import_module(sys.argv[1]).app
+imported = time.perf_counter()
+
+
+async def first_request():
+    async with httpx.AsyncClient(app=app, base_url="http://startup") as client:
+        return await client.get(sys.argv[2])
+
+
+status = asyncio.run(first_request()).status_code
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_request": done - start, "status": status}))
+"""
+
+
+def measure(module: str, path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, module, path],
+        cwd=ROOT.parent,
+        env={**os.environ, "PYTHONPATH": str(ROOT.parent)},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    if result["status"] != 200:
+        raise RuntimeError(f"{module} answered {path} with {result['status']}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--apps", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--path", default="/openapi.json")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print one JSON line")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.apps:
+        runs = [measure(APPS[name], args.path) for _ in range(args.runs)]
+        results[name] = {
+            "import_ms": statistics.median(r["import"] for r in runs) * 1000,
+            "first_request_ms": statistics.median(r["first_request"] for r in runs)
+            * 1000,
+        }
+
+    if args.json:
+        print(json.dumps({"runs": args.runs, "path": args.path, "apps": results}))
+    else:
+        print(f"median of {args.runs} fresh interpreters, first request {args.path}")
+        print(f"{'app':>6} {'import ms':>10} {'first request ms':>17}")
+        for name, result in results.items():
+            print(
+                f"{name:>6} {result['import_ms']:>10.1f}"
+                f" {result['first_request_ms']:>17.1f}"
+            )
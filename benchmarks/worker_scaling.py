@@ -0,0 +1,100 @@
+"""
+Measures how throughput scales with the number of gunicorn worker processes.
+
+Starts the app with gunicorn.conf.py once per worker count and load tests it.
+The apps connect to MongoDB on startup, so db-config.toml must point at a
+reachable cluster. By default the cached OpenAPI schema is requested, which
+measures the serving stack alone; pass a real route to include the database:
+
+    python benchmarks/worker_scaling.py --workers 1 2 4
+    python benchmarks/worker_scaling.py --workers 1 2 4 \\
+        --path /student/get_meetings --method POST \\
+        --json '{"session_levels": ["junior_a"]}' --token <student access token>
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from load_test import measure
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def wait_until_ready(url: str, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server not ready after {timeout} seconds")
+
+
+def run_with_workers(workers: int, args) -> dict:
+    env = {
+        **os.environ,
+        "APP_MODULE": args.app,
+        "PORT": str(args.port),
+        "WEB_CONCURRENCY": str(workers),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.port}{args.path}"
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.port}/openapi.json", server)
+        body = json.loads(args.json) if args.json else None
+        # warm up every worker before measuring
+        asyncio.run(measure(url, args.method, body, args.token, 200, args.concurrency))
+        return asyncio.run(
+            measure(
+                url,
+                args.method,
+                body,
+                args.token,
+                args.requests,
+                args.concurrency,
+            )
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--app", default="backend.main.src.app:app")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--path", default="/openapi.json")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--json", default=None, help="JSON request body")
+    parser.add_argument("--token", default=None, help="bearer access token")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.requests} requests to {args.path}")
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        stats = run_with_workers(workers, args)
+        baseline = baseline or stats["throughput"]
+        print(
+            f"{workers:>8} {stats['throughput']:>10.1f} {stats['p50'] * 1000:>8.1f}"
+            f" {stats['p99'] * 1000:>8.1f} {stats['throughput'] / baseline:>7.2f}x"
+        )
@@ -1,44 +1,80 @@
-from pathlib import Path
+from typing import Dict
 
-from mongoengine import connect
-import toml
+from mongoengine import connect, disconnect
 
 from backend.auth.db.main import connect_to_db
+from backend.main.db.docs.broadcast_doc import BroadcastDocument
+from backend.main.db.docs.idempotency_doc import IdempotencyRecordDocument
+from backend.main.db.docs.job_doc import JobDocument
+from backend.main.db.docs.lease_doc import LeaseDocument
+from backend.main.db.docs.mailing_list_doc import MailingListRecipientDocument
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.docs.outbox_doc import OutboxEmailDocument
+from backend.main.db.docs.student_doc import StudentDocument
+from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.docs.sync_docs import MeetingTombstoneDocument, SequenceDocument
+from backend.main.db.repositories.async_collection import (
+    clear_databases,
+    register_database,
+)
+from backend.settings import settings
+from backend.mongo_clients import (
+    cluster_uri,
+    client_options,
+    close_clients,
+    get_async_client,
+)
 
-# get the config file path
-CONFIG_PATH = Path(__file__).resolve().parent.joinpath("auth/db-config.toml")
-print("Using CONFIG_PATH:", CONFIG_PATH)
 
-config = toml.load(str(CONFIG_PATH))
-
-db_username = config["atlas-username"]
-db_password = config["atlas-password"]
-db_uri = config["connection-uri"]
-auth_db = config["auth-db"]
-meeting_db = config["meeting-db"]
-student_db = config["student-db"]
+def db_aliases() -> Dict[str, str]:
+    """mongoengine alias -> database name, every alias lives on the same cluster"""
+    return {
+        "student-db": settings["student-db"],
+        "meeting-db": settings["meeting-db"],
+        "admin-db": settings.get("admin-db", "admin_db"),
+    }
 
 
 def connect_to_mongodb():
-    connect(
-        alias="student-db",
-        db=student_db,
-        host=db_uri.format(
-            username=db_username, password=db_password, database=student_db
-        ),
-        uuidRepresentation="standard",
-    )
-    connect(
-        alias="meeting-db",
-        db=meeting_db,
-        host=db_uri.format(
-            username=db_username, password=db_password, database=meeting_db
-        ),
-        uuidRepresentation="standard",
-    )
+    # identical host and options for every alias, so mongoengine shares one
+    # MongoClient (and one connection pool) between them
+    for alias, db in db_aliases().items():
+        connect(alias=alias, db=db, host=cluster_uri(), **client_options("mongoengine"))
+    # the repositories query through Motor, so mongoengine never creates the
+    # indexes lazily, create them up front instead
+    for document in (
+        BroadcastDocument,
+        IdempotencyRecordDocument,
+        JobDocument,
+        LeaseDocument,
+        MailingListRecipientDocument,
+        MeetingDocument,
+        MeetingTombstoneDocument,
+        OutboxEmailDocument,
+        SequenceDocument,
+        StudentDocument,
+        StudentProfileDocument,
+    ):
+        document.ensure_indexes()
+
+
+def connect_to_async_mongodb():
+    """
+    Registers the shared Motor client with the repositories in `main/db/repositories`.
+    Must be called from inside the running event loop, e.g. a startup event
+    """
+    client = get_async_client(cluster_uri())
+    for alias, db in db_aliases().items():
+        register_database(alias, client[db])
+
+
+def disconnect_from_mongodb():
+    """Closes the mongoengine and Motor connections opened by the functions above"""
+    clear_databases()
+    close_clients()
+    for alias in db_aliases():
+        disconnect(alias)
 
 
 def connect_to_auth_db():
-    connect_to_db(
-        db_uri.format(username=db_username, password=db_password, database=auth_db)
-    )
+    connect_to_db(cluster_uri(settings["auth-db"]))
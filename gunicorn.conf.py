@@ -0,0 +1,67 @@
+"""
+Production server settings, gunicorn reads this file from the working directory:
+
+    gunicorn backend.main.src.app:app      # or set APP_MODULE, see Procfile
+
+Settings come from the environment:
+    APP_MODULE        the ASGI app to serve (default: the main app), the auth
+                      server runs as its own deployment with
+                      APP_MODULE=backend.auth.main:app
+    PORT              port to listen on (default: 9000)
+    WEB_CONCURRENCY   number of worker processes (default: 2 * cores + 1)
+    GRACEFUL_TIMEOUT  seconds workers get to drain on shutdown (default: 25)
+"""
+import importlib.util
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _register_package():
+    # the code imports itself as `backend`, make that work whatever the
+    # checkout is called (e.g. /app on Heroku)
+    if "backend" in sys.modules:
+        return
+    if ROOT.name == "backend":
+        sys.path.insert(0, str(ROOT.parent))
+        return
+    spec = importlib.util.spec_from_file_location(
+        "backend", ROOT.joinpath("__init__.py"), submodule_search_locations=[str(ROOT)]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["backend"] = module
+    spec.loader.exec_module(module)
+
+
+_register_package()
+
+wsgi_app = os.environ.get("APP_MODULE", "backend.main.src.app:app")
+bind = "0.0.0.0:" + os.environ.get("PORT", "9000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# import the app once in the master so the workers share its memory copy-on-write.
+# Nothing may open a connection at import time: the apps connect to MongoDB in
+# their startup event, which every worker runs for itself after the fork
+preload_app = True
+
+# on SIGTERM uvicorn stops accepting connections and waits for in-flight requests,
+# including their BackgroundTasks (e.g. emails), before running the shutdown event.
+# Heroku sends SIGKILL 30 seconds after SIGTERM, so stay below that
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 25))
+timeout = 60
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    server.log.info("worker %s forked, connecting to MongoDB in startup", worker.pid)
+
+
+def worker_exit(server, worker):
+    server.log.info("worker %s exited", worker.pid)
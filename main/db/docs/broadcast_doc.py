@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from mongoengine import DateTimeField, Document, IntField, StringField
+
+
+class BroadcastDocument(Document):
+    """
+    An email to a whole mailing list, sent in waves of `wave_size` emails
+    `interval_seconds` apart rather than all at once, so the families do not
+    all open the site in the same minute.
+    The emails are OutboxEmailDocuments, HELD until their wave is released
+    """
+
+    subject = StringField(required=True)
+    total = IntField(required=True)
+    wave_size = IntField(required=True)
+    waves = IntField(required=True)
+    interval_seconds = IntField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    # the wave released next and when, unset once every wave is out
+    next_wave = IntField(default=0)
+    next_wave_at = DateTimeField(required=False)
+    # how many times the waves were pushed back because the API was busy
+    postponed = IntField(default=0)
+    finished_at = DateTimeField(required=False)
+
+    meta = {
+        "db_alias": "admin-db",
+        "indexes": [{"fields": ["next_wave_at"], "sparse": True}, "-created_at"],
+    }
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from mongoengine import (
+    BinaryField,
+    DateTimeField,
+    Document,
+    IntField,
+    ListField,
+    StringField,
+)
+
+# state of an idempotent request
+PENDING = "pending"
+DONE = "done"
+
+
+class IdempotencyRecordDocument(Document):
+    """
+    The first response to a request sent with an `Idempotency-Key` header,
+    replayed to retries of the same request, see `main/src/idempotency.py`.
+    `key` combines the header with the caller and the route, `fingerprint`
+    is a hash of the request body so a key reused for another request is
+    refused rather than answered with the wrong response
+    """
+
+    key = StringField(required=True)
+    fingerprint = StringField(required=True)
+    status = StringField(required=True, default=PENDING, choices=[PENDING, DONE])
+    # the process running the request owns a pending record until then,
+    # an expired one means it died and a retry may run the request again
+    lease_expires_at = DateTimeField(required=False)
+    status_code = IntField(required=False)
+    # [name, value] pairs
+    headers = ListField(ListField(StringField()), required=False)
+    body = BinaryField(required=False)
+    created_at = DateTimeField(default=datetime.utcnow)
+    expires_at = DateTimeField(required=True)
+
+    meta = {
+        "db_alias": "admin-db",
+        "indexes": [
+            # duplicates racing to insert the pending record, only one wins
+            {"fields": ["key"], "unique": True},
+            {"fields": ["expires_at"], "expireAfterSeconds": 0},
+        ],
+    }
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from mongoengine import (
+    DateTimeField,
+    DictField,
+    Document,
+    IntField,
+    StringField,
+)
+
+# status of a background job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobDocument(Document):
+    """
+    Work deferred to the job worker (see `main/jobs/worker.py`), e.g. a mailing
+    list rebuild. `name` picks the handler, which is called with `payload`
+    """
+
+    name = StringField(required=True)
+    payload = DictField()
+    status = StringField(
+        required=True, default=QUEUED, choices=[QUEUED, RUNNING, DONE, FAILED]
+    )
+    # higher runs first among the jobs that are due
+    priority = IntField(default=0)
+    # not started before this time, pushed back after every failed attempt
+    run_at = DateTimeField(default=datetime.utcnow)
+    attempts = IntField(default=0)
+    max_attempts = IntField(default=5)
+    created_at = DateTimeField(default=datetime.utcnow)
+    # a worker that claimed the job owns it until then, it renews the lease
+    # while the job runs, so an expired one means the worker died
+    lease_expires_at = DateTimeField(required=False)
+    worker = StringField(required=False)
+    started_at = DateTimeField(required=False)
+    finished_at = DateTimeField(required=False)
+    # set once the job is done or has failed, MongoDB removes it then
+    expires_at = DateTimeField(required=False)
+    # milliseconds from run_at to the start of the last attempt, and of the run
+    wait_ms = IntField(required=False)
+    run_ms = IntField(required=False)
+    result = DictField(required=False)
+    last_error = StringField(required=False)
+
+    meta = {
+        "db_alias": "admin-db",
+        "indexes": [
+            ("status", "-priority", "run_at"),
+            ("status", "lease_expires_at"),
+            ("status", "finished_at"),
+            {"fields": ["expires_at"], "expireAfterSeconds": 0},
+        ],
+    }
@@ -0,0 +1,20 @@
+from mongoengine import DateTimeField, Document, StringField
+
+
+class LeaseDocument(Document):
+    """
+    Ownership of a job that only one process should run at a time, e.g. the
+    meeting reminders. The owner renews it before `expires_at`, once that has
+    passed any other process may take it over
+    """
+
+    name = StringField(required=True)
+    owner = StringField(required=True)
+    expires_at = DateTimeField(required=True)
+
+    meta = {
+        "db_alias": "admin-db",
+        # two processes taking a free lease at once would both insert it,
+        # the unique index makes one of them fail
+        "indexes": [{"fields": ["name"], "unique": True}],
+    }
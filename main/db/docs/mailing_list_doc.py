@@ -0,0 +1,22 @@
+from mongoengine import Document, ListField, StringField, UUIDField
+
+
+class MailingListRecipientDocument(Document):
+    """
+    One address on one session level's mailing list, kept current from the
+    StudentProfileDocuments by `mailing_list_repo` so that announcing a meeting
+    reads a single index range instead of every profile and its students
+    """
+
+    level = StringField(required=True)
+    # lower case, an address on several profiles is one recipient
+    email = StringField(required=True)
+    profile_uuid = UUIDField(required=True)
+    # the guardian with this address, or the profile's first guardian
+    name = StringField(required=False)
+    student_names = ListField(StringField())
+
+    meta = {
+        "db_alias": "student-db",
+        "indexes": [("level", "email"), "profile_uuid"],
+    }
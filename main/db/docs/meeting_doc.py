@@ -37,11 +37,24 @@ class MeetingDocument(Document):
     student_notes = StringField(reguired=False)
     materials_uploaded = BooleanField(required=False)
     materials_object_name = StringField(required=False)
+    # when the reminder emails were queued, unset again if the meeting moves
+    reminder_sent_at = DateTimeField(required=False)
+    # set from a counter on every change clients can see, `since` queries
+    # return the meetings with a higher one
+    updated_seq = IntField(required=False)
+    updated_at = DateTimeField(required=False)
 
     meta = {
         "query_class": MeetingQuerySet,
         "db_alias": "meeting-db",
-        "indexes": ["session_level"],
+        # date_and_time finds the meetings that are about to start,
+        # students.student_id the meetings a student is registered for
+        "indexes": [
+            ("session_level", "date_and_time"),
+            "date_and_time",
+            "updated_seq",
+            "students.student_id",
+        ],
     }
 
     def student_dict(self):
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from mongoengine import (
+    Document,
+    DateTimeField,
+    IntField,
+    ListField,
+    ObjectIdField,
+    StringField,
+)
+
+# delivery status of an outbox email
+# part of a broadcast wave that has not been released yet, see `BroadcastDocument`
+HELD = "held"
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class OutboxEmailDocument(Document):
+    """
+    An email waiting to be sent, or the record of one that was.
+    The routes insert these, `OutboxWorker` sends them
+    """
+
+    receivers = ListField(StringField(), required=True)
+    subject = StringField(required=True)
+    body = StringField(required=True)
+    subtype = StringField(default="html")
+    status = StringField(
+        required=True,
+        default=QUEUED,
+        choices=[HELD, QUEUED, SENDING, SENT, FAILED],
+    )
+    attempts = IntField(default=0)
+    created_at = DateTimeField(default=datetime.utcnow)
+    # not sent before this time, pushed back after every failed attempt
+    next_attempt_at = DateTimeField(default=datetime.utcnow)
+    # a worker that claimed the email owns it until then, after that another
+    # worker may take it over (e.g. the first one was killed mid batch)
+    lease_expires_at = DateTimeField(required=False)
+    claim = StringField(required=False)
+    sent_at = DateTimeField(required=False)
+    # set once the email is sent or has failed, MongoDB removes it then
+    expires_at = DateTimeField(required=False)
+    last_error = StringField(required=False)
+    # receivers the server refused while accepting the others
+    refused = ListField(StringField(), required=False)
+    # set on emails that must be sent at most once, see `enqueue_keyed_emails`
+    key = StringField(required=False)
+    broadcast_id = ObjectIdField(required=False)
+    wave = IntField(required=False)
+
+    meta = {
+        "db_alias": "admin-db",
+        "indexes": [
+            ("status", "next_attempt_at"),
+            ("status", "lease_expires_at"),
+            {"fields": ["key"], "unique": True, "sparse": True},
+            {"fields": ["broadcast_id", "wave"], "sparse": True},
+            {"fields": ["expires_at"], "expireAfterSeconds": 0},
+        ],
+    }
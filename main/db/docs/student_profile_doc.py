@@ -5,6 +5,7 @@ from mongoengine import (
     QuerySet,
     UUIDField,
     ReferenceField,
+    BooleanField,
 )
 
 from backend.main.db.models.student_profile_model import (
@@ -46,11 +47,13 @@ class StudentProfileDocument(Document):
     students = ListField(ReferenceField(StudentDocument))
     guardians = ListField(required=True)
     mailing_lists = ListField(required=False)
+    email_verified = BooleanField(default=False)
 
     meta = {
         "query_class": StudentProfileQuerySet,
         "db_alias": "student-db",
-        "indexes": ["email", "uuid"],
+        # mailing_lists is an array, so its index is multikey
+        "indexes": ["email", "uuid", "mailing_lists"],
     }
 
     def dict(self):
@@ -61,4 +64,5 @@ class StudentProfileDocument(Document):
             "student_list": students,
             "guardians": self.guardians,
             "mailing_lists": self.mailing_lists,
+            "email_verified": self.email_verified,
         }
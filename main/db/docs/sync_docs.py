@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from mongoengine import DateTimeField, Document, IntField, StringField, UUIDField
+
+
+class SequenceDocument(Document):
+    """A counter, `meeting_repo.next_seq` hands out `updated_seq` values from it"""
+
+    name = StringField(required=True)
+    value = IntField(default=0)
+
+    meta = {
+        "db_alias": "meeting-db",
+        "indexes": [{"fields": ["name"], "unique": True}],
+    }
+
+
+class MeetingTombstoneDocument(Document):
+    """
+    Left behind by a deleted meeting so that clients syncing with `since`
+    learn about the deletion. Kept for good, they are tiny and rare
+    """
+
+    uuid = UUIDField(required=True)
+    deleted_seq = IntField(required=True)
+    deleted_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        "db_alias": "meeting-db",
+        "indexes": ["deleted_seq"],
+    }
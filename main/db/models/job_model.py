@@ -0,0 +1,14 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class JobRequest(BaseModel):
+    name: str = Field()
+    payload: dict = Field(default={})
+    # higher runs first
+    priority: int = Field(default=0)
+    # UTC, now when not given
+    run_at: Optional[datetime] = Field(default=None)
+    max_attempts: int = Field(default=5, gt=0, le=20)
@@ -2,7 +2,7 @@ from typing import Optional, List
 from datetime import datetime, date
 from uuid import uuid4
 
-from pydantic import Field, BaseModel, EmailStr, UUID4
+from pydantic import Field, BaseModel, EmailStr, UUID4, conint, conlist
 
 from backend.main.db.mixins import SessionLevel, PydanticObjectId
 from backend.main.db.models.student_profile_model import Guardian
@@ -14,6 +14,10 @@ class StudentMeetingRegistration(BaseModel):
     registered: bool
 
 
+class StudentMeetingRegistrationBatch(BaseModel):
+    registrations: conlist(StudentMeetingRegistration, min_items=1, max_items=200)
+
+
 class StudentMeetingAttendance(BaseModel):
     meeting_id: UUID4 = Field()
     student_id: PydanticObjectId = Field()
@@ -58,3 +62,31 @@ class MeetingIdModel(BaseModel):
 class MeetingSearchModel(BaseModel):
     session_levels: Optional[List[SessionLevel]]
     dates: Optional[List[date]]
+
+
+class MaterialsUploadStart(BaseModel):
+    meeting_id: UUID4 = Field()
+    object_name: str = Field()
+    # S3 parts are at least 5 MiB, except for the last one
+    part_count: int = Field(gt=0, le=10000)
+    content_type: Optional[str] = Field(default=None)
+
+
+class MaterialsUpload(BaseModel):
+    meeting_id: UUID4 = Field()
+    object_name: str = Field()
+    upload_id: str = Field()
+
+
+class MaterialsUploadParts(MaterialsUpload):
+    part_numbers: List[conint(ge=1, le=10000)] = Field()
+
+
+class UploadedPart(BaseModel):
+    part_number: int = Field(ge=1, le=10000)
+    # the ETag header S3 returned for the part
+    etag: str = Field()
+
+
+class MaterialsUploadComplete(MaterialsUpload):
+    parts: List[UploadedPart] = Field()
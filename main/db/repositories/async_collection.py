@@ -0,0 +1,103 @@
+from typing import Dict, Type
+
+import motor.motor_asyncio
+from mongoengine import Document
+from starlette.concurrency import run_in_threadpool
+
+# Motor databases by mongoengine alias, filled in by `register_database`
+_databases: Dict[str, motor.motor_asyncio.AsyncIOMotorDatabase] = {}
+
+
+def register_database(alias: str, database: motor.motor_asyncio.AsyncIOMotorDatabase):
+    """Routes repository queries for documents with `db_alias` `alias` to Motor"""
+    _databases[alias] = database
+
+
+def clear_databases():
+    _databases.clear()
+
+
+def get_collection(document: Type[Document]):
+    """
+    Returns an async collection for `document`.
+    Uses Motor when the document's alias has been registered, otherwise the
+    mongoengine connection (e.g. mongomock in the tests) is run in the threadpool
+    so the event loop is never blocked either way
+    """
+    alias = document._meta["db_alias"]
+    if alias in _databases:
+        return _databases[alias][document._get_collection_name()]
+    return ThreadedCollection(document._get_collection())
+
+
+class ThreadedCursor:
+    """The subset of `AsyncIOMotorCursor` used by the repositories"""
+
+    def __init__(self, open_cursor):
+        # the pymongo cursor is opened in the threadpool, `aggregate` runs right away
+        self._open_cursor = open_cursor
+        self._cursor = None
+        self._modifiers = []
+        self._buffer = []
+
+    def sort(self, *args, **kwargs):
+        self._modifiers.append(lambda cursor: cursor.sort(*args, **kwargs))
+        return self
+
+    def skip(self, count: int):
+        self._modifiers.append(lambda cursor: cursor.skip(count))
+        return self
+
+    def limit(self, count: int):
+        self._modifiers.append(lambda cursor: cursor.limit(count))
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    async def to_list(self, length=None):
+        def take():
+            if self._cursor is None:
+                self._cursor = self._open_cursor()
+                for modify in self._modifiers:
+                    self._cursor = modify(self._cursor)
+            if length is None:
+                return list(self._cursor)
+            return [doc for _, doc in zip(range(length), self._cursor)]
+
+        return await run_in_threadpool(take)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            self._buffer = await self.to_list(100)
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.pop(0)
+
+
+class ThreadedCollection:
+    """Wraps a synchronous pymongo collection with Motor's async interface"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    @property
+    def name(self):
+        return self._collection.name
+
+    def find(self, *args, **kwargs):
+        return ThreadedCursor(lambda: self._collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return ThreadedCursor(lambda: self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def run(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+
+        return run
@@ -0,0 +1,139 @@
+import math
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+
+from backend.main.db.docs.broadcast_doc import BroadcastDocument
+from backend.main.db.docs.outbox_doc import HELD, QUEUED
+from backend.main.db.repositories import outbox_repo
+from backend.main.db.repositories.async_collection import get_collection
+
+
+def broadcasts_collection():
+    return get_collection(BroadcastDocument)
+
+
+def broadcast_dict(broadcast: dict) -> dict:
+    return {
+        "id": str(broadcast["_id"]),
+        "subject": broadcast["subject"],
+        "total": broadcast["total"],
+        "wave_size": broadcast["wave_size"],
+        "waves": broadcast["waves"],
+        "waves_released": broadcast.get("next_wave", 0),
+        "interval_seconds": broadcast["interval_seconds"],
+        "created_at": broadcast.get("created_at"),
+        "next_wave_at": broadcast.get("next_wave_at"),
+        "postponed": broadcast.get("postponed", 0),
+        "finished_at": broadcast.get("finished_at"),
+    }
+
+
+async def create_broadcast(
+    emails: List[dict],
+    wave_size: int,
+    window: timedelta,
+    now: Optional[datetime] = None,
+) -> dict:
+    """
+    Puts `emails` (arguments of `enqueue_email`) in the outbox as a broadcast.
+    The first wave is due right away and the last one `window` later,
+    two queries whatever the number of emails
+    """
+    now = now or datetime.utcnow()
+    waves = max(1, math.ceil(len(emails) / wave_size))
+    interval = window / (waves - 1) if waves > 1 else timedelta(0)
+    doc = BroadcastDocument(
+        subject=emails[0]["subject"] if emails else "",
+        total=len(emails),
+        wave_size=wave_size,
+        waves=waves,
+        interval_seconds=int(interval.total_seconds()),
+        created_at=now,
+        next_wave_at=now,
+    )
+    doc.validate()
+    son = doc.to_mongo().to_dict()
+    result = await broadcasts_collection().insert_one(son)
+    son["_id"] = result.inserted_id
+    await outbox_repo.enqueue_emails(
+        [
+            {
+                **email,
+                "status": HELD,
+                "broadcast_id": son["_id"],
+                "wave": i // wave_size,
+            }
+            for i, email in enumerate(emails)
+        ]
+    )
+    return son
+
+
+async def get_due_broadcasts(now: datetime, limit: int = 20) -> List[dict]:
+    cursor = broadcasts_collection().find({"next_wave_at": {"$lte": now}}).limit(limit)
+    return await cursor.to_list(limit)
+
+
+async def release_wave(broadcast: dict, now: Optional[datetime] = None) -> bool:
+    """
+    Queues the broadcast's next wave and schedules the one after it.
+    Releasing only touches HELD emails, so two workers releasing the same wave
+    queue it once, and only one of them moves the broadcast on
+    """
+    now = now or datetime.utcnow()
+    wave = broadcast.get("next_wave", 0)
+    await outbox_repo.outbox_collection().update_many(
+        {"broadcast_id": broadcast["_id"], "wave": wave, "status": HELD},
+        {"$set": {"status": QUEUED, "next_attempt_at": now}},
+    )
+    if wave + 1 < broadcast["waves"]:
+        update = {
+            "$set": {
+                "next_wave": wave + 1,
+                "next_wave_at": now + timedelta(seconds=broadcast["interval_seconds"]),
+            }
+        }
+    else:
+        update = {
+            "$set": {"next_wave": wave + 1, "finished_at": now},
+            "$unset": {"next_wave_at": ""},
+        }
+    result = await broadcasts_collection().update_one(
+        {"_id": broadcast["_id"], "next_wave": wave}, update
+    )
+    return result.modified_count > 0
+
+
+async def postpone(broadcast_ids: List[ObjectId], until: datetime):
+    """Pushes the next wave of the broadcasts back to `until`, the rest follow it"""
+    await broadcasts_collection().update_many(
+        {"_id": {"$in": broadcast_ids}, "next_wave_at": {"$lt": until}},
+        {"$set": {"next_wave_at": until}, "$inc": {"postponed": 1}},
+    )
+
+
+async def get_broadcast_progress(broadcast_id: ObjectId) -> Optional[dict]:
+    """The broadcast and how many of its emails are in each delivery status"""
+    broadcast = await broadcasts_collection().find_one({"_id": broadcast_id})
+    if broadcast is None:
+        return None
+    progress = broadcast_dict(broadcast)
+    progress["counts"] = await _status_counts(broadcast_id)
+    return progress
+
+
+async def get_recent_broadcasts(limit: int = 20) -> List[dict]:
+    cursor = broadcasts_collection().find().sort("created_at", -1).limit(limit)
+    return [broadcast_dict(broadcast) for broadcast in await cursor.to_list(limit)]
+
+
+async def _status_counts(broadcast_id: ObjectId) -> dict:
+    cursor = outbox_repo.outbox_collection().aggregate(
+        [
+            {"$match": {"broadcast_id": broadcast_id}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]
+    )
+    return {group["_id"]: group["count"] async for group in cursor}
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from backend.main.db.docs.idempotency_doc import (
+    DONE,
+    PENDING,
+    IdempotencyRecordDocument,
+)
+from backend.main.db.repositories.async_collection import get_collection
+
+
+def records_collection():
+    return get_collection(IdempotencyRecordDocument)
+
+
+async def claim(
+    key: str,
+    fingerprint: str,
+    lease: timedelta,
+    ttl: timedelta,
+    now: Optional[datetime] = None,
+) -> Optional[dict]:
+    """
+    Inserts the pending record for `key`, or takes over one whose lease
+    expired. None when this caller now runs the request, otherwise the
+    existing record: done with the response, or pending elsewhere.
+    One query when the key is new and one lookup when it is not
+    """
+    now = now or datetime.utcnow()
+    # until one of the two lands, the record may expire or be abandoned between
+    # the insert and the lookup, and then the next insert takes the key
+    while True:
+        try:
+            await records_collection().insert_one(
+                {
+                    "key": key,
+                    "fingerprint": fingerprint,
+                    "status": PENDING,
+                    "lease_expires_at": now + lease,
+                    "created_at": now,
+                    "expires_at": now + ttl,
+                }
+            )
+            return None
+        except DuplicateKeyError:
+            record = await records_collection().find_one({"key": key})
+        if record is not None:
+            break
+    if (
+        record["status"] == DONE
+        or record["fingerprint"] != fingerprint
+        or record["lease_expires_at"] > now
+    ):
+        return record
+    taken = await records_collection().find_one_and_update(
+        {"_id": record["_id"], "status": PENDING, "lease_expires_at": {"$lte": now}},
+        {"$set": {"lease_expires_at": now + lease}},
+        {"_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return None if taken is not None else record
+
+
+async def get_record(key: str) -> Optional[dict]:
+    return await records_collection().find_one({"key": key})
+
+
+async def complete(
+    key: str, status_code: int, headers: List[Tuple[str, str]], body: bytes
+):
+    await records_collection().update_one(
+        {"key": key},
+        {
+            "$set": {
+                "status": DONE,
+                "status_code": status_code,
+                "headers": [list(header) for header in headers],
+                "body": body,
+            },
+            "$unset": {"lease_expires_at": ""},
+        },
+    )
+
+
+async def abandon(key: str):
+    """Drops a pending record, the request failed and a retry should run it again"""
+    await records_collection().delete_one({"key": key, "status": PENDING})
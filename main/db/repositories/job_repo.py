@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from backend.main.db.docs.job_doc import DONE, FAILED, QUEUED, RUNNING, JobDocument
+from backend.main.db.repositories.async_collection import get_collection
+
+# how long done and failed jobs are kept
+RETENTION = timedelta(days=30)
+
+
+def jobs_collection():
+    return get_collection(JobDocument)
+
+
+async def enqueue(
+    name: str,
+    payload: Optional[dict] = None,
+    priority: int = 0,
+    run_at: Optional[datetime] = None,
+    max_attempts: int = 5,
+) -> ObjectId:
+    """Stores a job for the job worker, due at `run_at` (now by default)"""
+    doc = JobDocument(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=max_attempts,
+    )
+    doc.validate()
+    result = await jobs_collection().insert_one(doc.to_mongo().to_dict())
+    return result.inserted_id
+
+
+async def claim(
+    worker: str, lease: timedelta, now: Optional[datetime] = None
+) -> Optional[dict]:
+    """
+    The due job with the highest priority, oldest first among equals, now
+    owned by `worker`. A single find_one_and_update, so two workers never get
+    the same job, and it walks the (status, -priority, run_at) index
+    """
+    now = now or datetime.utcnow()
+    return await jobs_collection().find_one_and_update(
+        {"status": QUEUED, "run_at": {"$lte": now}},
+        {
+            "$set": {
+                "status": RUNNING,
+                "worker": worker,
+                "lease_expires_at": now + lease,
+                "started_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("priority", -1), ("run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def renew(job: dict, lease: timedelta, now: Optional[datetime] = None) -> bool:
+    """False when the job is no longer this worker's, e.g. its lease expired"""
+    now = now or datetime.utcnow()
+    result = await jobs_collection().update_one(
+        {"_id": job["_id"], "status": RUNNING, "worker": job["worker"]},
+        {"$set": {"lease_expires_at": now + lease}},
+    )
+    return result.matched_count > 0
+
+
+def _timings(job: dict, now: datetime) -> dict:
+    return {
+        "wait_ms": int((job["started_at"] - job["run_at"]).total_seconds() * 1000),
+        "run_ms": int((now - job["started_at"]).total_seconds() * 1000),
+    }
+
+
+async def _finish(job: dict, fields: dict, now: datetime):
+    # only while the job is still ours, a job whose lease ran out may have
+    # been claimed by another worker in the meantime
+    await jobs_collection().update_one(
+        {"_id": job["_id"], "status": RUNNING, "worker": job["worker"]},
+        {
+            "$set": {**fields, **_timings(job, now)},
+            "$unset": {"lease_expires_at": "", "worker": ""},
+        },
+    )
+
+
+async def complete(
+    job: dict,
+    result: Optional[dict],
+    now: Optional[datetime] = None,
+    retention: timedelta = RETENTION,
+):
+    now = now or datetime.utcnow()
+    await _finish(
+        job,
+        {
+            "status": DONE,
+            "finished_at": now,
+            "expires_at": now + retention,
+            "result": result or {},
+        },
+        now,
+    )
+
+
+async def retry(
+    job: dict, error: str, run_at: datetime, now: Optional[datetime] = None
+):
+    now = now or datetime.utcnow()
+    await _finish(job, {"status": QUEUED, "run_at": run_at, "last_error": error}, now)
+
+
+async def fail(
+    job: dict,
+    error: str,
+    now: Optional[datetime] = None,
+    retention: timedelta = RETENTION,
+):
+    now = now or datetime.utcnow()
+    await _finish(
+        job,
+        {
+            "status": FAILED,
+            "finished_at": now,
+            "expires_at": now + retention,
+            "last_error": error,
+        },
+        now,
+    )
+
+
+async def requeue_expired(
+    now: Optional[datetime] = None, retention: timedelta = RETENTION
+) -> int:
+    """
+    Jobs of workers that died mid run go back in the queue, unless they have
+    used up their attempts, so a job that kills its worker is not run forever
+    """
+    now = now or datetime.utcnow()
+    expired = {"status": RUNNING, "lease_expires_at": {"$lte": now}}
+    jobs = (
+        await jobs_collection()
+        .find(expired, {"attempts": 1, "max_attempts": 1})
+        .to_list(None)
+    )
+    spent = [
+        job["_id"]
+        for job in jobs
+        if job.get("attempts", 0) >= job.get("max_attempts", 5)
+    ]
+    remaining = [job["_id"] for job in jobs if job["_id"] not in spent]
+    reaped = 0
+    for ids, fields in (
+        (
+            spent,
+            {"status": FAILED, "finished_at": now, "expires_at": now + retention},
+        ),
+        (remaining, {"status": QUEUED}),
+    ):
+        if not ids:
+            continue
+        # the lease is checked again, the worker may have renewed it since
+        result = await jobs_collection().update_many(
+            {**expired, "_id": {"$in": ids}},
+            {
+                "$set": {**fields, "last_error": "worker lease expired"},
+                "$unset": {"lease_expires_at": "", "worker": ""},
+            },
+        )
+        reaped += result.modified_count
+    return reaped
+
+
+async def get_job_stats(
+    now: Optional[datetime] = None, window: timedelta = timedelta(hours=1)
+) -> dict:
+    """
+    Queue depth by status, how many queued jobs are due or scheduled later,
+    how long the oldest due one has waited, and per job name the wait and run
+    times of the jobs finished within `window`
+    """
+    now = now or datetime.utcnow()
+    counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+    cursor = jobs_collection().aggregate(
+        [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    )
+    async for group in cursor:
+        counts[group["_id"]] = group["count"]
+
+    due = await jobs_collection().count_documents(
+        {"status": QUEUED, "run_at": {"$lte": now}}
+    )
+    oldest = await jobs_collection().find_one(
+        {"status": QUEUED, "run_at": {"$lte": now}}, {"run_at": 1}, sort=[("run_at", 1)]
+    )
+    latency = {}
+    cursor = jobs_collection().aggregate(
+        [
+            {"$match": {"status": DONE, "finished_at": {"$gte": now - window}}},
+            {
+                "$group": {
+                    "_id": "$name",
+                    "count": {"$sum": 1},
+                    "average_wait_ms": {"$avg": "$wait_ms"},
+                    "max_wait_ms": {"$max": "$wait_ms"},
+                    "average_run_ms": {"$avg": "$run_ms"},
+                    "max_run_ms": {"$max": "$run_ms"},
+                }
+            },
+        ]
+    )
+    async for group in cursor:
+        latency[group.pop("_id")] = group
+    return {
+        "counts": counts,
+        "due": due,
+        "scheduled": counts[QUEUED] - due,
+        "oldest_due_seconds": (now - oldest["run_at"]).total_seconds()
+        if oldest
+        else None,
+        "latency": latency,
+    }
+
+
+async def get_failed_jobs(limit: int = 50) -> List[dict]:
+    return (
+        await jobs_collection()
+        .find(
+            {"status": FAILED},
+            {"name": 1, "payload": 1, "attempts": 1, "last_error": 1},
+        )
+        .sort("finished_at", -1)
+        .limit(limit)
+        .to_list(limit)
+    )
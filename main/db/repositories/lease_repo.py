@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from backend.main.db.docs.lease_doc import LeaseDocument
+from backend.main.db.repositories.async_collection import get_collection
+
+
+def leases_collection():
+    return get_collection(LeaseDocument)
+
+
+async def acquire(
+    name: str, owner: str, duration: timedelta, now: Optional[datetime] = None
+) -> bool:
+    """
+    Takes or renews the lease `name` for `duration`, one query.
+    False while another owner holds it
+    """
+    now = now or datetime.utcnow()
+    try:
+        lease = await leases_collection().find_one_and_update(
+            {"name": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + duration}},
+            {"owner": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # the lease exists and is held, so the filter did not match
+        return False
+    return lease is not None and lease["owner"] == owner
+
+
+async def release(name: str, owner: str):
+    """Lets another owner take the lease right away instead of when it expires"""
+    await leases_collection().delete_one({"name": name, "owner": owner})
@@ -0,0 +1,156 @@
+from typing import Dict, Iterable, List, Optional
+
+from backend.main.db.docs.mailing_list_doc import MailingListRecipientDocument
+from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.mixins import SessionLevel
+from backend.main.db.repositories.async_collection import get_collection
+from backend.main.db.repositories.student_repo import get_students_by_ids
+
+# only what the recipient entries are made of
+PROFILE_PROJECTION = {
+    "uuid": 1,
+    "email": 1,
+    "guardians.email": 1,
+    "guardians.first_name": 1,
+    "students": 1,
+    "mailing_lists": 1,
+}
+
+
+def recipients_collection():
+    return get_collection(MailingListRecipientDocument)
+
+
+def profile_addresses(profile: dict) -> Dict[str, Optional[str]]:
+    """
+    The account email and every guardian's email, lower case and once each,
+    mapped to the name of the guardian with that address (or the first one)
+    """
+    guardians = profile.get("guardians") or []
+    first_name = guardians[0].get("first_name") if guardians else None
+    addresses = {}
+    for guardian in guardians:
+        if guardian.get("email"):
+            addresses.setdefault(guardian["email"].lower(), guardian.get("first_name"))
+    if profile.get("email"):
+        addresses.setdefault(profile["email"].lower(), first_name)
+    return addresses
+
+
+def recipient_entries(profile: dict, students: List[dict]) -> List[dict]:
+    """
+    A profile's MailingListRecipientDocuments: its account email and every
+    guardian's email, once each, on each of its mailing lists
+    """
+    addresses = profile_addresses(profile)
+    student_names = [st["first_name"] for st in students if st.get("first_name")]
+    return [
+        {
+            "level": SessionLevel(level).value,
+            "email": email,
+            "profile_uuid": profile["uuid"],
+            "name": name,
+            "student_names": student_names,
+        }
+        for level in profile.get("mailing_lists", [])
+        for email, name in addresses.items()
+    ]
+
+
+async def refresh_profile(profile: dict, students: Optional[List[dict]] = None):
+    """Replaces the profile's entries, call after the profile or its students changed"""
+    if students is None:
+        by_id = await get_students_by_ids(profile.get("students", []), ["first_name"])
+        students = [
+            by_id[str(sid)] for sid in profile.get("students", []) if str(sid) in by_id
+        ]
+    await recipients_collection().delete_many({"profile_uuid": profile["uuid"]})
+    entries = recipient_entries(profile, students)
+    if entries:
+        await recipients_collection().insert_many(entries)
+
+
+async def get_recipients(level: SessionLevel) -> List[dict]:
+    """
+    Everyone on the `level` mailing list, one dict per address with the
+    guardian's name and the students of every profile with that address.
+    The (level, email) index returns the entries sorted, so duplicates are
+    next to each other and are merged while the cursor is read
+    """
+    cursor = (
+        recipients_collection()
+        .find(
+            {"level": SessionLevel(level).value},
+            {"_id": 0, "email": 1, "name": 1, "student_names": 1},
+        )
+        .sort([("level", 1), ("email", 1)])
+    )
+    recipients = []
+    async for entry in cursor.batch_size(1000):
+        if recipients and recipients[-1]["email"] == entry["email"]:
+            merged = recipients[-1]
+            merged["guardian_name"] = merged["guardian_name"] or entry.get("name")
+            merged["student_names"] += [
+                name
+                for name in entry.get("student_names", [])
+                if name not in merged["student_names"]
+            ]
+            continue
+        recipients.append(
+            {
+                "email": entry["email"],
+                "guardian_name": entry.get("name"),
+                "student_names": list(entry.get("student_names", [])),
+            }
+        )
+    return recipients
+
+
+async def rebuild(
+    levels: Optional[Iterable[SessionLevel]] = None, chunk_size: int = 500
+) -> int:
+    """
+    Recomputes the entries of `levels` (all of them by default) from the
+    profiles, e.g. to fill the collection for existing data.
+    Profiles are streamed with only the fields the entries need, and their
+    students are loaded with one query per `chunk_size` profiles
+    """
+    if levels is None:
+        query = {}
+        await recipients_collection().delete_many({})
+    else:
+        levels = [SessionLevel(level).value for level in levels]
+        # the multikey index on mailing_lists finds the profiles
+        query = {"mailing_lists": {"$in": levels}}
+        await recipients_collection().delete_many({"level": {"$in": levels}})
+
+    count = 0
+    profiles = get_collection(StudentProfileDocument).find(query, PROFILE_PROJECTION)
+    chunk = []
+    async for profile in profiles.batch_size(chunk_size):
+        chunk.append(profile)
+        if len(chunk) == chunk_size:
+            count += await _insert_entries(chunk, levels)
+            chunk = []
+    count += await _insert_entries(chunk, levels)
+    return count
+
+
+async def _insert_entries(profiles: List[dict], levels: Optional[List[str]]) -> int:
+    student_ids = [sid for profile in profiles for sid in profile.get("students", [])]
+    students = await get_students_by_ids(student_ids, ["first_name"])
+    entries = []
+    for profile in profiles:
+        profile_students = [
+            students[str(sid)]
+            for sid in profile.get("students", [])
+            if str(sid) in students
+        ]
+        entries += [
+            entry
+            for entry in recipient_entries(profile, profile_students)
+            if levels is None or entry["level"] in levels
+        ]
+    if entries:
+        await recipients_collection().insert_many(entries)
+    return len(entries)
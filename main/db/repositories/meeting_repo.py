@@ -0,0 +1,374 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pydantic import UUID4
+
+from backend.main.db.docs.meeting_doc import MeetingDocument, document as MeetingDoc
+from backend.main.db.docs.sync_docs import MeetingTombstoneDocument, SequenceDocument
+from backend.main.db.models.meeting_model import MeetingModel
+from backend.main.db.mixins import PydanticObjectId, SessionLevel
+from backend.main.db.repositories.async_collection import get_collection
+
+
+# a change is visible to every reader this long after its sequence number was
+# taken, see `sync_cursor`
+SETTLE_TIME = timedelta(seconds=2)
+
+
+def meetings_collection():
+    return get_collection(MeetingDocument)
+
+
+def tombstones_collection():
+    return get_collection(MeetingTombstoneDocument)
+
+
+async def next_seq() -> int:
+    """The next meeting `updated_seq`, from a counter incremented atomically"""
+    for _ in range(2):
+        try:
+            counter = await get_collection(SequenceDocument).find_one_and_update(
+                {"name": "meetings"},
+                {"$inc": {"value": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return counter["value"]
+        except DuplicateKeyError:
+            # another request created the counter at the same time, it exists now
+            continue
+    raise RuntimeError("could not increment the meetings sequence")
+
+
+async def change_stamp() -> dict:
+    """Fields to $set with every change clients can see"""
+    return {"updated_seq": await next_seq(), "updated_at": datetime.utcnow()}
+
+
+def sync_cursor(since: int, changes: List[Tuple[int, datetime]], now: datetime) -> int:
+    """
+    The cursor to hand back after sending `changes` (sequence number, time it
+    was taken). Sequence numbers are taken before the write they go with, so
+    a smaller one may still be in flight when a larger one is visible. The
+    cursor therefore only moves past changes older than SETTLE_TIME, and
+    never past a newer one, which is sent again on the next call
+    """
+    cutoff = now - SETTLE_TIME
+    settled = [seq for seq, at in changes if at is not None and at <= cutoff]
+    unsettled = [seq for seq, at in changes if at is None or at > cutoff]
+    cursor = max(settled, default=since)
+    if unsettled:
+        cursor = min(cursor, min(unsettled) - 1)
+    return max(cursor, since)
+
+
+def meeting_student_dict(meeting: dict) -> dict:
+    """Same shape as `MeetingDocument.student_dict`"""
+    return {
+        "uuid": meeting["uuid"],
+        "date_and_time": meeting.get("date_and_time"),
+        "duration": meeting.get("duration"),
+        "zoom_link": meeting.get("zoom_link"),
+        "miro_link": meeting.get("miro_link"),
+        "topic": meeting.get("topic"),
+        "session_level": meeting.get("session_level"),
+        "student_notes": meeting.get("student_notes"),
+        "materials_uploaded": meeting.get("materials_uploaded"),
+    }
+
+
+def meeting_admin_dict(meeting: dict, students: Dict[str, dict]) -> dict:
+    """
+    Same shape as `MeetingDocument.admin_dict`, `students` are the registered
+    StudentDocuments keyed by id, see `registered_student_ids`
+    """
+    students_to_return = []
+    for st in meeting.get("students", []):
+        st = dict(st)
+        student = students.get(st["student_id"])
+        if student is None:
+            print(
+                f"ERROR: student_id {st['student_id']} in MeetingDocument but StudentDocument does not exist"
+            )
+        else:
+            st["first_name"] = student.get("first_name")
+            st["last_name"] = student.get("last_name")
+        students_to_return.append(st)
+
+    return {
+        "uuid": meeting["uuid"],
+        "date_and_time": meeting.get("date_and_time"),
+        "duration": meeting.get("duration"),
+        "zoom_link": meeting.get("zoom_link"),
+        "miro_link": meeting.get("miro_link"),
+        "topic": meeting.get("topic"),
+        "session_level": meeting.get("session_level"),
+        "password": meeting.get("password"),
+        "students": students_to_return,
+        "coordinator_notes": meeting.get("coordinator_notes"),
+        "student_notes": meeting.get("student_notes"),
+        "materials_uploaded": meeting.get("materials_uploaded"),
+    }
+
+
+def registered_student_ids(meetings: List[dict]) -> List[str]:
+    ids = {
+        st["student_id"] for meeting in meetings for st in meeting.get("students", [])
+    }
+    return list(ids)
+
+
+async def get_meeting_by_uuid(
+    meeting_uuid: UUID4, projection: Optional[List[str]] = None
+) -> Optional[dict]:
+    return await meetings_collection().find_one({"uuid": meeting_uuid}, projection)
+
+
+async def get_meeting_levels(meeting_uuids: Iterable[str]) -> Dict[str, str]:
+    """Session level by meeting uuid string, with one `$in` query"""
+    uuids = [UUID(str(meeting_uuid)) for meeting_uuid in meeting_uuids]
+    if not uuids:
+        return {}
+    cursor = meetings_collection().find(
+        {"uuid": {"$in": uuids}}, {"uuid": 1, "session_level": 1}
+    )
+    return {str(meeting["uuid"]): meeting["session_level"] async for meeting in cursor}
+
+
+async def get_meetings_by_uuids(
+    meeting_uuids: Iterable[UUID4], projection: Optional[List[str]] = None
+) -> Dict[str, dict]:
+    """Loads all of `meeting_uuids` with one `$in` query, keyed by uuid string"""
+    uuids = [UUID(str(meeting_uuid)) for meeting_uuid in meeting_uuids]
+    if not uuids:
+        return {}
+    cursor = meetings_collection().find({"uuid": {"$in": uuids}}, projection)
+    return {str(meeting["uuid"]): meeting async for meeting in cursor}
+
+
+async def get_meetings_by_session_levels(levels: List[SessionLevel]) -> List[dict]:
+    """All meetings for `levels` with one `$in` query, grouped in the order of `levels`"""
+    levels = [SessionLevel(level).value for level in levels]
+    cursor = meetings_collection().find({"session_level": {"$in": levels}})
+    meetings = await cursor.to_list(None)
+    meetings.sort(key=lambda meeting: levels.index(meeting["session_level"]))
+    return meetings
+
+
+async def get_upcoming_meetings(
+    level: SessionLevel, now: datetime, limit: int
+) -> List[dict]:
+    """The next `limit` meetings of `level`, soonest first, from the (session_level, date_and_time) index"""
+    cursor = (
+        meetings_collection()
+        .find(
+            {"session_level": SessionLevel(level).value, "date_and_time": {"$gte": now}}
+        )
+        .sort("date_and_time", 1)
+        .limit(limit)
+    )
+    return await cursor.to_list(limit)
+
+
+async def get_registered_meetings(
+    student_ids: List[PydanticObjectId], now: datetime
+) -> List[dict]:
+    """Meetings from `now` on that any of `student_ids` is registered for, soonest first"""
+    if not student_ids:
+        return []
+    cursor = (
+        meetings_collection()
+        .find(
+            {
+                "students.student_id": {"$in": [str(sid) for sid in student_ids]},
+                "date_and_time": {"$gte": now},
+            },
+            {
+                "uuid": 1,
+                "date_and_time": 1,
+                "topic": 1,
+                "session_level": 1,
+                "students": 1,
+            },
+        )
+        .sort("date_and_time", 1)
+    )
+    return await cursor.to_list(None)
+
+
+async def get_meetings_cursor(now: Optional[datetime] = None) -> int:
+    """
+    A cursor to go with a full listing read right after this call, the
+    newest settled change (see `sync_cursor`). Walks the updated_seq index
+    down from the top, past the few changes of the last SETTLE_TIME
+    """
+    now = now or datetime.utcnow()
+    newest = await meetings_collection().find_one(
+        {"updated_at": {"$lte": now - SETTLE_TIME}},
+        {"updated_seq": 1},
+        sort=[("updated_seq", -1)],
+    )
+    return (newest or {}).get("updated_seq") or 0
+
+
+async def get_meeting_changes(
+    since: int, now: Optional[datetime] = None
+) -> Tuple[List[dict], List[str], int]:
+    """
+    The meetings changed and the uuids of those deleted after cursor `since`,
+    with the cursor for the next call. Two range reads of the sequence indexes
+    """
+    now = now or datetime.utcnow()
+    changed = (
+        await meetings_collection()
+        .find({"updated_seq": {"$gt": since}})
+        .sort("updated_seq", 1)
+        .to_list(None)
+    )
+    tombstones = (
+        await tombstones_collection()
+        .find(
+            {"deleted_seq": {"$gt": since}},
+            {"uuid": 1, "deleted_seq": 1, "deleted_at": 1},
+        )
+        .to_list(None)
+    )
+    cursor = sync_cursor(
+        since,
+        [(m["updated_seq"], m.get("updated_at")) for m in changed]
+        + [(t["deleted_seq"], t.get("deleted_at")) for t in tombstones],
+        now,
+    )
+    return changed, [str(t["uuid"]) for t in tombstones], cursor
+
+
+async def add_meeting(meeting: MeetingModel) -> dict:
+    doc = MeetingDoc(meeting)
+    doc.validate()
+    son = doc.to_mongo().to_dict()
+    son.update(await change_stamp())
+    result = await meetings_collection().insert_one(son)
+    son["_id"] = result.inserted_id
+    return son
+
+
+async def update_meeting(meeting_uuid: UUID4, fields: dict) -> Optional[dict]:
+    update = {"$set": {**fields, **await change_stamp()}}
+    if "date_and_time" in fields:
+        # the reminder is sent again for the new time, the outbox keys keep
+        # the families from getting it twice when the time did not change
+        update["$unset"] = {"reminder_sent_at": ""}
+    return await meetings_collection().find_one_and_update(
+        {"uuid": meeting_uuid}, update, return_document=ReturnDocument.AFTER
+    )
+
+
+async def delete_meeting(meeting_uuid: UUID4) -> bool:
+    result = await meetings_collection().delete_one({"uuid": meeting_uuid})
+    if result.deleted_count == 0:
+        return False
+    stamp = await change_stamp()
+    await tombstones_collection().insert_one(
+        {
+            "uuid": meeting_uuid,
+            "deleted_seq": stamp["updated_seq"],
+            "deleted_at": stamp["updated_at"],
+        }
+    )
+    return True
+
+
+async def add_student_to_meeting(meeting_uuid: UUID4, student_info: dict) -> bool:
+    """Appends `student_info` to the meeting unless the student is already on it"""
+    result = await meetings_collection().update_one(
+        {
+            "uuid": meeting_uuid,
+            "students.student_id": {"$ne": student_info["student_id"]},
+        },
+        {"$push": {"students": student_info}, "$set": await change_stamp()},
+    )
+    return result.modified_count > 0
+
+
+async def remove_student_from_meeting(
+    meeting_uuid: UUID4, student_id: PydanticObjectId
+) -> bool:
+    result = await meetings_collection().update_one(
+        {"uuid": meeting_uuid, "students.student_id": str(student_id)},
+        {
+            "$pull": {"students": {"student_id": str(student_id)}},
+            "$set": await change_stamp(),
+        },
+    )
+    return result.modified_count > 0
+
+
+async def apply_registrations(
+    registrations: List[Tuple[UUID4, dict, bool]]
+) -> List[bool]:
+    """
+    Adds (True) or removes (False) the `student_info` of each
+    (meeting uuid, student_info, registered), and returns for each whether it
+    was applied. The filters are those of `add_student_to_meeting` and
+    `remove_student_from_meeting`, so a change someone else made in between is
+    not applied twice. A `bulk_write` only reports totals, so the updates are
+    sent side by side instead, each one tells whether it changed the meeting
+    """
+    if not registrations:
+        return []
+    stamp = await change_stamp()
+
+    async def apply(meeting_uuid: UUID4, student_info: dict, registered: bool):
+        student_id = str(student_info["student_id"])
+        if registered:
+            result = await meetings_collection().update_one(
+                {"uuid": meeting_uuid, "students.student_id": {"$ne": student_id}},
+                {"$push": {"students": student_info}, "$set": stamp},
+            )
+        else:
+            result = await meetings_collection().update_one(
+                {"uuid": meeting_uuid, "students.student_id": student_id},
+                {"$pull": {"students": {"student_id": student_id}}, "$set": stamp},
+            )
+        return result.modified_count > 0
+
+    return list(await asyncio.gather(*(apply(*r) for r in registrations)))
+
+
+async def set_meeting_attendance(
+    meeting_uuid: UUID4, student_id: PydanticObjectId, attended: bool
+) -> bool:
+    result = await meetings_collection().update_one(
+        {"uuid": meeting_uuid, "students.student_id": str(student_id)},
+        {"$set": {"students.$.attended": attended, **await change_stamp()}},
+    )
+    return result.matched_count > 0
+
+
+async def get_meetings_needing_reminder(
+    start: datetime, end: datetime, limit: int
+) -> List[dict]:
+    """
+    Up to `limit` meetings starting between `start` and `end` whose reminder
+    has not been sent, soonest first. A range of the date_and_time index
+    """
+    cursor = (
+        meetings_collection()
+        .find(
+            {"date_and_time": {"$gte": start, "$lte": end}, "reminder_sent_at": None},
+            {"coordinator_notes": 0, "student_notes": 0},
+        )
+        .sort("date_and_time", 1)
+        .limit(limit)
+    )
+    return await cursor.to_list(limit)
+
+
+async def set_reminders_sent(meeting_uuids: List[UUID4], now: datetime):
+    await meetings_collection().update_many(
+        {"uuid": {"$in": meeting_uuids}}, {"$set": {"reminder_sent_at": now}}
+    )
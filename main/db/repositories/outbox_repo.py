@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from backend.main.db.docs.outbox_doc import (
+    FAILED,
+    HELD,
+    QUEUED,
+    SENDING,
+    SENT,
+    OutboxEmailDocument,
+)
+from backend.main.db.repositories.async_collection import get_collection
+
+# how long sent and failed emails are kept
+RETENTION = timedelta(days=30)
+
+
+def outbox_collection():
+    return get_collection(OutboxEmailDocument)
+
+
+def due_filter(now: datetime) -> dict:
+    """Emails a worker may claim: queued and due, or claimed by a worker that died"""
+    return {
+        "$or": [
+            {"status": QUEUED, "next_attempt_at": {"$lte": now}},
+            {"status": SENDING, "lease_expires_at": {"$lte": now}},
+        ]
+    }
+
+
+def _email_sons(emails: List[dict]) -> List[dict]:
+    sons = []
+    for email in emails:
+        doc = OutboxEmailDocument(**email)
+        doc.validate()
+        sons.append(doc.to_mongo().to_dict())
+    return sons
+
+
+async def enqueue_email(
+    receivers: List[str], subject: str, body: str, subtype: str = "html"
+) -> ObjectId:
+    doc = OutboxEmailDocument(
+        receivers=receivers, subject=subject, body=body, subtype=subtype
+    )
+    doc.validate()
+    result = await outbox_collection().insert_one(doc.to_mongo().to_dict())
+    return result.inserted_id
+
+
+async def enqueue_emails(emails: List[dict]) -> List[ObjectId]:
+    """Inserts many emails with one query, `emails` have the arguments of `enqueue_email`"""
+    if not emails:
+        return []
+    sons = _email_sons(emails)
+    result = await outbox_collection().insert_many(sons)
+    return result.inserted_ids
+
+
+async def enqueue_keyed_emails(emails: List[dict]) -> int:
+    """
+    `enqueue_emails` for emails with a `key`, an email whose key is already in
+    the outbox is skipped, so queueing the same emails again is harmless.
+    Returns how many were new
+    """
+    if not emails:
+        return 0
+    sons = _email_sons(emails)
+    try:
+        result = await outbox_collection().insert_many(sons, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        return e.details["nInserted"]
+    return len(result.inserted_ids)
+
+
+async def claim_batch(
+    limit: int, lease: timedelta, now: Optional[datetime] = None
+) -> List[dict]:
+    """
+    Claims up to `limit` due emails for this worker, oldest first.
+    Three queries whatever the batch size; the update checks the filter again,
+    so an email another worker claimed in between is skipped rather than sent twice
+    """
+    now = now or datetime.utcnow()
+    candidates = (
+        await outbox_collection()
+        .find(due_filter(now), {"_id": 1})
+        .sort("next_attempt_at", 1)
+        .limit(limit)
+        .to_list(limit)
+    )
+    if not candidates:
+        return []
+    claim = uuid4().hex
+    ids = [doc["_id"] for doc in candidates]
+    await outbox_collection().update_many(
+        {"_id": {"$in": ids}, **due_filter(now)},
+        {
+            "$set": {
+                "status": SENDING,
+                "claim": claim,
+                "lease_expires_at": now + lease,
+            },
+            "$inc": {"attempts": 1},
+        },
+    )
+    # looked up by _id, there is no index on claim
+    return (
+        await outbox_collection()
+        .find({"_id": {"$in": ids}, "claim": claim})
+        .to_list(limit)
+    )
+
+
+async def mark_sent(
+    email_ids: List[ObjectId],
+    refused: Optional[Dict[ObjectId, List[str]]] = None,
+    now: Optional[datetime] = None,
+    retention: timedelta = RETENTION,
+):
+    """One update for the whole batch, plus one per email with refused receivers"""
+    if not email_ids:
+        return
+    now = now or datetime.utcnow()
+    await outbox_collection().update_many(
+        {"_id": {"$in": email_ids}},
+        {
+            "$set": {"status": SENT, "sent_at": now, "expires_at": now + retention},
+            "$unset": {"claim": "", "lease_expires_at": "", "last_error": ""},
+        },
+    )
+    for email_id, receivers in (refused or {}).items():
+        await outbox_collection().update_one(
+            {"_id": email_id}, {"$set": {"refused": receivers}}
+        )
+
+
+async def mark_retry(email_id: ObjectId, error: str, next_attempt_at: datetime):
+    await outbox_collection().update_one(
+        {"_id": email_id},
+        {
+            "$set": {
+                "status": QUEUED,
+                "next_attempt_at": next_attempt_at,
+                "last_error": error,
+            },
+            "$unset": {"claim": "", "lease_expires_at": ""},
+        },
+    )
+
+
+async def mark_failed(
+    email_id: ObjectId,
+    error: str,
+    now: Optional[datetime] = None,
+    retention: timedelta = RETENTION,
+):
+    now = now or datetime.utcnow()
+    await outbox_collection().update_one(
+        {"_id": email_id},
+        {
+            "$set": {
+                "status": FAILED,
+                "last_error": error,
+                "expires_at": now + retention,
+            },
+            "$unset": {"claim": "", "lease_expires_at": ""},
+        },
+    )
+
+
+async def get_outbox_stats() -> dict:
+    """Number of emails per delivery status and the age of the oldest queued one"""
+    counts = {status: 0 for status in (HELD, QUEUED, SENDING, SENT, FAILED)}
+    cursor = outbox_collection().aggregate(
+        [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    )
+    async for group in cursor:
+        counts[group["_id"]] = group["count"]
+    oldest = await outbox_collection().find_one(
+        {"status": QUEUED}, {"created_at": 1}, sort=[("created_at", 1)]
+    )
+    oldest_seconds = None
+    if oldest is not None:
+        oldest_seconds = (datetime.utcnow() - oldest["created_at"]).total_seconds()
+    return {"counts": counts, "oldest_queued_seconds": oldest_seconds}
+
+
+async def get_failed_emails(limit: int = 50) -> List[dict]:
+    return (
+        await outbox_collection()
+        .find(
+            {"status": FAILED},
+            {"receivers": 1, "subject": 1, "attempts": 1, "last_error": 1},
+        )
+        .sort("created_at", -1)
+        .limit(limit)
+        .to_list(limit)
+    )
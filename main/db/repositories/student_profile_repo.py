@@ -0,0 +1,94 @@
+from typing import List, Optional, Tuple
+
+from pydantic import UUID4, EmailStr
+from pymongo import ReturnDocument
+
+from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.models.student_profile_model import StudentProfileModel
+from backend.main.db.repositories import mailing_list_repo
+from backend.main.db.repositories.async_collection import get_collection
+from backend.main.db.repositories.student_repo import (
+    add_students,
+    get_students_by_ids,
+    student_dict,
+)
+
+
+# changes to these update the profile's mailing list entries
+MAILING_LIST_FIELDS = {"email", "guardians", "students", "mailing_lists"}
+
+
+def profiles_collection():
+    return get_collection(StudentProfileDocument)
+
+
+def profile_dict(profile: dict, students: List[dict]) -> dict:
+    """Same shape as `StudentProfileDocument.dict`"""
+    return {
+        "uuid": profile["uuid"],
+        "email": profile.get("email"),
+        "student_list": [student_dict(st) for st in students],
+        "guardians": profile.get("guardians", []),
+        "mailing_lists": profile.get("mailing_lists", []),
+        "email_verified": profile.get("email_verified", False),
+    }
+
+
+async def get_profile_by_uuid(
+    uuid: UUID4, projection: Optional[List[str]] = None
+) -> Optional[dict]:
+    return await profiles_collection().find_one({"uuid": uuid}, projection)
+
+
+async def get_all_profiles() -> List[dict]:
+    return await profiles_collection().find().to_list(None)
+
+
+async def get_profile_students(profile: dict) -> List[dict]:
+    """The profile's StudentDocuments in profile order, with one query"""
+    students = await get_students_by_ids(profile.get("students", []))
+    return [
+        students[str(sid)]
+        for sid in profile.get("students", [])
+        if str(sid) in students
+    ]
+
+
+async def add_profile(profile: StudentProfileModel) -> Tuple[dict, List[dict]]:
+    """Creates the StudentDocuments and the StudentProfileDocument referencing them"""
+    students = await add_students(profile.students)
+    doc = StudentProfileDocument(
+        uuid=profile.uuid,
+        email=profile.email,
+        guardians=[g.dict() for g in profile.guardians],
+        mailing_lists=profile.mailing_lists,
+    )
+    doc.validate()
+    son = doc.to_mongo().to_dict()
+    son["students"] = [st["_id"] for st in students]
+    result = await profiles_collection().insert_one(son)
+    son["_id"] = result.inserted_id
+    await mailing_list_repo.refresh_profile(son, students)
+    return son, students
+
+
+async def update_profile(uuid: UUID4, fields: dict) -> bool:
+    result = await profiles_collection().find_one_and_update(
+        {"uuid": uuid},
+        {"$set": fields},
+        mailing_list_repo.PROFILE_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if result is None:
+        return False
+    if MAILING_LIST_FIELDS.intersection(fields):
+        await mailing_list_repo.refresh_profile(result)
+    return True
+
+
+async def set_email_verified(uuid: UUID4, email: EmailStr) -> bool:
+    """Only matches while the profile still has `email`, so it needs no read"""
+    result = await profiles_collection().update_one(
+        {"uuid": uuid, "email": email}, {"$set": {"email_verified": True}}
+    )
+    return result.matched_count > 0
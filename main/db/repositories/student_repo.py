@@ -0,0 +1,161 @@
+from typing import Dict, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+from pydantic import UUID4
+from pymongo import UpdateOne
+
+from backend.main.db.docs.student_doc import StudentDocument, document as StudentDoc
+from backend.main.db.models.student_models import StudentModel
+from backend.main.db.mixins import PydanticObjectId, SessionLevel
+from backend.main.db.repositories.async_collection import get_collection
+
+
+def students_collection():
+    return get_collection(StudentDocument)
+
+
+def student_dict(student: dict) -> dict:
+    """Same shape as `StudentDocument.dict`"""
+    return {
+        "id": str(student["_id"]),
+        "profile_uuid": student.get("profile_uuid"),
+        "first_name": student.get("first_name"),
+        "last_name": student.get("last_name"),
+        "grade": student.get("grade"),
+        "birth_month": student.get("birth_month"),
+        "birth_year": student.get("birth_year"),
+        "meetings_registered": student.get("meetings_registered", {}),
+        "meeting_counts": student.get("meeting_counts", {}),
+        "verification_status": student.get("verification_status"),
+        "consent_form_object_name": student.get("consent_form_object_name"),
+    }
+
+
+def counter(level: SessionLevel, name: str) -> str:
+    return f"meeting_counts.{SessionLevel(level).value}.{name}"
+
+
+def to_object_id(student_id: PydanticObjectId) -> ObjectId:
+    return student_id if isinstance(student_id, ObjectId) else ObjectId(student_id)
+
+
+async def get_student_by_id(
+    student_id: PydanticObjectId, projection: Optional[List[str]] = None
+) -> Optional[dict]:
+    return await students_collection().find_one(
+        {"_id": to_object_id(student_id)}, projection
+    )
+
+
+async def get_students_by_ids(
+    student_ids: List[PydanticObjectId], projection: Optional[List[str]] = None
+) -> Dict[str, dict]:
+    """Loads all of `student_ids` with one `$in` query, keyed by string id"""
+    if not student_ids:
+        return {}
+    cursor = students_collection().find(
+        {"_id": {"$in": [to_object_id(sid) for sid in student_ids]}}, projection
+    )
+    return {str(student["_id"]): student async for student in cursor}
+
+
+async def add_students(students: List[StudentModel]) -> List[dict]:
+    if not students:
+        return []
+    sons = []
+    for student in students:
+        doc = StudentDoc(student)
+        doc.validate()
+        sons.append(doc.to_mongo().to_dict())
+    result = await students_collection().insert_many(sons)
+    for son, inserted_id in zip(sons, result.inserted_ids):
+        son["_id"] = inserted_id
+    return sons
+
+
+async def update_student(student_id: PydanticObjectId, fields: dict) -> bool:
+    result = await students_collection().update_one(
+        {"_id": to_object_id(student_id)}, {"$set": fields}
+    )
+    return result.matched_count > 0
+
+
+async def register_student_for_meeting(
+    student_id: PydanticObjectId, meeting_uuid: UUID4, level: SessionLevel
+) -> bool:
+    """Adds the registration and bumps the registered count, unless already there"""
+    registration = f"meetings_registered.{meeting_uuid}"
+    result = await students_collection().update_one(
+        {"_id": to_object_id(student_id), registration: {"$exists": False}},
+        {
+            "$set": {registration: False},
+            "$inc": {counter(level, "registered"): 1},
+        },
+    )
+    return result.modified_count > 0
+
+
+async def unregister_student_from_meeting(
+    student_id: PydanticObjectId, meeting_uuid: UUID4, level: SessionLevel
+) -> bool:
+    """Removes the registration and decrements the registered count, if it exists"""
+    registration = f"meetings_registered.{meeting_uuid}"
+    result = await students_collection().update_one(
+        {"_id": to_object_id(student_id), registration: {"$exists": True}},
+        {
+            "$unset": {registration: ""},
+            "$inc": {counter(level, "registered"): -1},
+        },
+    )
+    return result.modified_count > 0
+
+
+async def apply_registrations(
+    registrations: List[Tuple[PydanticObjectId, UUID4, SessionLevel, bool]]
+):
+    """
+    `register_student_for_meeting` (True) or `unregister_student_from_meeting`
+    (False) for each (student id, meeting uuid, level, registered), with one
+    `bulk_write`
+    """
+    if not registrations:
+        return
+    operations = []
+    for student_id, meeting_uuid, level, registered in registrations:
+        registration = f"meetings_registered.{meeting_uuid}"
+        if registered:
+            update = {
+                "$set": {registration: False},
+                "$inc": {counter(level, "registered"): 1},
+            }
+        else:
+            update = {
+                "$unset": {registration: ""},
+                "$inc": {counter(level, "registered"): -1},
+            }
+        operations.append(
+            UpdateOne(
+                {
+                    "_id": to_object_id(student_id),
+                    registration: {"$exists": not registered},
+                },
+                update,
+            )
+        )
+    await students_collection().bulk_write(operations, ordered=False)
+
+
+async def set_student_attendance(
+    student_id: PydanticObjectId,
+    meeting_uuid: UUID4,
+    level: SessionLevel,
+    attended: bool,
+) -> bool:
+    result = await students_collection().update_one(
+        {"_id": to_object_id(student_id)},
+        {
+            "$set": {f"meetings_registered.{meeting_uuid}": attended},
+            "$inc": {counter(level, "attended"): 1 if attended else -1},
+        },
+    )
+    return result.matched_count > 0
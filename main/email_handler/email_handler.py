@@ -1,32 +1,17 @@
-from fastapi import BackgroundTasks
-from starlette.responses import JSONResponse
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from pydantic import BaseModel, EmailStr, Field
+from datetime import timedelta
 from typing import List
-import toml
-from pathlib import Path
-
-CONFIG_PATH = (
-    Path(__file__).resolve().parent.parent.parent.joinpath("auth/db-config.toml")
-)
-print("Using CONFIG_PATH:", CONFIG_PATH)
 
-config = toml.load(str(CONFIG_PATH))
+from starlette.responses import JSONResponse
+from pydantic import BaseModel, EmailStr, Field
 
+from backend.main.db.repositories import broadcast_repo, outbox_repo
+from backend.main.email_handler.outbox_worker import wake_email_worker
+from backend.settings import settings
 
-email_username = config["email-username"]
-email_password = config["email-password"]
-admin_email = config["admin-email"]
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=email_username,
-    MAIL_PASSWORD=email_password,
-    MAIL_FROM=admin_email,
-    MAIL_PORT=587,
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_TLS=True,
-    MAIL_SSL=False,
-)
+def frontend_url() -> str:
+    # links in emails point at the frontend, which calls the API with the token
+    return settings.get("frontend-url", "http://localhost:3000")
 
 
 class EmailSchema(BaseModel):
@@ -35,19 +20,48 @@ class EmailSchema(BaseModel):
     body: str = Field()
 
 
-async def email_handler(
-    background_task: BackgroundTasks, email: EmailSchema
-) -> JSONResponse:
+async def email_handler(email: EmailSchema) -> JSONResponse:
+    """
+    Puts `email` in the outbox, sent by `OutboxWorker`. Once this returns the
+    email survives restarts and is retried until the server accepts it
+    """
+    await outbox_repo.enqueue_email(email.receivers, email.subject, email.body)
+    wake_email_worker()
+    return JSONResponse(status_code=200, content={"message": "email has been sent"})
+
 
-    message = MessageSchema(
-        subject=email.subject,
-        recipients=email.receivers,  # List of recipients, as many as you can pass
-        body=email.body,
-        subtype="html",
+async def bulk_email_handler(emails: List[EmailSchema]) -> JSONResponse:
+    """`email_handler` for many emails, they are put in the outbox with one query"""
+    await outbox_repo.enqueue_emails(
+        [
+            {"receivers": email.receivers, "subject": email.subject, "body": email.body}
+            for email in emails
+        ]
     )
+    wake_email_worker()
+    return JSONResponse(status_code=200, content={"message": "email has been sent"})
 
-    fm = FastMail(conf)
-
-    background_task.add_task(fm.send_message, message)
 
-    return JSONResponse(status_code=200, content={"message": "email has been sent"})
+async def broadcast_email_handler(emails: List[EmailSchema]) -> JSONResponse:
+    """
+    `bulk_email_handler` for an email to a whole mailing list. The emails go
+    out in waves of broadcast-wave-size spread over broadcast-window-minutes,
+    so the families do not all visit the site at the same moment
+    """
+    broadcast = await broadcast_repo.create_broadcast(
+        [
+            {"receivers": email.receivers, "subject": email.subject, "body": email.body}
+            for email in emails
+        ],
+        wave_size=settings.get("broadcast-wave-size", 100),
+        window=timedelta(minutes=settings.get("broadcast-window-minutes", 30)),
+    )
+    wake_email_worker()
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "email is being sent",
+            "broadcast_id": str(broadcast["_id"]),
+            "waves": broadcast["waves"],
+        },
+    )
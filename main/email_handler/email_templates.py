@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from markupsafe import Markup
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.joinpath("templates")
+
+
+class TemplateRegistry:
+    """
+    The email templates in `directory`, compiled once by `load`.
+    Parts that are the same for every recipient of a bulk email are rendered
+    once with `render_shared` and passed to the per recipient template
+    """
+
+    def __init__(self, directory: Path = TEMPLATES_DIR, shared_cache_size: int = 256):
+        self.environment = Environment(
+            loader=FileSystemLoader(str(directory)),
+            autoescape=select_autoescape(["html"]),
+            # the templates only change with a deploy
+            auto_reload=False,
+        )
+        self.templates: Dict[str, Template] = {}
+        self._shared: OrderedDict = OrderedDict()
+        self.shared_cache_size = shared_cache_size
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    def load(self) -> "TemplateRegistry":
+        for name in self.environment.list_templates(extensions=["html"]):
+            self.templates[name] = self.environment.get_template(name)
+        return self
+
+    def get(self, name: str) -> Template:
+        template = self.templates.get(name)
+        if template is None:
+            template = self.templates[name] = self.environment.get_template(name)
+        return template
+
+    def render(self, name: str, **context) -> str:
+        return self.get(name).render(context)
+
+    def render_each(
+        self, name: str, recipients: Iterable[dict], **shared
+    ) -> Iterator[str]:
+        """One copy of `name` per recipient, each rendered with `shared` and its own dict"""
+        render = self.get(name).render
+        for recipient in recipients:
+            yield render(shared, **recipient)
+
+    def render_shared(self, name: str, **context) -> Markup:
+        """
+        `name` rendered with `context`, from the cache when it was rendered with
+        the same context before. Markup, so it is not escaped again when
+        included in another template
+        """
+        try:
+            key = (name, tuple(sorted(context.items())))
+            hash(key)
+        except TypeError:
+            # unhashable values, e.g. lists, are rendered every time
+            return Markup(self.render(name, **context))
+
+        rendered = self._shared.get(key)
+        if rendered is not None:
+            self.shared_hits += 1
+            self._shared.move_to_end(key)
+            return rendered
+        self.shared_misses += 1
+        rendered = self._shared[key] = Markup(self.render(name, **context))
+        if len(self._shared) > self.shared_cache_size:
+            self._shared.popitem(last=False)
+        return rendered
+
+
+@lru_cache(maxsize=None)
+def get_templates() -> TemplateRegistry:
+    """The compiled templates, call from a startup event to compile them up front"""
+    return TemplateRegistry().load()
+
+
+def meeting_details(meeting: dict) -> Markup:
+    """The meeting's date, time and links, the shared part of meeting emails"""
+    start = meeting["date_and_time"]
+    return get_templates().render_shared(
+        "meeting_details.html",
+        start=start,
+        end=start + timedelta(minutes=meeting.get("duration") or 0),
+        topic=meeting.get("topic"),
+        zoom_link=meeting.get("zoom_link"),
+        password=meeting.get("password"),
+        miro_link=meeting.get("miro_link"),
+        session_level=meeting.get("session_level"),
+    )
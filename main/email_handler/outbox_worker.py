@@ -0,0 +1,320 @@
+"""
+Sends the emails in the outbox (see `OutboxEmailDocument`).
+
+Every web worker drains the outbox in the background by default. Claims are
+atomic, so any number of them can run side by side, or the web workers can
+leave it (email-worker = false in db-config.toml) to a separate process:
+
+    python -m backend.main.email_handler.outbox_worker
+"""
+import asyncio
+import random
+import signal
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from typing import Callable, List, Optional
+
+import aiosmtplib
+
+from backend.main.db.repositories import broadcast_repo, outbox_repo
+from backend.main.src.load_monitor import get_load_monitor
+from backend.settings import settings
+
+
+class SMTPPool:
+    """
+    Up to `size` SMTP connections that stay open between messages, so a batch
+    pays for the TCP, STARTTLS and AUTH handshakes once per connection rather
+    than once per message
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        start_tls: bool = True,
+        size: int = 4,
+        timeout: float = 30,
+    ):
+        self.options = {
+            "hostname": hostname,
+            "port": port,
+            "username": username,
+            "password": password,
+            "start_tls": start_tls,
+            "timeout": timeout,
+        }
+        self.size = size
+        self._idle: List[aiosmtplib.SMTP] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.connections_opened = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        """An open connection, closed instead of reused if it broke while in use"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        async with self._semaphore:
+            smtp = self._idle.pop() if self._idle else None
+            if smtp is None or not smtp.is_connected:
+                smtp = aiosmtplib.SMTP(**self.options)
+                await smtp.connect()
+                self.connections_opened += 1
+            try:
+                yield smtp
+            except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+                # the server answered, the connection is still good
+                self._idle.append(smtp)
+                raise
+            except BaseException:
+                smtp.close()
+                raise
+            self._idle.append(smtp)
+
+    async def close(self):
+        while self._idle:
+            smtp = self._idle.pop()
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+
+def build_message(email: dict, sender: str) -> MIMEText:
+    # MIMEText's compat32 headers are stored as given, the default policy of
+    # EmailMessage parses every header and takes several times longer
+    message = MIMEText(email["body"], email.get("subtype") or "html", "utf-8")
+    subject = email["subject"]
+    message["From"] = sender
+    message["To"] = ", ".join(email["receivers"])
+    message["Subject"] = subject if subject.isascii() else Header(subject, "utf-8")
+    message["Date"] = formatdate(usegmt=True)
+    # the same id on every attempt lets receivers drop a duplicate delivery,
+    # the domain is given because looking up this host's name is slow
+    message["Message-ID"] = make_msgid(
+        idstring=str(email["_id"]), domain=sender.rpartition("@")[2]
+    )
+    return message
+
+
+def is_permanent(error: Exception) -> bool:
+    """5xx replies (unknown mailbox, rejected content) fail the same way again"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(refused.code >= 500 for refused in error.recipients)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        pool: SMTPPool,
+        sender: str,
+        batch_size: int = 50,
+        max_attempts: int = 6,
+        backoff: timedelta = timedelta(seconds=30),
+        max_backoff: timedelta = timedelta(hours=1),
+        lease: timedelta = timedelta(minutes=5),
+        poll_interval: float = 5,
+        is_overloaded: Optional[Callable[[], bool]] = None,
+        load_backoff: timedelta = timedelta(minutes=2),
+        retention: timedelta = outbox_repo.RETENTION,
+    ):
+        self.pool = pool
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        # broadcast waves wait while this says the API is busy
+        self.is_overloaded = is_overloaded or (lambda: False)
+        self.load_backoff = load_backoff
+        # sent and failed emails are deleted this long after
+        self.retention = retention
+        self.waves_released = 0
+        self.waves_postponed = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def retry_delay(self, attempts: int) -> timedelta:
+        """Exponential backoff with jitter: 30s, 1m, 2m, ... up to `max_backoff`"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.0)
+
+    async def send(self, email: dict) -> Optional[Exception]:
+        """None when the server accepted the email, otherwise the error"""
+        try:
+            async with self.pool.connection() as smtp:
+                refused, _ = await smtp.send_message(
+                    build_message(email, self.sender),
+                    sender=self.sender,
+                    recipients=email["receivers"],
+                )
+        except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+            return e
+        email["refused"] = sorted(refused)
+        return None
+
+    async def release_waves(self, now: Optional[datetime] = None) -> int:
+        """
+        Queues the broadcast waves that are due, unless the API is busy, then
+        they are pushed back by `load_backoff` and the later waves with them
+        """
+        now = now or datetime.utcnow()
+        broadcasts = await broadcast_repo.get_due_broadcasts(now)
+        if not broadcasts:
+            return 0
+        if self.is_overloaded():
+            await broadcast_repo.postpone(
+                [broadcast["_id"] for broadcast in broadcasts], now + self.load_backoff
+            )
+            self.waves_postponed += len(broadcasts)
+            return 0
+        released = 0
+        for broadcast in broadcasts:
+            released += await broadcast_repo.release_wave(broadcast, now)
+        self.waves_released += released
+        return released
+
+    async def drain_once(self) -> int:
+        """Claims and sends one batch, returns how many emails were claimed"""
+        await self.release_waves()
+        batch = await outbox_repo.claim_batch(self.batch_size, self.lease)
+        if not batch:
+            return 0
+        # the pool limits how many are in flight at once
+        errors = await asyncio.gather(*(self.send(email) for email in batch))
+
+        sent = [email for email, error in zip(batch, errors) if error is None]
+        now = datetime.utcnow()
+        await outbox_repo.mark_sent(
+            [email["_id"] for email in sent],
+            {email["_id"]: email["refused"] for email in sent if email["refused"]},
+            now,
+            self.retention,
+        )
+        for email, error in zip(batch, errors):
+            if error is None:
+                continue
+            message = f"{type(error).__name__}: {error}"
+            if is_permanent(error) or email["attempts"] >= self.max_attempts:
+                await outbox_repo.mark_failed(
+                    email["_id"], message, now, self.retention
+                )
+            else:
+                next_attempt_at = now + self.retry_delay(email["attempts"])
+                await outbox_repo.mark_retry(email["_id"], message, next_attempt_at)
+        return len(batch)
+
+    def wake(self):
+        """Start on the next batch now instead of at the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Sends batches until `stop` is called, then closes the connections"""
+        self._wakeup = asyncio.Event()
+        try:
+            await self._run()
+        finally:
+            await self.pool.close()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await self.drain_once()
+            except Exception as e:
+                # e.g. the database is unreachable, try again at the next poll
+                print("ERROR: email outbox:", e)
+                claimed = 0
+            if claimed == self.batch_size:
+                # more are probably waiting
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stop(self):
+        """`run` returns once the batch being sent is done"""
+        self._stopping = True
+        self.wake()
+
+
+def create_worker() -> OutboxWorker:
+    """An `OutboxWorker` set up from db-config.toml"""
+    pool = SMTPPool(
+        hostname=settings.get("smtp-host", "smtp.gmail.com"),
+        port=settings.get("smtp-port", 587),
+        username=settings["email-username"],
+        password=settings["email-password"],
+        start_tls=settings.get("smtp-start-tls", True),
+        size=settings.get("smtp-pool-size", 4),
+    )
+    return OutboxWorker(
+        pool,
+        sender=settings["admin-email"],
+        batch_size=settings.get("email-batch-size", 50),
+        retention=timedelta(days=settings.get("outbox-retention-days", 30)),
+        # only sees the requests of this process, a worker running on its own
+        # sends the waves on schedule
+        is_overloaded=get_load_monitor().is_high,
+    )
+
+
+# the worker running in this process, if any
+_worker: Optional[OutboxWorker] = None
+_task: Optional[asyncio.Task] = None
+
+
+def start_email_worker():
+    """Drains the outbox in the background of this process, call from a startup event"""
+    global _worker, _task
+    if not settings.get("email-worker", True) or _task is not None:
+        return
+    _worker = create_worker()
+    _task = asyncio.get_event_loop().create_task(_worker.run())
+
+
+async def stop_email_worker():
+    """Lets the current batch finish, call from a shutdown event"""
+    global _worker, _task
+    if _task is None:
+        return
+    _worker.stop()
+    await _task
+    _worker, _task = None, None
+
+
+def wake_email_worker():
+    if _worker is not None:
+        _worker.wake()
+
+
+async def main():
+    from backend.connect_to_mongodb import (
+        connect_to_async_mongodb,
+        connect_to_mongodb,
+        disconnect_from_mongodb,
+    )
+
+    connect_to_mongodb()
+    connect_to_async_mongodb()
+    worker = create_worker()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    print("Email outbox worker started")
+    await worker.run()
+    disconnect_from_mongodb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,236 @@
+"""
+Queues a reminder email to the families registered for every meeting that
+starts within the next `reminder-window-hours` (24 by default).
+
+Every web worker runs the scheduler in the background, but only the one
+holding the lease does any work, so they take turns rather than racing.
+Set reminder-scheduler = false in db-config.toml to run it on its own instead:
+
+    python -m backend.main.email_handler.reminder_scheduler
+"""
+import asyncio
+import os
+import signal
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+from backend.main.db.repositories import (
+    lease_repo,
+    mailing_list_repo,
+    meeting_repo,
+    outbox_repo,
+    student_repo,
+)
+from backend.main.email_handler.email_templates import get_templates, meeting_details
+from backend.main.email_handler.outbox_worker import wake_email_worker
+from backend.settings import settings
+
+LEASE_NAME = "meeting-reminders"
+SUBJECT = "Reminder: upcoming Tucson Math Circle meeting"
+
+
+def reminder_emails(meeting: dict, students: Dict[str, dict]) -> List[dict]:
+    """
+    One reminder per address of every family registered for `meeting`,
+    naming the family's registered students. `students` are keyed by id.
+    The key makes the outbox drop a reminder it already has for this meeting
+    at this time
+    """
+    families: Dict[str, dict] = {}
+    for registration in meeting.get("students", []):
+        family = families.setdefault(
+            str(registration["account_uuid"]),
+            {
+                "addresses": mailing_list_repo.profile_addresses(registration),
+                "names": [],
+            },
+        )
+        student = students.get(registration["student_id"])
+        if student is not None and student.get("first_name"):
+            family["names"].append(student["first_name"])
+
+    recipients = [
+        {"email": email, "guardian_name": name, "student_names": family["names"]}
+        for family in families.values()
+        for email, name in family["addresses"].items()
+    ]
+    bodies = get_templates().render_each(
+        "meeting_reminder.html",
+        (
+            {"guardian_name": r["guardian_name"], "student_names": r["student_names"]}
+            for r in recipients
+        ),
+        meeting_details=meeting_details(meeting),
+    )
+    prefix = f"reminder:{meeting['uuid']}:{meeting['date_and_time'].isoformat()}"
+    return [
+        {
+            "receivers": [recipient["email"]],
+            "subject": SUBJECT,
+            "body": body,
+            "key": f"{prefix}:{recipient['email']}",
+        }
+        for recipient, body in zip(recipients, bodies)
+    ]
+
+
+async def send_due_reminders(
+    window: timedelta, limit: int, now: Optional[datetime] = None
+) -> dict:
+    """
+    Queues the reminders of up to `limit` meetings starting within `window`.
+    Four queries however many meetings and families there are: the meetings,
+    the names of their students, the emails and the meetings' markers.
+    Safe to repeat, e.g. after a crash between queueing and marking
+    """
+    now = now or datetime.utcnow()
+    meetings = await meeting_repo.get_meetings_needing_reminder(
+        now, now + window, limit
+    )
+    if not meetings:
+        return {"meetings": 0, "emails": 0}
+    students = await student_repo.get_students_by_ids(
+        meeting_repo.registered_student_ids(meetings), ["first_name"]
+    )
+    emails = [
+        email for meeting in meetings for email in reminder_emails(meeting, students)
+    ]
+    queued = await outbox_repo.enqueue_keyed_emails(emails)
+    await meeting_repo.set_reminders_sent(
+        [meeting["uuid"] for meeting in meetings], now
+    )
+    if queued:
+        wake_email_worker()
+    return {"meetings": len(meetings), "emails": queued}
+
+
+async def send_all_due_reminders(
+    window: timedelta, batch_size: int, now: Optional[datetime] = None
+) -> dict:
+    """`send_due_reminders` in batches of `batch_size` meetings until none are left"""
+    totals = {"meetings": 0, "emails": 0}
+    while True:
+        sent = await send_due_reminders(window, batch_size, now)
+        totals["meetings"] += sent["meetings"]
+        totals["emails"] += sent["emails"]
+        if sent["meetings"] < batch_size:
+            return totals
+
+
+class ReminderScheduler:
+    """
+    Calls `send_due_reminders` every `interval` while holding the lease.
+    The lease outlives a few intervals, so a crashed holder is replaced
+    after at most `lease` and a live one keeps it by renewing every tick
+    """
+
+    def __init__(
+        self,
+        window: timedelta = timedelta(hours=24),
+        interval: float = 60,
+        batch_size: int = 50,
+        lease: Optional[timedelta] = None,
+    ):
+        self.window = window
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease = lease or timedelta(seconds=3 * interval)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def tick(self, now: Optional[datetime] = None) -> Optional[dict]:
+        """One batch of meetings, None when another process holds the lease"""
+        now = now or datetime.utcnow()
+        if not await lease_repo.acquire(LEASE_NAME, self.owner, self.lease, now):
+            return None
+        return await send_due_reminders(self.window, self.batch_size, now)
+
+    async def run(self):
+        """Ticks until `stop` is called, then hands the lease over"""
+        self._wakeup = asyncio.Event()
+        try:
+            await self._run()
+        finally:
+            await lease_repo.release(LEASE_NAME, self.owner)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                result = await self.tick()
+            except Exception as e:
+                print("ERROR: meeting reminders:", e)
+                result = None
+            if result is not None and result["meetings"] == self.batch_size:
+                # more meetings are probably due
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+
+def reminder_window() -> timedelta:
+    return timedelta(hours=settings.get("reminder-window-hours", 24))
+
+
+def create_scheduler() -> ReminderScheduler:
+    """A `ReminderScheduler` set up from db-config.toml"""
+    return ReminderScheduler(
+        window=reminder_window(),
+        interval=settings.get("reminder-interval-seconds", 60),
+        batch_size=settings.get("reminder-batch-size", 50),
+    )
+
+
+# the scheduler running in this process, if any
+_scheduler: Optional[ReminderScheduler] = None
+_task: Optional[asyncio.Task] = None
+
+
+def start_reminder_scheduler():
+    """Runs the scheduler in the background of this process, call from a startup event"""
+    global _scheduler, _task
+    if not settings.get("reminder-scheduler", True) or _task is not None:
+        return
+    _scheduler = create_scheduler()
+    _task = asyncio.get_event_loop().create_task(_scheduler.run())
+
+
+async def stop_reminder_scheduler():
+    """Call from a shutdown event"""
+    global _scheduler, _task
+    if _task is None:
+        return
+    _scheduler.stop()
+    await _task
+    _scheduler, _task = None, None
+
+
+async def main():
+    from backend.connect_to_mongodb import (
+        connect_to_async_mongodb,
+        connect_to_mongodb,
+        disconnect_from_mongodb,
+    )
+
+    connect_to_mongodb()
+    connect_to_async_mongodb()
+    scheduler = create_scheduler()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, scheduler.stop)
+    print("Meeting reminder scheduler started")
+    await scheduler.run()
+    disconnect_from_mongodb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
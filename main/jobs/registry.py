@@ -0,0 +1,26 @@
+from typing import Awaitable, Callable, Dict, Optional
+
+# a handler gets the job's payload and may return a dict stored as its result
+Handler = Callable[[dict], Awaitable[Optional[dict]]]
+
+_handlers: Dict[str, Handler] = {}
+
+
+def job(name: str):
+    """Registers the decorated coroutine function as the handler of `name` jobs"""
+
+    def register(handler: Handler) -> Handler:
+        if name in _handlers:
+            raise ValueError(f"job {name} is already registered")
+        _handlers[name] = handler
+        return handler
+
+    return register
+
+
+def get_handler(name: str) -> Optional[Handler]:
+    return _handlers.get(name)
+
+
+def job_names():
+    return sorted(_handlers)
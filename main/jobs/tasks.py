@@ -0,0 +1,91 @@
+"""
+The jobs the job worker knows how to run, enqueue them with `job_repo.enqueue`
+"""
+from datetime import timedelta
+from typing import Dict
+
+from backend.main.db.mixins import SessionLevel
+from backend.main.db.repositories import (
+    mailing_list_repo,
+    meeting_repo,
+    student_repo,
+)
+from backend.main.email_handler.reminder_scheduler import (
+    reminder_window,
+    send_all_due_reminders,
+)
+from backend.main.jobs.registry import job
+
+
+@job("send_reminders")
+async def send_reminders(payload: dict) -> dict:
+    """Every reminder that is due, in batches of `batch_size` meetings"""
+    window = (
+        timedelta(hours=payload["window_hours"]) if "window_hours" in payload else None
+    )
+    return await send_all_due_reminders(
+        window or reminder_window(), payload.get("batch_size", 50)
+    )
+
+
+@job("rebuild_mailing_lists")
+async def rebuild_mailing_lists(payload: dict) -> dict:
+    entries = await mailing_list_repo.rebuild(payload.get("levels"))
+    return {"entries": entries}
+
+
+def meeting_counts(registered: Dict[str, bool], levels: Dict[str, str]) -> dict:
+    """`StudentDocument.meeting_counts` recomputed from its registrations"""
+    counts = {level.value: {"attended": 0, "registered": 0} for level in SessionLevel}
+    for meeting_uuid, attended in registered.items():
+        level = levels.get(meeting_uuid)
+        if level is None:
+            # the meeting was deleted
+            continue
+        counts[level]["registered"] += 1
+        counts[level]["attended"] += int(bool(attended))
+    return counts
+
+
+@job("reconcile_meeting_counts")
+async def reconcile_meeting_counts(payload: dict) -> dict:
+    """
+    Recomputes every student's registered and attended counts from their
+    registrations, e.g. after a crash between the two writes of a registration.
+    Students are read in chunks with the levels of their meetings loaded by one
+    `$in` per chunk, and only counts that are off are written
+    """
+    chunk_size = payload.get("chunk_size", 500)
+    checked = fixed = 0
+    cursor = student_repo.students_collection().find(
+        {}, {"meetings_registered": 1, "meeting_counts": 1}
+    )
+    chunk = []
+    async for student in cursor.batch_size(chunk_size):
+        chunk.append(student)
+        if len(chunk) < chunk_size:
+            continue
+        fixed += await _reconcile_chunk(chunk)
+        checked += len(chunk)
+        chunk = []
+    fixed += await _reconcile_chunk(chunk)
+    checked += len(chunk)
+    return {"checked": checked, "fixed": fixed}
+
+
+async def _reconcile_chunk(students) -> int:
+    meeting_uuids = {
+        meeting_uuid
+        for student in students
+        for meeting_uuid in student.get("meetings_registered", {})
+    }
+    levels = await meeting_repo.get_meeting_levels(meeting_uuids)
+    fixed = 0
+    for student in students:
+        expected = meeting_counts(student.get("meetings_registered", {}), levels)
+        if student.get("meeting_counts") != expected:
+            await student_repo.update_student(
+                student["_id"], {"meeting_counts": expected}
+            )
+            fixed += 1
+    return fixed
@@ -0,0 +1,171 @@
+"""
+Runs the jobs in the job queue (see `JobDocument`), in its own process so
+that long jobs never hold up requests:
+
+    python -m backend.main.jobs.worker
+
+Claims are atomic, so any number of these can run side by side.
+"""
+import asyncio
+import os
+import random
+import signal
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+
+from backend.main.db.repositories import job_repo
+from backend.main.jobs import tasks  # noqa: F401, registers the handlers
+from backend.main.jobs.registry import get_handler
+from backend.settings import settings
+
+
+class JobWorker:
+    """
+    Up to `concurrency` jobs at a time. A running job's lease is renewed every
+    third of `lease`, so only a job whose worker died is run again
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        lease: timedelta = timedelta(minutes=2),
+        poll_interval: float = 2,
+        backoff: timedelta = timedelta(seconds=30),
+        max_backoff: timedelta = timedelta(hours=1),
+        retention: timedelta = job_repo.RETENTION,
+    ):
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # done and failed jobs are deleted this long after
+        self.retention = retention
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def retry_delay(self, attempts: int) -> timedelta:
+        """Exponential backoff with jitter: 30s, 1m, 2m, ... up to `max_backoff`"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.0)
+
+    async def run_one(self) -> bool:
+        """Claims and runs one job, False when none was due"""
+        job = await job_repo.claim(self.name, self.lease)
+        if job is None:
+            return False
+        await self.execute(job)
+        return True
+
+    async def execute(self, job: dict):
+        handler = get_handler(job["name"])
+        if handler is None:
+            await job_repo.fail(
+                job, f"no handler for job {job['name']}", retention=self.retention
+            )
+            self.failed += 1
+            return
+
+        renewer = asyncio.get_event_loop().create_task(self._renew(job))
+        try:
+            result = await handler(job.get("payload") or {})
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+            if job["attempts"] >= job.get("max_attempts", 5):
+                await job_repo.fail(job, message, retention=self.retention)
+                self.failed += 1
+            else:
+                run_at = datetime.utcnow() + self.retry_delay(job["attempts"])
+                await job_repo.retry(job, message, run_at)
+                self.retried += 1
+            return
+        finally:
+            renewer.cancel()
+        await job_repo.complete(job, result, retention=self.retention)
+        self.completed += 1
+
+    async def _renew(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            if not await job_repo.renew(job, self.lease):
+                return
+
+    async def _slot(self):
+        while not self._stopping:
+            try:
+                ran = await self.run_one()
+            except Exception as e:
+                # e.g. the database is unreachable, try again at the next poll
+                print("ERROR: job worker:", e)
+                ran = False
+            if ran:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reaper(self):
+        while not self._stopping:
+            try:
+                await job_repo.requeue_expired(retention=self.retention)
+            except Exception as e:
+                print("ERROR: job worker:", e)
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.lease.total_seconds() / 2
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        """Runs jobs until `stop` is called, then lets the running ones finish"""
+        self._wakeup = asyncio.Event()
+        await asyncio.gather(
+            self._reaper(), *(self._slot() for _ in range(self.concurrency))
+        )
+
+    def stop(self):
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.name,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+async def main():
+    from backend.connect_to_mongodb import (
+        connect_to_async_mongodb,
+        connect_to_mongodb,
+        disconnect_from_mongodb,
+    )
+
+    connect_to_mongodb()
+    connect_to_async_mongodb()
+    worker = JobWorker(
+        concurrency=settings.get("job-concurrency", 4),
+        retention=timedelta(days=settings.get("job-retention-days", 30)),
+    )
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    print("Job worker started:", worker.name)
+    await worker.run()
+    print("Job worker stopped:", worker.stats())
+    disconnect_from_mongodb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,30 @@
+"""
+Fills the mailing list recipients (see `MailingListRecipientDocument`) from
+the student profiles. Run once after deploying them, profile changes keep
+them current afterwards:
+
+    python -m backend.main.scripts.rebuild_mailing_lists [junior_a ...]
+"""
+import asyncio
+import sys
+
+from backend.connect_to_mongodb import (
+    connect_to_async_mongodb,
+    connect_to_mongodb,
+    disconnect_from_mongodb,
+)
+from backend.main.db.repositories import mailing_list_repo
+
+
+async def main(levels):
+    connect_to_mongodb()
+    connect_to_async_mongodb()
+    try:
+        count = await mailing_list_repo.rebuild(levels or None)
+        print(f"Wrote {count} mailing list entries")
+    finally:
+        disconnect_from_mongodb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,35 +1,46 @@
-# hack to add project directory to path and make modules work nicely
-import sys
-from pathlib import Path
-
-PROJECTS_DIR = Path(__file__).resolve().parents[3]
-print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
-sys.path.append(str(PROJECTS_DIR))
-# end hack
-
-from datetime import timedelta
-
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 # main db imports
-from backend.main.src.routers import student, admin
-from backend.connect_to_mongodb import connect_to_mongodb, connect_to_auth_db
+from backend.main.src.routers import student, admin, files
+from backend.admission import AdmissionMiddleware
+from backend.connect_to_mongodb import (
+    connect_to_mongodb,
+    connect_to_async_mongodb,
+    connect_to_auth_db,
+    disconnect_from_mongodb,
+)
 from backend.main.db.mixins import PresignedPostUrlInfo
+from backend.main.email_handler.email_templates import get_templates
+from backend.main.email_handler.outbox_worker import (
+    start_email_worker,
+    stop_email_worker,
+)
+from backend.main.email_handler.reminder_scheduler import (
+    start_reminder_scheduler,
+    stop_reminder_scheduler,
+)
+from backend.main.src.idempotency import IdempotencyMiddleware
+from backend.main.src.load_monitor import LoadMiddleware, get_load_monitor
+from backend.main.src.roster_events import start_event_bridge, stop_event_bridge
+from backend.main.storage.base import get_storage
+from backend.mongo_clients import warm_pools
 
 # auth db imports
 from backend.auth.dependencies import (
     Token,
     TokenData,
-    create_access_token,
+    create_user_access_token,
     authenticate_user,
-    ACCESS_TOKEN_EXPIRE_MIN,
-    create_presigned_post,
     get_current_token_data,
 )
 from backend.auth.db.main import get_user_by_email
+from backend.auth.revocation import (
+    start_revocation_refresher,
+    stop_revocation_refresher,
+)
 
 # flag which controls whether a connection to the auth_db is opened
 TESTING = True
@@ -39,6 +50,8 @@ app = FastAPI()
 
 app.include_router(student.router, prefix="/student", tags=["Students"])
 app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+# downloads and uploads when storage-backend is "local"
+app.include_router(files.router, prefix="/files", tags=["Files"])
 
 # TODO: make a list of origins, for now the server allows requests from everywhere
 # possible a origin_regex could be used instead which matches anything that starts with
@@ -48,20 +61,67 @@ origins = [
     "*",
 ]
 
+# replays the stored response to retries sent with an Idempotency-Key header,
+# added first so the CORS headers are set for the replays too
+app.add_middleware(IdempotencyMiddleware)
+# concurrency limits and wait queues per route class, inside CORS so the 503s
+# can be read by the frontend; admin requests are turned away first when the
+# load monitor says the worker is busy
+app.add_middleware(
+    AdmissionMiddleware,
+    is_busy=lambda: get_load_monitor().is_high(),
+    exclude_paths=["/admin/roster_events", "/admin/get_admission_stats"],
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # routes that change the student list send a refreshed token in this header,
+    # the local storage backend returns the ETag of uploaded parts,
+    # student/get_meetings the cursor for syncing changes and the age of the
+    # listing, and replayed idempotent responses are marked
+    expose_headers=[
+        "X-Access-Token",
+        "ETag",
+        "X-Meetings-Cursor",
+        "Age",
+        "X-Meetings-Stale",
+        "Idempotent-Replayed",
+    ],
 )
+# counts requests in flight, broadcast waves wait while there are too many
+app.add_middleware(LoadMiddleware, exclude_paths=["/admin/roster_events"])
 
 
 # These two functions are here to make the Authorize button work on FastAPI docs
 @app.on_event("startup")
 async def startup():
+    # under gunicorn every worker runs this after the fork, so no connection is
+    # ever shared between processes
+    connect_to_mongodb()
+    connect_to_async_mongodb()
     if TESTING:
         connect_to_auth_db()
+        await start_revocation_refresher()
+    await warm_pools()
+    # compiled once here rather than by the first request that sends an email
+    get_templates()
+    start_email_worker()
+    start_reminder_scheduler()
+    await start_event_bridge()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # runs after the server has drained in-flight requests
+    await stop_revocation_refresher()
+    await stop_reminder_scheduler()
+    await stop_event_bridge()
+    # finishes the batch of emails being sent
+    await stop_email_worker()
+    disconnect_from_mongodb()
 
 
 @app.post("/token", response_model=Token)
@@ -77,11 +137,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MIN)
-    access_token = create_access_token(
-        data={"sub": str(user.id), "role": user.role},
-        expires_delta=access_token_expires,
-    )
+    access_token = create_user_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -89,7 +145,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 async def generate_presigned_post_url(
     info: PresignedPostUrlInfo, token_data: TokenData = Depends(get_current_token_data)
 ):
-    response = create_presigned_post(info.object_name, info.fields, info.conditions)
+    response = get_storage().create_presigned_post(
+        info.object_name, info.fields, info.conditions
+    )
 
     if response is not None:
         return response
@@ -97,6 +155,7 @@ async def generate_presigned_post_url(
     return {"details": "Could not generate presigned url"}
 
 
+# local development only, production runs gunicorn, see gunicorn.conf.py.
+# Run from the directory containing the checkout: python -m backend.main.src.app
 if __name__ == "__main__":
-    connect_to_mongodb()
     uvicorn.run(app, host="127.0.0.1", port=9000)
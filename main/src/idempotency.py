@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from starlette.responses import JSONResponse
+
+from backend.auth.dependencies import get_token_subject
+from backend.main.db.docs.idempotency_doc import DONE
+from backend.main.db.repositories import idempotency_repo
+from backend.settings import settings
+
+HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+MAX_KEY_LENGTH = 255
+# credentials are not kept with the stored response, a replay goes without them
+UNSTORED_HEADERS = frozenset({"set-cookie", "x-access-token"})
+
+
+def request_key(scope, idempotency_key: bytes) -> str:
+    """
+    The header scoped to the caller and the route. The caller is the user of
+    the access token, so a retry sent with a refreshed token still finds the
+    first request, or the raw Authorization header when it does not verify
+    """
+    authorization = dict(scope["headers"]).get(b"authorization", b"")
+    subject = get_token_subject(authorization.decode("latin-1"))
+    caller = b"sub:" + subject.encode() if subject else authorization
+    digest = hashlib.sha256()
+    for part in (caller, scope["method"].encode(), scope["path"].encode()):
+        digest.update(part + b"\n")
+    digest.update(idempotency_key)
+    return digest.hexdigest()
+
+
+def request_fingerprint(scope, body: bytes) -> str:
+    return hashlib.sha256(scope["query_string"] + b"\n" + body).hexdigest()
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware for requests with an `Idempotency-Key` header, e.g. a
+    parent's phone retrying add_profile on a flaky connection. The first
+    request with a key runs and its response is stored for `ttl`; retries get
+    the stored response back, less the `UNSTORED_HEADERS`, marked with an
+    `Idempotent-Replayed` header, for the cost of one lookup. Duplicates
+    arriving while the first is still running wait for it instead of running
+    again: in this process on the running request itself, across processes by
+    polling its pending record.
+    A key reused with a different body gets a 422, a duplicate still waiting
+    after `wait` a 409. Failed requests (5xx or an exception) are not stored,
+    so a retry runs them again
+    """
+
+    def __init__(
+        self,
+        app,
+        methods: Iterable[str] = ("POST", "PUT"),
+        exclude_paths: Iterable[str] = (),
+        ttl: Optional[timedelta] = None,
+        lease: timedelta = timedelta(seconds=60),
+        wait: float = 10,
+        poll_interval: float = 0.1,
+    ):
+        self.app = app
+        self.methods = frozenset(methods)
+        self.exclude_paths = frozenset(exclude_paths)
+        self._ttl = ttl
+        self.lease = lease
+        self.wait = wait
+        self.poll_interval = poll_interval
+        # requests running in this process by key, resolved with the stored
+        # record or None when it failed
+        self._running: Dict[str, asyncio.Future] = {}
+
+    @property
+    def ttl(self) -> timedelta:
+        if self._ttl is None:
+            self._ttl = timedelta(hours=settings.get("idempotency-ttl-hours", 24))
+        return self._ttl
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in self.methods
+            or scope["path"] in self.exclude_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = dict(scope["headers"]).get(HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                status_code=400,
+                content={
+                    "detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"
+                },
+            )
+            await response(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        key = request_key(scope, idempotency_key)
+        fingerprint = request_fingerprint(scope, body)
+        deadline = time.monotonic() + self.wait
+        while True:
+            running = self._running.get(key)
+            if running is not None:
+                record = await asyncio.shield(running)
+                if record is None:
+                    # it failed, so this duplicate runs it again
+                    continue
+            else:
+                record = await idempotency_repo.claim(
+                    key, fingerprint, self.lease, self.ttl
+                )
+                if record is None:
+                    await self._run(key, fingerprint, body, scope, receive, send)
+                    return
+
+            if record["fingerprint"] != fingerprint:
+                response = JSONResponse(
+                    status_code=422,
+                    content={
+                        "detail": "Idempotency-Key was already used for a different request"
+                    },
+                )
+                await response(scope, receive, send)
+                return
+            if record["status"] == DONE:
+                await self._replay(record, send)
+                return
+            # running in another process
+            if time.monotonic() >= deadline:
+                response = JSONResponse(
+                    status_code=409,
+                    content={
+                        "detail": "A request with this Idempotency-Key is in progress"
+                    },
+                    headers={"Retry-After": "1"},
+                )
+                await response(scope, receive, send)
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run(self, key: str, fingerprint: str, body: bytes, scope, receive, send):
+        running = self._running[key] = asyncio.get_event_loop().create_future()
+        sent_body = False
+
+        async def replay_receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status_code": 500, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                response["headers"] = [
+                    (name.decode("latin-1"), value.decode("latin-1"))
+                    for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        record = None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if response["status_code"] < 500:
+                record = {
+                    "fingerprint": fingerprint,
+                    "status": DONE,
+                    "status_code": response["status_code"],
+                    "headers": [
+                        (name, value)
+                        for name, value in response["headers"]
+                        if name.lower() not in UNSTORED_HEADERS
+                    ],
+                    "body": b"".join(response["body"]),
+                }
+                await idempotency_repo.complete(
+                    key, record["status_code"], record["headers"], record["body"]
+                )
+            else:
+                await idempotency_repo.abandon(key)
+        except BaseException:
+            await idempotency_repo.abandon(key)
+            raise
+        finally:
+            running.set_result(record)
+            del self._running[key]
+
+    async def _replay(self, record: dict, send):
+        headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in record["headers"]
+        ]
+        headers.append((REPLAYED_HEADER, b"true"))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": record["status_code"],
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": bytes(record["body"])})
@@ -0,0 +1,97 @@
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from backend.settings import settings
+
+
+class LoadMonitor:
+    """
+    Requests in flight and a moving average of their duration in this worker.
+    Background work that can wait, like the next wave of a broadcast, checks
+    `is_high` and backs off while the API is busy
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 50,
+        max_latency: float = 1.0,
+        smoothing: float = 0.1,
+        stale_after: float = 30,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_latency = max_latency
+        self.smoothing = smoothing
+        # with no requests for this long the average says nothing about now
+        self.stale_after = stale_after
+        self.in_flight = 0
+        self.requests = 0
+        self.latency = 0.0
+        self.last_finished: Optional[float] = None
+
+    def started(self):
+        self.in_flight += 1
+
+    def finished(self, duration: float):
+        self.in_flight -= 1
+        self.requests += 1
+        if self.requests == 1:
+            self.latency = duration
+        else:
+            self.latency += self.smoothing * (duration - self.latency)
+        self.last_finished = time.monotonic()
+
+    def is_high(self) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return True
+        recent = (
+            self.last_finished is not None
+            and time.monotonic() - self.last_finished < self.stale_after
+        )
+        return recent and self.latency >= self.max_latency
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "average_latency_ms": round(self.latency * 1000, 1),
+            "high": self.is_high(),
+        }
+
+
+class LoadMiddleware:
+    """
+    ASGI middleware feeding every HTTP request to `monitor`, except those to
+    `exclude_paths`, e.g. event streams that stay open for hours
+    """
+
+    def __init__(
+        self,
+        app,
+        monitor: Optional[LoadMonitor] = None,
+        exclude_paths: Iterable[str] = (),
+    ):
+        self.app = app
+        self.monitor = monitor
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        monitor = self.monitor or get_load_monitor()
+        monitor.started()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            monitor.finished(time.perf_counter() - start)
+
+
+@lru_cache(maxsize=None)
+def get_load_monitor() -> LoadMonitor:
+    """This worker's monitor, thresholds from db-config.toml"""
+    return LoadMonitor(
+        max_in_flight=settings.get("high-load-in-flight", 50),
+        max_latency=settings.get("high-load-latency-ms", 1000) / 1000,
+    )
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import time
+from functools import lru_cache
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from fastapi.encoders import jsonable_encoder
+
+from backend.main.db.mixins import SessionLevel
+from backend.main.db.repositories import meeting_repo
+from backend.settings import settings
+
+# why a cached catalog was served after its soft TTL
+REVALIDATING = "revalidating"
+ERROR = "error"
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one run of the function: the
+    first starts it, the others await its result. Nothing is kept once it
+    finishes, so a later call runs it again
+    """
+
+    def __init__(self):
+        self._running: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.runs = 0
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable]):
+        self.calls += 1
+        running = self._running.get(key)
+        if running is None:
+            self.runs += 1
+            running = self._running[key] = asyncio.ensure_future(function())
+            running.add_done_callback(lambda _: self._forget(key, running))
+        # a caller that is cancelled, e.g. the client went away, does not
+        # cancel the run the others are waiting for
+        return await asyncio.shield(running)
+
+    def _forget(self, key: Hashable, running: asyncio.Future):
+        if self._running.get(key) is running:
+            del self._running[key]
+
+    def stats(self) -> dict:
+        coalesced = self.calls - self.runs
+        return {
+            "calls": self.calls,
+            "runs": self.runs,
+            "coalesced": coalesced,
+            "in_flight": len(self._running),
+            "coalescing_ratio": round(coalesced / self.calls, 3) if self.calls else 0.0,
+        }
+
+
+def encode(value) -> bytes:
+    """The bytes JSONResponse would send for `value`"""
+    return json.dumps(
+        jsonable_encoder(value),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class CatalogMeeting(NamedTuple):
+    uuid: str
+    # `meeting_student_dict` encoded, the same for every student
+    encoded: bytes
+
+
+class Catalog(NamedTuple):
+    """The meetings of some levels, encoded once for everyone who asked for them"""
+
+    # taken before the query, see `meeting_repo.get_meetings_cursor`
+    cursor: int
+    meetings: List[CatalogMeeting]
+
+    def listing(self, students: List[dict]) -> bytes:
+        """
+        The student/get_meetings response for a family with `students`: each
+        encoded meeting with the family's registrations spliced in before its
+        closing brace. Registrations come from the students' own
+        `meetings_registered`, loaded for the request, so they are current
+        even when the catalog is not
+        """
+        parts = []
+        for meeting in self.meetings:
+            registrations = [
+                {
+                    "id": str(st["_id"]),
+                    "first_name": st["first_name"],
+                    "last_name": st["last_name"],
+                    "registered": meeting.uuid in st.get("meetings_registered", {}),
+                }
+                for st in students
+            ]
+            parts.append(
+                meeting.encoded[:-1]
+                + b',"registrations":'
+                + encode(registrations)
+                + b"}"
+            )
+        return b"[" + b",".join(parts) + b"]"
+
+
+async def load_catalog(levels: List[str]) -> Catalog:
+    cursor = await meeting_repo.get_meetings_cursor()
+    meetings = await meeting_repo.get_meetings_by_session_levels(levels)
+    return Catalog(
+        cursor,
+        [
+            CatalogMeeting(
+                str(meeting["uuid"]),
+                encode(meeting_repo.meeting_student_dict(meeting)),
+            )
+            for meeting in meetings
+        ],
+    )
+
+
+class CachedCatalog:
+    def __init__(self, catalog: Catalog, loaded_at: float):
+        self.catalog = catalog
+        self.loaded_at = loaded_at
+        # when the last refresh failed, None after a successful one
+        self.failed_at: Optional[float] = None
+
+
+class MeetingCatalog:
+    """
+    The meeting listing of student/get_meetings, cached per set of levels.
+    Identical requests arriving together, e.g. a whole class opening the page
+    when the session starts, share one query and one encoding of the meetings.
+
+    A catalog younger than `soft_ttl` is served as is. Up to `hard_ttl` it is
+    still served right away while one refresh runs in the background, and
+    when that refresh fails, e.g. the cluster is unreachable, it keeps being
+    served (retrying at most every `retry_interval`). Only a catalog older
+    than `hard_ttl`, or none at all, makes a request wait for the database
+    """
+
+    def __init__(
+        self,
+        soft_ttl: float = 2,
+        hard_ttl: float = 300,
+        retry_interval: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.flight = SingleFlight()
+        self._cache: Dict[Tuple[str, ...], CachedCatalog] = {}
+        self._refreshing: Dict[Tuple[str, ...], asyncio.Task] = {}
+        self.hits = 0
+        self.stale = 0
+        self.stale_if_error = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    async def get(
+        self, levels: List[SessionLevel]
+    ) -> Tuple[Catalog, float, Optional[str]]:
+        """
+        The catalog of `levels`, its age in seconds, and None when it is
+        fresh or why it is served stale: REVALIDATING or ERROR
+        """
+        key = tuple(SessionLevel(level).value for level in levels)
+        cached = self._cache.get(key)
+        now = self.clock()
+        if cached is not None:
+            age = now - cached.loaded_at
+            if age < self.soft_ttl:
+                self.hits += 1
+                return cached.catalog, age, None
+            if age < self.hard_ttl:
+                retry_at = (cached.failed_at or 0) + self.retry_interval
+                if key not in self._refreshing and now >= retry_at:
+                    self._refreshing[key] = asyncio.ensure_future(self._refresh(key))
+                if cached.failed_at is not None:
+                    self.stale_if_error += 1
+                    return cached.catalog, age, ERROR
+                self.stale += 1
+                return cached.catalog, age, REVALIDATING
+
+        self.misses += 1
+        catalog = await self._load(key)
+        return catalog, 0.0, None
+
+    async def _load(self, key: Tuple[str, ...]) -> Catalog:
+        catalog = await self.flight.do(key, lambda: load_catalog(list(key)))
+        self._cache[key] = CachedCatalog(catalog, self.clock())
+        return catalog
+
+    async def _refresh(self, key: Tuple[str, ...]):
+        try:
+            await self._load(key)
+        except Exception as e:
+            self.refresh_errors += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                cached.failed_at = self.clock()
+            print(f"ERROR: could not refresh the meeting catalog {key}: {e!r}")
+        finally:
+            del self._refreshing[key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale": self.stale,
+            "stale_if_error": self.stale_if_error,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+            "refreshing": len(self._refreshing),
+            "flight": self.flight.stats(),
+        }
+
+
+@lru_cache(maxsize=None)
+def get_meeting_catalog() -> MeetingCatalog:
+    """This worker's catalog, TTLs from db-config.toml"""
+    return MeetingCatalog(
+        soft_ttl=settings.get("catalog-soft-ttl-seconds", 2),
+        hard_ttl=settings.get("catalog-hard-ttl-seconds", 300),
+    )
@@ -0,0 +1,290 @@
+"""
+Live roster changes for the coordinators' SSE streams, see `admin/roster_events`.
+
+The registration and attendance routes publish small events to the hub of
+their worker, which hands them to the streams subscribed to the meeting or
+its session level. With redis-url set in db-config.toml the events also go
+through a Redis channel, so a stream sees the changes made on every worker.
+"""
+import asyncio
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+from uuid import uuid4
+
+from backend.settings import settings
+
+# every worker publishes to and listens on this channel
+REDIS_CHANNEL = "roster-events"
+
+
+def event_topics(event: dict) -> List[str]:
+    return [f"meeting:{event['meeting_id']}", f"level:{event['session_level']}"]
+
+
+def roster_event(
+    kind: str, meeting_id, session_level: str, student_id, **fields
+) -> dict:
+    """A registered, unregistered or attended event, JSON ready"""
+    return {
+        "type": kind,
+        "meeting_id": str(meeting_id),
+        "session_level": session_level,
+        "student_id": str(student_id),
+        "at": datetime.utcnow().isoformat(),
+        **fields,
+    }
+
+
+class Subscription:
+    """
+    The events of some topics, queued until the stream sends them.
+    A stream that falls `max_queued` events behind loses the oldest ones
+    rather than holding up the publishers
+    """
+
+    def __init__(self, hub: "EventHub", topics: List[str], max_queued: int = 100):
+        self.hub = hub
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(max_queued)
+        self.dropped = 0
+
+    def deliver(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """The next event, None if there was none for `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """In process pub/sub, optionally bridged to the other workers by `RedisBridge`"""
+
+    def __init__(self):
+        self.subscriptions: Dict[str, Set[Subscription]] = {}
+        self.bridge: Optional["RedisBridge"] = None
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, topics: Iterable[str], max_queued: int = 100) -> Subscription:
+        subscription = Subscription(self, list(topics), max_queued)
+        for topic in subscription.topics:
+            self.subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self.subscriptions.get(topic, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(topic, None)
+
+    def deliver(self, event: dict):
+        """Hands `event` to this worker's subscriptions, once each"""
+        subscribers = set()
+        for topic in event_topics(event):
+            subscribers.update(self.subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        self.delivered += len(subscribers)
+
+    async def publish(self, event: dict):
+        """
+        Delivers `event` here and through the bridge to the other workers.
+        The roster change is already saved, so a Redis error is only logged
+        """
+        self.published += 1
+        self.deliver(event)
+        if self.bridge is not None:
+            try:
+                await self.bridge.publish(event)
+            except Exception as e:
+                print("ERROR: could not publish roster event to Redis:", e)
+
+    def stats(self) -> dict:
+        subscriptions = {s for subs in self.subscriptions.values() for s in subs}
+        return {
+            "subscriptions": len(subscriptions),
+            "topics": len(self.subscriptions),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": sum(s.dropped for s in subscriptions),
+            "bridged": self.bridge is not None,
+        }
+
+
+class RedisBridge:
+    """
+    Publishes this worker's events to `REDIS_CHANNEL` and delivers the other
+    workers' events from it. `connect` returns an aioredis 1.x connection.
+    When the subscription is lost, e.g. Redis restarted, it subscribes again,
+    waiting `backoff`, then twice as long after every failure up to `max_backoff`
+    """
+
+    def __init__(
+        self,
+        hub: EventHub,
+        connect: Callable[[], Awaitable],
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+    ):
+        self.hub = hub
+        self.connect = connect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # a worker's own events were delivered when they were published
+        self.origin = uuid4().hex
+        self.reconnects = 0
+        self.bad_messages = 0
+        self._publisher = None
+        self._subscriber = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._publisher = await self.connect()
+        channel = await self._subscribe()
+        self._task = asyncio.get_event_loop().create_task(self._run(channel))
+        self.hub.bridge = self
+
+    async def publish(self, event: dict):
+        message = json.dumps({"origin": self.origin, "event": event})
+        await self._publisher.publish(REDIS_CHANNEL, message)
+
+    async def _subscribe(self):
+        self._subscriber = await self.connect()
+        [channel] = await self._subscriber.subscribe(REDIS_CHANNEL)
+        return channel
+
+    async def _close_subscriber(self):
+        subscriber, self._subscriber = self._subscriber, None
+        if subscriber is not None:
+            subscriber.close()
+            await subscriber.wait_closed()
+
+    async def _run(self, channel):
+        delay = self.backoff
+        while True:
+            if channel is not None:
+                await self._listen(channel)
+                delay = self.backoff
+            if self._stopping:
+                return
+            # the channel closed without `stop`, the connection was lost
+            await self._close_subscriber()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            try:
+                channel = await self._subscribe()
+                self.reconnects += 1
+            except Exception as e:
+                print("ERROR: could not subscribe to roster events in Redis:", e)
+                channel = None
+                delay = min(self.max_backoff, delay * 2)
+
+    async def _listen(self, channel):
+        """Delivers the other workers' events until the channel closes"""
+        try:
+            while await channel.wait_message():
+                try:
+                    message = json.loads(await channel.get(encoding="utf-8"))
+                    if message.get("origin") != self.origin:
+                        self.hub.deliver(message["event"])
+                except Exception as e:
+                    # one bad message must not end the subscription
+                    self.bad_messages += 1
+                    print("ERROR: could not deliver roster event from Redis:", e)
+        except Exception as e:
+            print("ERROR: roster events subscription to Redis lost:", e)
+
+    async def stop(self):
+        self.hub.bridge = None
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._subscriber is not None:
+            try:
+                await self._subscriber.unsubscribe(REDIS_CHANNEL)
+            except Exception:
+                # the connection is gone already, closing it ends the listener
+                self._subscriber.close()
+        if self._task is not None:
+            await self._task
+        await self._close_subscriber()
+        if self._publisher is not None:
+            self._publisher.close()
+            await self._publisher.wait_closed()
+
+
+def format_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def event_stream(request, subscription: Subscription, heartbeat: float = 15):
+    """
+    Server-Sent Events for `subscription` until the client goes away.
+    A comment every `heartbeat` seconds keeps proxies from closing the
+    connection and notices a client that left
+    """
+    try:
+        # how long EventSource waits before reconnecting
+        yield "retry: 3000\n\n"
+        while True:
+            event = await subscription.get(heartbeat)
+            if await request.is_disconnected():
+                return
+            yield ": keepalive\n\n" if event is None else format_event(event)
+    finally:
+        subscription.close()
+
+
+@lru_cache(maxsize=None)
+def get_event_hub() -> EventHub:
+    """This worker's hub"""
+    return EventHub()
+
+
+async def publish_roster_event(
+    kind: str, meeting_id, session_level: str, student_id, **fields
+):
+    await get_event_hub().publish(
+        roster_event(kind, meeting_id, session_level, student_id, **fields)
+    )
+
+
+_bridge: Optional[RedisBridge] = None
+
+
+async def start_event_bridge():
+    """Joins the workers' hubs through Redis when redis-url is set, call on startup"""
+    global _bridge
+    url = settings.get("redis-url")
+    if not url or _bridge is not None:
+        return
+    import aioredis
+
+    _bridge = RedisBridge(get_event_hub(), lambda: aioredis.create_redis_pool(url))
+    await _bridge.start()
+
+
+async def stop_event_bridge():
+    global _bridge
+    if _bridge is not None:
+        await _bridge.stop()
+        _bridge = None
@@ -1,20 +1,27 @@
-from fastapi import Depends, APIRouter, HTTPException, status, BackgroundTasks
-from pydantic import UUID4
-from starlette.responses import JSONResponse
+from datetime import timezone
+
+from bson import ObjectId
+from typing import Optional
 
-from backend.main.email_handler.email_handler import EmailSchema, email_handler
+from fastapi import Depends, APIRouter, HTTPException, Request, status
+from pydantic import UUID4
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 
-from backend.main.src.routers.student import (
-    student_meeting_index,
-    update_meeting_count,
+from backend.admission import admission_stats
+from backend.main.email_handler.email_handler import (
+    EmailSchema,
+    broadcast_email_handler,
+)
+from backend.main.email_handler.email_templates import get_templates, meeting_details
+from backend.main.email_handler.reminder_scheduler import (
+    reminder_window,
+    send_all_due_reminders,
 )
 
 # main db imports
 from backend.main.db.models.student_models import StudentVerification
-from backend.main.db.docs.student_doc import StudentDocument
-from backend.main.db.docs.student_profile_doc import (
-    StudentProfileDocument,
-)
+from backend.main.db.models.job_model import JobRequest
 from backend.main.db.models.meeting_model import (
     CreateMeetingModel,
     MeetingSearchModel,
@@ -22,131 +29,284 @@ from backend.main.db.models.meeting_model import (
     UpdateMeeting,
     StudentMeetingAttendance,
     MeetingIdModel,
+    MaterialsUploadStart,
+    MaterialsUpload,
+    MaterialsUploadParts,
+    MaterialsUploadComplete,
+)
+from backend.main.db.repositories import (
+    broadcast_repo,
+    job_repo,
+    mailing_list_repo,
+    meeting_repo,
+    outbox_repo,
+    student_repo,
+    student_profile_repo as profile_repo,
 )
-from backend.main.db.docs.meeting_doc import (
-    document as MeetingDoc,
-    MeetingDocument,
+from backend.main.jobs.registry import get_handler
+from backend.main.jobs import tasks  # noqa: F401, registers the job names
+from backend.main.src.load_monitor import get_load_monitor
+from backend.main.src.meeting_catalog import get_meeting_catalog
+from backend.main.src.roster_events import (
+    event_stream,
+    get_event_hub,
+    publish_roster_event,
 )
+from backend.main.storage.base import get_storage
+from backend.mongo_clients import pool_stats
 from backend.main.db.password_generator import generate_random_password
-from backend.main.db.mixins import PydanticObjectId
+from backend.main.db.mixins import PydanticObjectId, SessionLevel
 
 # auth db imports
 from backend.auth.dependencies import (
     TokenData,
     get_admin_token_data,
-    create_presigned_url,
 )
 
 router = APIRouter()
 
+REMINDER_BATCH_SIZE = 50
 
-def update_attendance(
-    meeting_doc: MeetingDocument, attendance: StudentMeetingAttendance
-):
-    st_query = StudentDocument.objects(id=attendance.student_id)
-    if len(st_query) < 1:
+
+async def update_attendance(meeting: dict, attendance: StudentMeetingAttendance):
+    updated = await student_repo.set_student_attendance(
+        attendance.student_id,
+        attendance.meeting_id,
+        meeting["session_level"],
+        attendance.attended,
+    )
+    if not updated:
         print("ERROR: update_student_attendance, could not find Student Document")
-    else:
-        student = st_query[0]
-        student.meetings_registered[str(attendance.meeting_id)] = attendance.attended
-        update_count = 1 if attendance.attended else -1
-        update_meeting_count(student, meeting_doc.session_level, attended=update_count)
-        student.save()
-
-    index = student_meeting_index(meeting_doc, attendance.student_id)
-    if index is not None:
-        meeting_doc.students[index]["attended"] = attendance.attended
-        meeting_doc.save()
-    else:
+
+    updated = await meeting_repo.set_meeting_attendance(
+        attendance.meeting_id, attendance.student_id, attendance.attended
+    )
+    if not updated:
         print("ERROR: update_student_attendance, student not registered for meeting")
+        return
+    await publish_roster_event(
+        "attended",
+        attendance.meeting_id,
+        meeting["session_level"],
+        attendance.student_id,
+        attended=attendance.attended,
+    )
+
+
+async def meetings_admin_dicts(meetings):
+    # one query for the names of every student registered for `meetings`
+    students = await student_repo.get_students_by_ids(
+        meeting_repo.registered_student_ids(meetings), ["first_name", "last_name"]
+    )
+    return [meeting_repo.meeting_admin_dict(meeting, students) for meeting in meetings]
 
 
 # GET routes
 @router.get("/get_student_profiles")
-def get_student_profiles(token_data: TokenData = Depends(get_admin_token_data)):
+async def get_student_profiles(token_data: TokenData = Depends(get_admin_token_data)):
+    profiles = await profile_repo.get_all_profiles()
+    # load the students of every profile with a single query
+    student_ids = [sid for profile in profiles for sid in profile.get("students", [])]
+    students = await student_repo.get_students_by_ids(student_ids)
     all_profiles = []
-    for profile in StudentProfileDocument.objects():
-        all_profiles.append(profile.dict())
+    for profile in profiles:
+        profile_students = [
+            students[str(sid)]
+            for sid in profile.get("students", [])
+            if str(sid) in students
+        ]
+        all_profiles.append(profile_repo.profile_dict(profile, profile_students))
     return all_profiles
 
 
 @router.post("/send_reminder_email")
-def send_reminder_email(token_data: TokenData = Depends(get_admin_token_data)):
-    # TODO:setup student doc for verified email
-    pass
+async def send_reminder_email(token_data: TokenData = Depends(get_admin_token_data)):
+    """
+    Queues the reminders of the meetings starting soon without waiting for the
+    scheduler, families that already got theirs are skipped
+    """
+    return await send_all_due_reminders(reminder_window(), REMINDER_BATCH_SIZE)
 
 
 @router.post("/send_new_meeting_email")
-def send_new_meeting_email(
-    background_task: BackgroundTasks,
-    meeting_id: str,
+async def send_new_meeting_email(
+    meeting_id: UUID4,
     token_data: TokenData = Depends(get_admin_token_data),
 ):
-    meeting = MeetingDocument.objects(id=meeting_id).first()
-    students = StudentProfileDocument.objects(mailing_lists__in=meeting.session_level)
-    emails = []
-    for student in students:
-        emails.append(student.email)
-    body = (
-        """
-        <html>
-            <body>
-                <p>A new meeting has been posted to the Tucson Math Circle website</p>
-        """
-        + f"<p>Date: {meeting.date_and_time.date}"
-        + f"<br>Time: {meeting.date_and_time.time}-{create_meeting.duration.time}"
-        + f"<br>Topic: {meeting.topic}"
-        + f"<br>Zoom Link: {meeting.zoom_link}"
-        + f"<br>Zoom Password: {meeting.password}"
-        + f"<br>Miro Link: {meeting.miro_link}"
-        + f"<br>Session Level: {meeting.session_level}</p>"
-        + """
-            </body>
-        </html>
-        """
+    meeting = await meeting_repo.get_meeting_by_uuid(meeting_id)
+    if meeting is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Could not find meeting with uuid {meeting_id}",
+        )
+    recipients = await mailing_list_repo.get_recipients(meeting["session_level"])
+    # every recipient gets their own copy, the meeting details are rendered once
+    bodies = get_templates().render_each(
+        "new_meeting.html",
+        (
+            {"guardian_name": r["guardian_name"], "student_names": r["student_names"]}
+            for r in recipients
+        ),
+        meeting_details=meeting_details(meeting),
     )
-    new_email = EmailSchema(
-        receivers=emails, subject="New meeting Published", body=body
+    emails = [
+        EmailSchema(
+            receivers=[recipient["email"]], subject="New meeting Published", body=body
+        )
+        for recipient, body in zip(recipients, bodies)
+    ]
+    # sent in waves, see `BroadcastDocument`
+    return await broadcast_email_handler(emails)
+
+
+@router.get("/get_pool_stats")
+async def get_pool_stats(token_data: TokenData = Depends(get_admin_token_data)):
+    """Connection pool settings and counters, to size `max-pool-size` per dyno"""
+    return pool_stats()
+
+
+@router.get("/get_admission_stats")
+async def get_admission_stats(token_data: TokenData = Depends(get_admin_token_data)):
+    """
+    Running and waiting requests per route class of this worker, with how many
+    were queued or turned away, and the load the admin class is shed on
+    """
+    return {"classes": admission_stats(), "api_load": get_load_monitor().stats()}
+
+
+@router.get("/get_catalog_stats")
+async def get_catalog_stats(token_data: TokenData = Depends(get_admin_token_data)):
+    """
+    How this worker's meeting listings were served: from the cache, stale
+    while refreshing or because refreshing failed, or loaded, and how many
+    loads were shared with identical requests
+    """
+    return get_meeting_catalog().stats()
+
+
+@router.get("/get_email_outbox_stats")
+async def get_email_outbox_stats(token_data: TokenData = Depends(get_admin_token_data)):
+    """Delivery status of the outbox and the emails that could not be delivered"""
+    stats = await outbox_repo.get_outbox_stats()
+    failed = await outbox_repo.get_failed_emails()
+    stats["failed"] = [
+        {
+            "receivers": email["receivers"],
+            "subject": email["subject"],
+            "attempts": email.get("attempts"),
+            "last_error": email.get("last_error"),
+        }
+        for email in failed
+    ]
+    return stats
+
+
+@router.get("/get_broadcasts")
+async def get_broadcasts(token_data: TokenData = Depends(get_admin_token_data)):
+    """The latest broadcasts, how many of their waves are out and when the next is due"""
+    return await broadcast_repo.get_recent_broadcasts()
+
+
+@router.get("/get_broadcast_progress")
+async def get_broadcast_progress(
+    broadcast_id: PydanticObjectId,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    progress = await broadcast_repo.get_broadcast_progress(ObjectId(broadcast_id))
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Could not find broadcast with id {broadcast_id}",
+        )
+    progress["api_load"] = get_load_monitor().stats()
+    return progress
+
+
+@router.get("/get_job_stats")
+async def get_job_stats(token_data: TokenData = Depends(get_admin_token_data)):
+    """Job queue depth, wait and run times, and the jobs that failed for good"""
+    stats = await job_repo.get_job_stats()
+    failed = await job_repo.get_failed_jobs()
+    stats["failed"] = [
+        {
+            "id": str(job["_id"]),
+            "name": job["name"],
+            "payload": job.get("payload"),
+            "attempts": job.get("attempts"),
+            "last_error": job.get("last_error"),
+        }
+        for job in failed
+    ]
+    return stats
+
+
+@router.get("/roster_events")
+async def roster_events(
+    request: Request,
+    meeting_id: Optional[UUID4] = None,
+    session_level: Optional[SessionLevel] = None,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    """
+    Server-Sent Events with the registrations, cancellations and attendance
+    changes of one meeting or of every meeting of a session level, as they
+    happen. Load the roster once with get_meetings and apply these to it
+    """
+    topics = []
+    if meeting_id is not None:
+        topics.append(f"meeting:{meeting_id}")
+    if session_level is not None:
+        topics.append(f"level:{session_level.value}")
+    if not topics:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Give a meeting_id or a session_level",
+        )
+    subscription = get_event_hub().subscribe(topics)
+    return StreamingResponse(
+        event_stream(request, subscription),
+        media_type="text/event-stream",
+        # no caching, and no buffering by a proxy in front of the app
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    background_task.add_task(email_handler, new_email)
-    return JSONResponse(status_code=200, content={"message": "email has been sent"})
 
 
 @router.get("/get_student_profile")
-def get_student_profile(
+async def get_student_profile(
     account_uuid: UUID4, token_data: TokenData = Depends(get_admin_token_data)
 ):
-    pr_query = StudentProfileDocument.objects(uuid=account_uuid)
-    if len(pr_query) == 0:
+    profile = await profile_repo.get_profile_by_uuid(account_uuid)
+    if profile is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Could not find account with that account_uuid",
         )
 
-    profile = pr_query[0]
-    return profile.dict()
+    students = await profile_repo.get_profile_students(profile)
+    return profile_repo.profile_dict(profile, students)
 
 
 @router.get("/get_student_consent_form_url")
 async def get_student_consent_form_url(
     student_id: PydanticObjectId, token_data: TokenData = Depends(get_admin_token_data)
 ):
-    st_query = StudentDocument.objects(id=student_id)
-    if len(st_query) == 0:
+    student = await student_repo.get_student_by_id(
+        student_id, ["consent_form_object_name"]
+    )
+    if student is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Could not find student with id {student_id}",
         )
 
-    student = st_query[0]
-    object_name = student.consent_form_object_name
+    object_name = student.get("consent_form_object_name")
     if object_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student has not uploaded consent form yet",
         )
 
-    response = create_presigned_url(object_name)
+    response = get_storage().create_presigned_url(object_name)
     if response is not None:
         return response
 
@@ -157,22 +317,23 @@ async def get_student_consent_form_url(
 async def get_meeting_material_url(
     meeting_uuid: UUID4, token_data: TokenData = Depends(get_admin_token_data)
 ):
-    meeting_query = MeetingDocument.objects(uuid=meeting_uuid)
-    if len(meeting_query) == 0:
+    meeting = await meeting_repo.get_meeting_by_uuid(
+        meeting_uuid, ["materials_object_name"]
+    )
+    if meeting is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Could not find meeting with uuid {meeting_uuid}",
         )
 
-    meeting = meeting_query[0]
-    object_name = meeting.materials_object_name
+    object_name = meeting.get("materials_object_name")
     if object_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Meeting does not have a materials_object_name",
         )
 
-    response = create_presigned_url(object_name)
+    response = get_storage().create_presigned_url(object_name)
     if response is not None:
         return response
 
@@ -185,15 +346,34 @@ async def get_meetings_by_filter(
     search: MeetingSearchModel, token_data: TokenData = Depends(get_admin_token_data)
 ):
     # TODO: Use the dates field from MeetingSearchModel
-    meetings = []
     try:
-        for level in search.session_levels:
-            for meeting in MeetingDocument.objects(session_level=level):
-                meetings.append(meeting.admin_dict())
+        meetings = await meeting_repo.get_meetings_by_session_levels(
+            search.session_levels
+        )
+        return await meetings_admin_dicts(meetings)
     except Exception as e:
         print(e)
         return {"details": "Error finding meeting"}
-    return meetings
+
+
+@router.post("/enqueue_job")
+async def enqueue_job(
+    job: JobRequest, token_data: TokenData = Depends(get_admin_token_data)
+):
+    """Runs e.g. rebuild_mailing_lists in the job worker, see `main/jobs/tasks.py`"""
+    if get_handler(job.name) is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown job {job.name}",
+        )
+    # naive UTC like every other date in the database
+    run_at = job.run_at
+    if run_at is not None and run_at.tzinfo is not None:
+        run_at = run_at.astimezone(timezone.utc).replace(tzinfo=None)
+    job_id = await job_repo.enqueue(
+        job.name, job.payload, job.priority, run_at, job.max_attempts
+    )
+    return {"job_id": str(job_id)}
 
 
 @router.post("/create_meeting")
@@ -203,19 +383,112 @@ async def create_meeting(
 ):
     password = generate_random_password()
     meeting = MeetingModel(**create_meeting.dict(), password=password, students=[])
-    doc = MeetingDoc(meeting)
-    doc.save()
-    return doc.admin_dict()
+    doc = await meeting_repo.add_meeting(meeting)
+    return meeting_repo.meeting_admin_dict(doc, {})
+
+
+# multipart uploads of meeting materials, the browser PUTs the parts to the
+# presigned urls in parallel and sends back the ETag of every part
+@router.post("/start_materials_upload")
+async def start_materials_upload(
+    upload: MaterialsUploadStart,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    meeting = await meeting_repo.get_meeting_by_uuid(upload.meeting_id, ["uuid"])
+    if meeting is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not find the meeting",
+        )
+
+    upload_id = await run_in_threadpool(
+        get_storage().create_multipart_upload, upload.object_name, upload.content_type
+    )
+    if upload_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not start the upload",
+        )
+    return {
+        "object_name": upload.object_name,
+        "upload_id": upload_id,
+        "parts": get_storage().create_presigned_upload_part_urls(
+            upload.object_name, upload_id, range(1, upload.part_count + 1)
+        ),
+    }
+
+
+@router.post("/get_materials_upload_part_urls")
+async def get_materials_upload_part_urls(
+    upload: MaterialsUploadParts,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    """New urls for parts whose upload failed or whose url expired"""
+    parts = get_storage().create_presigned_upload_part_urls(
+        upload.object_name, upload.upload_id, upload.part_numbers
+    )
+    if parts is None:
+        return {"details": "Could not generate presigned url"}
+    return {"parts": parts}
+
+
+@router.post("/complete_materials_upload")
+async def complete_materials_upload(
+    upload: MaterialsUploadComplete,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    # check first, so a finished upload always ends up on its meeting
+    if await meeting_repo.get_meeting_by_uuid(upload.meeting_id, ["uuid"]) is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not find the meeting",
+        )
+
+    completed = await run_in_threadpool(
+        get_storage().complete_multipart_upload,
+        upload.object_name,
+        upload.upload_id,
+        [part.dict() for part in upload.parts],
+    )
+    if not completed:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not complete the upload",
+        )
+
+    meeting = await meeting_repo.update_meeting(
+        upload.meeting_id,
+        {"materials_object_name": upload.object_name, "materials_uploaded": True},
+    )
+    if meeting is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not find the meeting",
+        )
+    return (await meetings_admin_dicts([meeting]))[0]
+
+
+@router.post("/abort_materials_upload")
+async def abort_materials_upload(
+    upload: MaterialsUpload,
+    token_data: TokenData = Depends(get_admin_token_data),
+):
+    aborted = await run_in_threadpool(
+        get_storage().abort_multipart_upload, upload.object_name, upload.upload_id
+    )
+    if not aborted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not abort the upload",
+        )
+    return {"details": f"Aborted the upload of {upload.object_name}"}
 
 
 # DELETE routes
 @router.delete("/delete_meeting")
 async def delete_meeting(meeting: MeetingIdModel):
-    try:
-        meeting_doc = MeetingDocument.objects(uuid=meeting.meeting_id)[0]
-    except Exception:
+    if not await meeting_repo.delete_meeting(meeting.meeting_id):
         return "Could not find the meeting"
-    meeting_doc.delete()
 
 
 # PUT routes
@@ -224,12 +497,13 @@ async def update_student_attendance(
     attendance: StudentMeetingAttendance,
     token_data: TokenData = Depends(get_admin_token_data),
 ):
-    try:
-        meeting_doc = MeetingDocument.objects(uuid=attendance.meeting_id)[0]
-    except Exception:
+    meeting = await meeting_repo.get_meeting_by_uuid(
+        attendance.meeting_id, ["session_level"]
+    )
+    if meeting is None:
         return "Could not find the meeting"
 
-    update_attendance(meeting_doc, attendance)
+    await update_attendance(meeting, attendance)
     return {"details": f"Updated attendance for student id {attendance.student_id}"}
 
 
@@ -238,15 +512,14 @@ async def update_student_verification(
     verification: StudentVerification,
     token_data: TokenData = Depends(get_admin_token_data),
 ):
-    st_query = StudentDocument.objects(id=verification.student_id)
-    if len(st_query) == 0:
+    updated = await student_repo.update_student(
+        verification.student_id, {"verification_status": verification.status}
+    )
+    if not updated:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Could not find student with that student_id",
         )
-    student = st_query[0]
-    student.verification_status = verification.status
-    student.save()
     return {
         "details": f"Updated verification status for student id {verification.student_id}"
     }
@@ -257,20 +530,24 @@ async def update_meeting(
     update_meeting_model: UpdateMeeting,
     token_data: TokenData = Depends(get_admin_token_data),
 ):
-    meeting_doc = None
-    try:
-        meeting_doc = MeetingDocument.objects(uuid=update_meeting_model.meeting_id)[0]
-    except Exception:
-        print("Could not find the meeting")
-    meeting_doc.date_and_time = update_meeting_model.date_and_time
-    meeting_doc.duration = update_meeting_model.duration
-    meeting_doc.zoom_link = update_meeting_model.zoom_link
-    meeting_doc.session_level = update_meeting_model.session_level
-    meeting_doc.topic = update_meeting_model.topic
-    meeting_doc.miro_link = update_meeting_model.miro_link
-    meeting_doc.coordinator_notes = update_meeting_model.coordinator_notes
-    meeting_doc.student_notes = update_meeting_model.student_notes
-    meeting_doc.materials_uploaded = update_meeting_model.materials_uploaded
-    meeting_doc.materials_object_name = update_meeting_model.materials_object_name
-    meeting_doc.save()
-    return meeting_doc.admin_dict()
+    meeting = await meeting_repo.update_meeting(
+        update_meeting_model.meeting_id,
+        {
+            "date_and_time": update_meeting_model.date_and_time,
+            "duration": update_meeting_model.duration,
+            "zoom_link": update_meeting_model.zoom_link,
+            "session_level": update_meeting_model.session_level,
+            "topic": update_meeting_model.topic,
+            "miro_link": update_meeting_model.miro_link,
+            "coordinator_notes": update_meeting_model.coordinator_notes,
+            "student_notes": update_meeting_model.student_notes,
+            "materials_uploaded": update_meeting_model.materials_uploaded,
+            "materials_object_name": update_meeting_model.materials_object_name,
+        },
+    )
+    if meeting is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not find the meeting",
+        )
+    return (await meetings_admin_dicts([meeting]))[0]
@@ -0,0 +1,118 @@
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
+from fastapi import status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+from backend.auth.dependencies import TokenPurpose, verify_signed_token
+from backend.main.storage.base import get_storage
+from backend.main.storage.file_response import RangeFileResponse
+from backend.main.storage.local_storage import LocalStorage
+
+router = APIRouter()
+
+# the links to these routes are made by `LocalStorage`, the signed token in
+# them stands in for the signature of a presigned url
+
+
+def get_local_storage() -> LocalStorage:
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return storage
+
+
+def invalid_link_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid or expired link",
+    )
+
+
+# POST routes
+@router.post("/upload", status_code=status.HTTP_204_NO_CONTENT)
+async def upload_file(
+    key: str = Form(...),
+    token: str = Form(...),
+    file: UploadFile = File(...),
+    storage: LocalStorage = Depends(get_local_storage),
+):
+    """Form target of `LocalStorage.create_presigned_post`, answers like S3 does"""
+    claims = verify_signed_token(token, TokenPurpose.file_upload)
+    if key != claims["sub"]:
+        raise invalid_link_exception()
+    object_name = key
+    if key.endswith("${filename}"):
+        filename = Path(file.filename or "").name
+        # otherwise the object name would be the folder the key names
+        if not filename:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File name is required",
+            )
+        object_name = key[: -len("${filename}")] + filename
+
+    try:
+        saved = await run_in_threadpool(
+            storage.save, object_name, file.file, claims.get("max_size")
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid object name {object_name}",
+        )
+    if not saved:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File is larger than allowed",
+        )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+# PUT routes
+@router.put("/parts/{token}")
+async def upload_part(
+    token: str, request: Request, storage: LocalStorage = Depends(get_local_storage)
+):
+    """One part of a multipart upload, the response has the part's ETag header"""
+    claims = verify_signed_token(token, TokenPurpose.file_upload_part)
+    # large parts go to a temporary file instead of staying in memory
+    body = SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(body.write, chunk)
+        body.seek(0)
+        etag = await run_in_threadpool(
+            storage.save_part,
+            claims["sub"],
+            claims["upload_id"],
+            claims["part_number"],
+            body,
+        )
+    finally:
+        body.close()
+    if etag is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Could not find the upload",
+        )
+    return Response(headers={"ETag": etag})
+
+
+# GET routes
+@router.api_route("/{token}", methods=["GET", "HEAD"])
+async def download_file(
+    token: str, request: Request, storage: LocalStorage = Depends(get_local_storage)
+):
+    """Target of `LocalStorage.create_presigned_url`, supports Range requests"""
+    claims = verify_signed_token(token, TokenPurpose.file_download)
+    try:
+        path = storage.path(claims["sub"])
+        return RangeFileResponse(str(path), request.headers, request.method)
+    except (ValueError, FileNotFoundError, IsADirectoryError):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found",
+        )
@@ -1,8 +1,17 @@
-from fastapi import BackgroundTasks
 from starlette.responses import JSONResponse
-from fastapi import Depends, APIRouter, HTTPException, status
-from backend.main.email_handler.email_handler import EmailSchema, email_handler
-from pydantic import UUID4
+from fastapi import Depends, APIRouter, HTTPException, status, Response
+from backend.main.email_handler.email_handler import (
+    EmailSchema,
+    email_handler,
+    frontend_url,
+)
+from backend.main.email_handler.email_templates import get_templates
+import asyncio
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from pydantic import UUID4, EmailStr
 
 # main db imports
 from backend.main.db.models.student_profile_model import (
@@ -14,95 +23,64 @@ from backend.main.db.models.student_models import (
     StudentModel,
     StudentUpdateModel,
 )
-from backend.main.db.docs.student_doc import (
-    document as StudentDoc,
-    StudentDocument,
-)
-from backend.main.db.docs.student_profile_doc import (
-    document as ProfileDoc,
-    StudentProfileDocument,
-)
 from backend.main.db.models.meeting_model import (
     MeetingSearchModel,
     StudentMeetingRegistration,
+    StudentMeetingRegistrationBatch,
     StudentMeetingInfo,
 )
-from backend.main.db.docs.meeting_doc import (
-    MeetingDocument,
+from backend.main.db.repositories import (
+    meeting_repo,
+    student_repo,
+    student_profile_repo as profile_repo,
 )
 from backend.main.db.mixins import PydanticObjectId, SessionLevel
+from backend.main.src.meeting_catalog import get_meeting_catalog
+from backend.main.src.roster_events import publish_roster_event
 
 
 # auth db imports
+from backend.main.storage.base import get_storage
 from backend.auth.dependencies import (
     TokenData,
     get_student_token_data,
-    create_presigned_url,
+    create_access_token,
+    token_owns_student,
+    create_email_verification_token,
+    create_password_reset_token,
+    verify_signed_token,
+    TokenPurpose,
 )
+from backend.auth.db.main import update_student_ids_by_id, get_user_by_email
 
 router = APIRouter()
 
+# upcoming meetings per mailing list level on the dashboard
+DASHBOARD_MEETINGS_PER_LEVEL = 20
 
-def get_current_user_doc(token_data: TokenData):
-    current_user = None
-    try:
-        current_user = StudentProfileDocument.objects(uuid=token_data.id)[0]
-    # TODO: raise an HTTP exception instead of just returning details
-    except Exception as e:
-        print("Exception type:", type(e))
+
+async def get_current_user_doc(token_data: TokenData, projection=None):
+    current_user = await profile_repo.get_profile_by_uuid(token_data.id, projection)
+    if current_user is None:
         print("Could not find the user profile.")
     return current_user
 
 
-def get_student_meeting_index(meeting_doc, first, last):
-    i = 0
-    while i < len(meeting_doc.students):
-        if (
-            meeting_doc.students[i].first_name == first
-            and meeting_doc.students[i].last_name == last
-        ):
-            return i
-        i += 1
-    return i
-
-
-def student_meeting_index(meeting_doc: MeetingDocument, student_id: PydanticObjectId):
-    check_id = lambda reg: reg["student_id"] == student_id
-    for i, registration in enumerate(meeting_doc.students):
-        if check_id(registration):
-            return i
-    print("ERROR: get_student_meeting_index could not find student in MeetingDocument")
-    return None
-
-
-def update_meeting_count(
-    student: StudentDocument, level: SessionLevel, registered=0, attended=0
-):
-    """Increment `student`'s `meeting_counts` for SessionLevel `level` according to
-    `registered` and `attended`"""
-    student.meeting_counts[level]["registered"] += registered
-    student.meeting_counts[level]["attended"] += attended
-
-
-def remove_student_from_meeting(
-    meeting_doc: MeetingDocument, student_id: PydanticObjectId
-):
-    index = student_meeting_index(meeting_doc, student_id)
-    if index is not None:
-        del meeting_doc.students[index]
-        meeting_doc.save()
-    else:
-        print("ERROR: remove_student_from_meeting student not found in MeetingDocument")
+def no_profile_exception():
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="This account has no profile",
+    )
 
 
 def generate_meeting_registrations(registrations, students):
     # dict of registration status for each student in students
     meeting_registrations = {}
-    for i, st in enumerate(students):
-        meeting_registrations[str(st.id)] = {
-            "id": str(st.id),
-            "first_name": st.first_name,
-            "last_name": st.last_name,
+    for st in students:
+        meeting_registrations[str(st["_id"])] = {
+            "id": str(st["_id"]),
+            "first_name": st["first_name"],
+            "last_name": st["last_name"],
             "registered": False,
         }
 
@@ -114,27 +92,102 @@ def generate_meeting_registrations(registrations, students):
     return meeting_registrations
 
 
-def update_student_document(student_doc: StudentDocument, updates: StudentUpdateModel):
-    student_doc.first_name = updates.first_name
-    student_doc.last_name = updates.last_name
-    student_doc.grade = updates.grade
-    student_doc.birth_month = updates.birth_month
-    student_doc.birth_year = updates.birth_year
-    student_doc.consent_form_object_name = updates.consent_form_object_name
-    student_doc.save()
+async def refresh_student_claims(
+    response: Response, token_data: TokenData, student_ids
+):
+    """Stores the ids of the account's students for future tokens and sends a token
+    carrying them back in the `X-Access-Token` header"""
+    student_ids = [str(sid) for sid in student_ids]
+    await update_student_ids_by_id(token_data.id, student_ids)
+    response.headers["X-Access-Token"] = create_access_token(
+        data={"sub": str(token_data.id), "role": token_data.role},
+        student_ids=student_ids,
+    )
+
+
+def student_document_updates(updates: StudentUpdateModel):
+    return {
+        "first_name": updates.first_name,
+        "last_name": updates.last_name,
+        "grade": updates.grade,
+        "birth_month": updates.birth_month,
+        "birth_year": updates.birth_year,
+        "consent_form_object_name": updates.consent_form_object_name,
+    }
 
 
 # GET routes
 @router.get("/get_my_profile")
-def get_current_user_profile(token_data: TokenData = Depends(get_student_token_data)):
-    current_user = get_current_user_doc(token_data)
-    return current_user.dict()
+async def get_current_user_profile(
+    token_data: TokenData = Depends(get_student_token_data),
+):
+    current_user = await get_current_user_doc(token_data)
+    if not current_user:
+        raise no_profile_exception()
+    students = await profile_repo.get_profile_students(current_user)
+    return profile_repo.profile_dict(current_user, students)
 
 
 @router.get("/get_students")
-def get_student_names(token_data: TokenData = Depends(get_student_token_data)):
-    current_user = get_current_user_doc(token_data)
-    return current_user["students"]
+async def get_student_names(token_data: TokenData = Depends(get_student_token_data)):
+    current_user = await get_current_user_doc(token_data, ["students"])
+    if not current_user:
+        raise no_profile_exception()
+    students = await profile_repo.get_profile_students(current_user)
+    return [student_repo.student_dict(st) for st in students]
+
+
+@router.get("/dashboard")
+async def get_dashboard(token_data: TokenData = Depends(get_student_token_data)):
+    """
+    Everything the home page shows in one request: the profile with its
+    students, the upcoming meetings of each mailing list level with the
+    students' registration status, and the upcoming meetings the account's
+    students are registered for. The profile is loaded once, the other
+    queries only need its fields and run concurrently
+    """
+    current_user = await get_current_user_doc(token_data)
+    if not current_user:
+        raise no_profile_exception()
+
+    now = datetime.utcnow()
+    levels = [
+        SessionLevel(level).value for level in current_user.get("mailing_lists", [])
+    ]
+    student_ids = current_user.get("students", [])
+    students, registered, *upcoming = await asyncio.gather(
+        profile_repo.get_profile_students(current_user),
+        meeting_repo.get_registered_meetings(student_ids, now),
+        *(
+            meeting_repo.get_upcoming_meetings(level, now, DASHBOARD_MEETINGS_PER_LEVEL)
+            for level in levels
+        ),
+    )
+
+    # only this account's students, the meetings hold other families' too
+    own_ids = {str(sid) for sid in student_ids}
+    registrations = [
+        {
+            "meeting_id": meeting["uuid"],
+            "date_and_time": meeting.get("date_and_time"),
+            "topic": meeting.get("topic"),
+            "session_level": meeting.get("session_level"),
+            "student_ids": [
+                st["student_id"]
+                for st in meeting.get("students", [])
+                if st["student_id"] in own_ids
+            ],
+        }
+        for meeting in registered
+    ]
+    return {
+        "profile": profile_repo.profile_dict(current_user, students),
+        "meetings": {
+            level: [meeting_info(meeting, students) for meeting in meetings]
+            for level, meetings in zip(levels, upcoming)
+        },
+        "registrations": registrations,
+    }
 
 
 @router.get("/get_consent_form_url")
@@ -142,28 +195,32 @@ async def get_student_consent_form_url(
     student_id: PydanticObjectId,
     token_data: TokenData = Depends(get_student_token_data),
 ):
-    st_query = StudentDocument.objects(id=student_id)
-    if len(st_query) == 0:
+    # the token's claims usually settle ownership, so only the object name is loaded
+    owns_student = token_owns_student(token_data, student_id)
+    fields = ["consent_form_object_name"]
+    if not owns_student:
+        fields.append("profile_uuid")
+    student = await student_repo.get_student_by_id(student_id, fields)
+    if student is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Could not find student with id {student_id}",
         )
 
-    student = st_query[0]
-    if student.profile_uuid != token_data.id:
+    if not owns_student and student.get("profile_uuid") != token_data.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student id is associated with a different account",
         )
 
-    object_name = student.consent_form_object_name
+    object_name = student.get("consent_form_object_name")
     if object_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Student has not uploaded consent form yet",
         )
 
-    response = create_presigned_url(object_name)
+    response = get_storage().create_presigned_url(object_name)
 
     if response is not None:
         return response
@@ -175,22 +232,23 @@ async def get_student_consent_form_url(
 async def get_meeting_material_url(
     meeting_uuid: UUID4, token_data: TokenData = Depends(get_student_token_data)
 ):
-    meeting_query = MeetingDocument.objects(uuid=meeting_uuid)
-    if len(meeting_query) == 0:
+    meeting = await meeting_repo.get_meeting_by_uuid(
+        meeting_uuid, ["materials_object_name"]
+    )
+    if meeting is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Could not find meeting with uuid {meeting_uuid}",
         )
 
-    meeting = meeting_query[0]
-    object_name = meeting.materials_object_name
+    object_name = meeting.get("materials_object_name")
     if object_name is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Meeting does not have a materials_object_name",
         )
 
-    response = create_presigned_url(object_name)
+    response = get_storage().create_presigned_url(object_name)
     if response is not None:
         return response
 
@@ -198,53 +256,68 @@ async def get_meeting_material_url(
 
 
 @router.post("/send_verification_email")
-def send_verification_email(
-    background_task: BackgroundTasks,
+async def send_verification_email(
     token_data: TokenData = Depends(get_student_token_data),
 ):
-    current_user = get_current_user_doc(token_data)
-    verification_url = "This/Is/The/Verification/Url"
+    current_user = await get_current_user_doc(token_data, ["uuid", "email"])
+    if not current_user:
+        raise no_profile_exception()
+    token = create_email_verification_token(current_user["uuid"], current_user["email"])
+    verification_url = f"{frontend_url()}/verify_email?token={token}"
     consent_form_url = "This/Is/The/Consent/Form/Url"
-    body = (
-        """
-        <html>
-            <body>
-                <p>This email was sent to verify your Tucson Math Circle account</p>
-                <p>Please click on the link below to verify your account.</p>
-        """
-        + f"<p>{verification_url}</p>"
-        f"<p>The following link is the link to "
-        f"the consent form that you have to fill out and upload to your account</p>"
-        f"<p>{consent_form_url}</p>"
-        + """
-            </body>
-        </html>
-        """
+    body = get_templates().render(
+        "verify_email.html",
+        verification_url=verification_url,
+        consent_form_url=consent_form_url,
     )
     new_email = EmailSchema(
-        receivers=[current_user.email],
+        receivers=[current_user["email"]],
         subject="Verify Email",
         body=body,
-        attachment=None,
     )
-    background_task.add_task(email_handler, background_task, new_email)
-    return JSONResponse(status_code=200, content={"message": "email has been sent"})
+    return await email_handler(new_email)
 
 
 @router.put("/verify_email")
-def verify_email(token_data: TokenData = Depends(get_student_token_data)):
-    # TODO:setup student doc for verified email
-    pass
+async def verify_email(token: str):
+    # the signed token is the proof, so the only DB access is the final write
+    payload = verify_signed_token(token, TokenPurpose.email_verification)
+    updated = await profile_repo.set_email_verified(
+        UUID(payload["sub"]), payload.get("email")
+    )
+    if not updated:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email has changed since this link was sent",
+        )
+    return {"details": "Email verified"}
+
+
+@router.post("/send_password_reset_email")
+async def send_password_reset_email(email: EmailStr):
+    # respond the same way whether or not the account exists
+    response = JSONResponse(status_code=200, content={"message": "email has been sent"})
+    user = await get_user_by_email(email)
+    if not user or user.disabled:
+        return response
+
+    token = create_password_reset_token(user)
+    reset_url = f"{frontend_url()}/reset_password?token={token}"
+    body = get_templates().render("password_reset.html", reset_url=reset_url)
+    new_email = EmailSchema(receivers=[user.email], subject="Reset Password", body=body)
+    await email_handler(new_email)
+    return response
 
 
 # POST routes
 @router.post("/add_profile")
 async def add_profile(
     profile: StudentProfileCreateModel,
+    response: Response,
     token_data: TokenData = Depends(get_student_token_data),
 ):
     # raise exception if profile already exists
-    existing_user = get_current_user_doc(token_data)
+    existing_user = await get_current_user_doc(token_data, ["uuid"])
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -266,43 +339,73 @@ async def add_profile(
         mailing_lists=profile.mailing_lists,
     )
 
-    # ProfileDoc handles creating StudentDocuments and saving them
-    doc = ProfileDoc(student_profile)
-    doc.save()
-    return doc.dict()
+    # add_profile handles creating StudentDocuments and saving them
+    doc, students = await profile_repo.add_profile(student_profile)
+    await refresh_student_claims(response, token_data, doc["students"])
+    return profile_repo.profile_dict(doc, students)
+
+
+def meeting_info(meeting: dict, current_students) -> dict:
+    meeting_registrations = generate_meeting_registrations(
+        meeting.get("students", []), current_students
+    )
+    info = meeting_repo.meeting_student_dict(meeting)
+    info["registrations"] = [
+        meeting_registrations[sid] for sid in meeting_registrations.keys()
+    ]
+    return info
 
 
 @router.post("/get_meetings")
 async def get_meetings_by_filter(
-    search: MeetingSearchModel, token_data: TokenData = Depends(get_student_token_data)
+    search: MeetingSearchModel,
+    response: Response,
+    since: Optional[int] = None,
+    token_data: TokenData = Depends(get_student_token_data),
 ):
-    current_user = get_current_user_doc(token_data)
+    """
+    The meetings of `search.session_levels`. The `X-Meetings-Cursor` header
+    carries a cursor, pass it back as `since` to get only what changed:
+    {"meetings": [changed], "deleted": [uuids to drop], "cursor": next cursor}.
+    A meeting that moved to a level not searched for is among the deleted.
+    The full listing may come from a cached catalog (see `MeetingCatalog`),
+    `Age` is its age in seconds and `X-Meetings-Stale` is set when it is
+    served past its soft TTL
+    """
+    current_user = await get_current_user_doc(token_data, ["students"])
     if not current_user:
         print("This account has no profile!")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This account has no profile",
-        )
-    current_students = current_user.students
+        raise no_profile_exception()
 
     # TODO: Use the dates field from MeetingSearchModel
     meetings = []
     try:
-        for level in search.session_levels:
-            for meeting in MeetingDocument.objects(session_level=level):
-                registrations = meeting.students
-                meeting_registrations = generate_meeting_registrations(
-                    registrations, current_students
-                )
-                meeting_info = meeting.student_dict()
-                meeting_info["registrations"] = [
-                    meeting_registrations[sid] for sid in meeting_registrations.keys()
-                ]
-                meetings.append(meeting_info)
+        current_students = await profile_repo.get_profile_students(current_user)
+        if since is not None:
+            levels = {
+                SessionLevel(level).value for level in search.session_levels or []
+            }
+            changed, deleted, cursor = await meeting_repo.get_meeting_changes(since)
+            for meeting in changed:
+                if meeting["session_level"] in levels:
+                    meetings.append(meeting_info(meeting, current_students))
+                else:
+                    deleted.append(str(meeting["uuid"]))
+            response.headers["X-Meetings-Cursor"] = str(cursor)
+            return {"meetings": meetings, "deleted": deleted, "cursor": cursor}
+
+        # cached and shared with identical requests, only the registrations
+        # are added per family
+        catalog, age, stale = await get_meeting_catalog().get(search.session_levels)
+        body = catalog.listing(current_students)
     except Exception as e:
         print("Exception type:", type(e))
         return {"details": "Problem in get_meetings_by_filter"}
-    return meetings
+    headers = {"X-Meetings-Cursor": str(catalog.cursor), "Age": str(int(age))}
+    if stale is not None:
+        # "revalidating" or "error", the meetings are older than usual
+        headers["X-Meetings-Stale"] = stale
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.post("/update_student_for_meeting")
@@ -310,36 +413,53 @@ async def update_student(
     registration: StudentMeetingRegistration,
     token_data: TokenData = Depends(get_student_token_data),
 ):
-
-    current_user = get_current_user_doc(token_data)
-    # FIXME: This assumes that the student id given in `registration`
-    # is a valid student id for this account
-    try:
-        student = StudentDocument.objects(id=registration.student_id)[0]
-    except Exception:
+    current_user = await get_current_user_doc(token_data, ["email", "guardians"])
+    if not current_user:
+        raise no_profile_exception()
+    student = await student_repo.get_student_by_id(
+        registration.student_id, ["profile_uuid", "first_name", "last_name"]
+    )
+    if student is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid student id",
         )
+    # the StudentDocument is loaded anyway, so a stale claim costs no extra query
+    if (
+        not token_owns_student(token_data, registration.student_id)
+        and student.get("profile_uuid") != token_data.id
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Student id is associated with a different account",
+        )
 
-    try:
-        meeting_doc = MeetingDocument.objects(uuid=registration.meeting_id)[0]
-    except Exception:
+    meeting_doc = await meeting_repo.get_meeting_by_uuid(
+        registration.meeting_id, ["session_level"]
+    )
+    if meeting_doc is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid meeting id",
         )
 
-    meeting_id = str(registration.meeting_id)
+    level = meeting_doc["session_level"]
     if not registration.registered:
-        remove_student_from_meeting(meeting_doc, registration.student_id)
-        # Update StudentDocument `meetings_registered` to reflect changes
-        if meeting_id in student.meetings_registered:
-            # remove registration
-            del student.meetings_registered[meeting_id]
-            # decrement registered count
-            update_meeting_count(student, meeting_doc.session_level, registered=-1)
-            student.save()
+        removed = await meeting_repo.remove_student_from_meeting(
+            registration.meeting_id, registration.student_id
+        )
+        # Update StudentDocument `meetings_registered` to reflect changes,
+        # this also decrements the registered count
+        await student_repo.unregister_student_from_meeting(
+            registration.student_id, registration.meeting_id, level
+        )
+        if removed:
+            await publish_roster_event(
+                "unregistered",
+                registration.meeting_id,
+                level,
+                registration.student_id,
+            )
 
         return {
             "details": f"Student with id {registration.student_id} removed from meeting list"
@@ -348,64 +468,203 @@ async def update_student(
     # otherwise add student to meeting
     student_info = StudentMeetingInfo(
         student_id=registration.student_id,
-        email=current_user.email,
-        guardians=current_user.guardians,
+        email=current_user["email"],
+        guardians=current_user["guardians"],
         account_uuid=token_data.id,
     )
-    meeting_doc.students.append(student_info.dict())
-    meeting_doc.save()
-
-    # Update StudentDocument `meetings_registered`
-    if meeting_id not in student.meetings_registered:
-        # add the registration
-        student.meetings_registered[meeting_id] = False
-        # increment registered count
-        update_meeting_count(student, meeting_doc.session_level, registered=1)
-    student.save()
+    added = await meeting_repo.add_student_to_meeting(
+        registration.meeting_id, student_info.dict()
+    )
+
+    # Update StudentDocument `meetings_registered` and the registered count
+    await student_repo.register_student_for_meeting(
+        registration.student_id, registration.meeting_id, level
+    )
+    if added:
+        await publish_roster_event(
+            "registered",
+            registration.meeting_id,
+            level,
+            registration.student_id,
+            first_name=student.get("first_name"),
+            last_name=student.get("last_name"),
+        )
     return {
         "details": f"Student with id {registration.student_id} added to meeting list"
     }
 
 
+@router.post("/update_students_for_meetings")
+async def update_students(
+    batch: StudentMeetingRegistrationBatch,
+    token_data: TokenData = Depends(get_student_token_data),
+):
+    """
+    `update_student_for_meeting` for many (meeting, student) pairs, e.g. all
+    the siblings for a term. The profile, the students and the meetings are
+    each loaded with one query. The meeting updates are sent side by side and
+    the student updates with one `bulk_write`. Returns one result per
+    registration, in order: its ids and `status` "registered", "unregistered",
+    "unchanged" or "error" with a `detail`
+    """
+    current_user = await get_current_user_doc(
+        token_data, ["email", "guardians", "students"]
+    )
+    if not current_user:
+        raise no_profile_exception()
+    own_ids = {str(sid) for sid in current_user.get("students", [])}
+
+    registrations = batch.registrations
+    students, meetings = await asyncio.gather(
+        student_repo.get_students_by_ids(
+            list({str(r.student_id) for r in registrations}),
+            ["first_name", "last_name"],
+        ),
+        meeting_repo.get_meetings_by_uuids(
+            {r.meeting_id for r in registrations},
+            ["uuid", "session_level", "students.student_id"],
+        ),
+    )
+
+    results = []
+    changes = []
+    seen = set()
+    for registration in registrations:
+        meeting_id = str(registration.meeting_id)
+        student_id = str(registration.student_id)
+        result = {
+            "meeting_id": meeting_id,
+            "student_id": student_id,
+            "registered": registration.registered,
+        }
+        results.append(result)
+        meeting = meetings.get(meeting_id)
+        error = None
+        if student_id not in students:
+            error = "Invalid student id"
+        elif student_id not in own_ids:
+            error = "Student id is associated with a different account"
+        elif meeting is None:
+            error = "Invalid meeting id"
+        elif (meeting_id, student_id) in seen:
+            error = "Registration is already in this batch"
+        if error is not None:
+            result.update(status="error", detail=error)
+            continue
+        seen.add((meeting_id, student_id))
+
+        on_meeting = any(
+            st["student_id"] == student_id for st in meeting.get("students", [])
+        )
+        if on_meeting == registration.registered:
+            result["status"] = "unchanged"
+            continue
+        changes.append((registration, meeting["session_level"], result))
+
+    student_info = {
+        "email": current_user["email"],
+        "guardians": current_user["guardians"],
+        "account_uuid": token_data.id,
+    }
+    applied = await meeting_repo.apply_registrations(
+        [
+            (
+                registration.meeting_id,
+                StudentMeetingInfo(
+                    student_id=registration.student_id, **student_info
+                ).dict(),
+                registration.registered,
+            )
+            for registration, _, _ in changes
+        ]
+    )
+    # a change a concurrent request made first is not ours to report or publish
+    for (registration, _, result), was_applied in zip(changes, applied):
+        if not was_applied:
+            result["status"] = "unchanged"
+        elif registration.registered:
+            result["status"] = "registered"
+        else:
+            result["status"] = "unregistered"
+    changes = [
+        (registration, level)
+        for (registration, level, _), was_applied in zip(changes, applied)
+        if was_applied
+    ]
+    await student_repo.apply_registrations(
+        [
+            (
+                registration.student_id,
+                registration.meeting_id,
+                level,
+                registration.registered,
+            )
+            for registration, level in changes
+        ]
+    )
+
+    for registration, level in changes:
+        student = students[str(registration.student_id)]
+        await publish_roster_event(
+            "registered" if registration.registered else "unregistered",
+            registration.meeting_id,
+            level,
+            registration.student_id,
+            first_name=student.get("first_name"),
+            last_name=student.get("last_name"),
+        )
+    return results
+
+
 # PUT routes
 @router.put("/update_profile")
 async def update_profile(
     new_profile: StudentProfileUpdateModel,
+    response: Response,
     token_data: TokenData = Depends(get_student_token_data),
 ):
-    current_user = get_current_user_doc(token_data)
-    current_user.email = new_profile.email
-    current_user.guardians = [g.dict() for g in new_profile.guardians]
-    current_user.mailing_lists = new_profile.mailing_lists
+    current_user = await get_current_user_doc(token_data)
+    if not current_user:
+        raise no_profile_exception()
+
+    profile_updates = {
+        "email": new_profile.email,
+        "guardians": [g.dict() for g in new_profile.guardians],
+        "mailing_lists": new_profile.mailing_lists,
+    }
+    if current_user["email"] != new_profile.email:
+        profile_updates["email_verified"] = False
 
     # keep track of id's seen so we know what students to remove from account
     # student id is an Optional
     ids_in_request = [st.id for st in new_profile.students if st.id]
     # remove students not found in request
-    for student_doc in current_user.students:
-        if str(student_doc.id) not in ids_in_request:
-            current_user.update(pull__students=student_doc)
+    student_ids = [
+        sid for sid in current_user.get("students", []) if str(sid) in ids_in_request
+    ]
 
     # update StudentDocuments
     # `new_profile.students` is a `List[StudentUpdateModel]`
+    new_students = []
     for student_update in new_profile.students:
         # add a new student if id is None
         if not student_update.id:
-            new_student = StudentModel(
-                **student_update.dict(), profile_uuid=token_data.id
+            new_students.append(
+                StudentModel(**student_update.dict(), profile_uuid=token_data.id)
+            )
+        # only students already on this profile can be updated
+        elif student_update.id in [str(sid) for sid in student_ids]:
+            await student_repo.update_student(
+                student_update.id, student_document_updates(student_update)
             )
-            student_document = StudentDoc(new_student)
-            student_document.save()
-            current_user.students.append(student_document)
-
         else:
-            query = StudentDocument.objects(id=student_update.id)
-            # if the student already existed update it
-            if len(query) > 0:
-                student_doc = query[0]
-                update_student_document(student_doc, student_update)
-            else:
-                print("ERROR: could not find student id in update_profile")
-
-    current_user.save()
-    return current_user.dict()
+            print("ERROR: could not find student id in update_profile")
+
+    student_ids += [st["_id"] for st in await student_repo.add_students(new_students)]
+    profile_updates["students"] = student_ids
+    await profile_repo.update_profile(token_data.id, profile_updates)
+
+    current_user.update(profile_updates)
+    students = await profile_repo.get_profile_students(current_user)
+    await refresh_student_claims(response, token_data, student_ids)
+    return profile_repo.profile_dict(current_user, students)
@@ -0,0 +1,76 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from backend.settings import settings
+
+
+class StorageBackend(ABC):
+    """
+    Where uploaded files (consent forms, meeting materials) are kept.
+    Files never pass through the API routes, clients get urls that are valid
+    for `expiration` seconds and download or upload straight to the storage
+    """
+
+    @abstractmethod
+    def create_presigned_url(self, object_name: str, expiration=3600) -> Optional[str]:
+        """Url to download `object_name`, None if error"""
+
+    @abstractmethod
+    def create_presigned_post(
+        self, object_name: str, fields=None, conditions=None, expiration=3600
+    ) -> Optional[dict]:
+        """
+        Url and form fields for a browser POST upload of `object_name`, the file
+        goes in a form field named "file" after the others. None if error
+        """
+
+    @abstractmethod
+    def create_multipart_upload(
+        self, object_name: str, content_type: str = None
+    ) -> Optional[str]:
+        """Starts an upload in parts and returns its upload id, None if error"""
+
+    @abstractmethod
+    def create_presigned_upload_part_urls(
+        self,
+        object_name: str,
+        upload_id: str,
+        part_numbers: Iterable[int],
+        expiration=3600,
+    ) -> Optional[List[dict]]:
+        """
+        Urls to PUT the parts to, dictionaries with the keys part_number and url.
+        The response to each PUT has the part's ETag header. None if error
+        """
+
+    @abstractmethod
+    def complete_multipart_upload(
+        self, object_name: str, upload_id: str, parts: List[Dict]
+    ) -> bool:
+        """Assembles the parts, dictionaries with the keys part_number and etag"""
+
+    @abstractmethod
+    def abort_multipart_upload(self, object_name: str, upload_id: str) -> bool:
+        """Discards the upload and the parts uploaded so far"""
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """
+    The backend chosen by storage-backend in db-config.toml, "s3" (the default)
+    or "local" to keep the files on this server's disk
+    """
+    backend = settings.get("storage-backend", "s3")
+    if backend == "s3":
+        from backend.main.storage.s3_storage import S3Storage
+
+        return S3Storage()
+    if backend == "local":
+        from backend.main.storage.local_storage import LocalStorage
+
+        return LocalStorage(
+            settings.get("storage-path", "/data/storage"),
+            settings.get("public-url", "http://localhost:9000"),
+        )
+    raise ValueError(f"Unknown storage-backend {backend!r}, use 's3' or 'local'")
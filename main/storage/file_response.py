@@ -0,0 +1,179 @@
+import hashlib
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# ASGI extension for servers that can sendfile(2) a file descriptor
+ZERO_COPY_SEND = "http.response.zerocopysend"
+
+
+class RangeFileResponse(Response):
+    """
+    Serves the file at `path` the way a static file server would:
+    single byte ranges (Range, If-Range) and conditional requests
+    (If-None-Match, If-Modified-Since).
+    When the server offers the zero-copy send extension the kernel copies the
+    file to the socket, otherwise it is read in chunks in the threadpool
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        request_headers: Headers,
+        method: str = "GET",
+        filename: str = None,
+        media_type: str = None,
+    ):
+        self.path = path
+        self.background = None
+        self.send_header_only = method.upper() == "HEAD"
+        self.media_type = (
+            media_type
+            or guess_type(filename or path)[0]
+            or ("application/octet-stream")
+        )
+
+        stat_result = os.stat(path)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise FileNotFoundError(f"{path} is not a file")
+        self.size = stat_result.st_size
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+        self.etag = '"' + hashlib.md5(etag_base.encode()).hexdigest() + '"'
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": self.etag,
+            "last-modified": self.last_modified,
+        }
+        if filename is not None:
+            headers["content-disposition"] = "attachment; filename*=utf-8''" + quote(
+                filename
+            )
+
+        self.start, self.length = 0, self.size
+        if self.is_not_modified(request_headers, int(stat_result.st_mtime)):
+            self.status_code = 304
+            self.length = 0
+        else:
+            byte_range = self.requested_range(request_headers)
+            if byte_range is None:
+                self.status_code = 200
+            elif byte_range == (-1, -1):
+                self.status_code = 416
+                self.length = 0
+                headers["content-range"] = f"bytes */{self.size}"
+            else:
+                self.status_code = 206
+                self.start, end = byte_range
+                self.length = end - self.start + 1
+                headers["content-range"] = f"bytes {self.start}-{end}/{self.size}"
+        if self.status_code != 304:
+            headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    def is_not_modified(self, request_headers: Headers, mtime: int) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            # weak comparison, W/"x" matches "x"
+            tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+            return "*" in tags or self.etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return mtime <= since
+        return False
+
+    def requested_range(self, request_headers: Headers) -> Optional[Tuple[int, int]]:
+        """
+        The first and last byte to send, (-1, -1) if the range is unsatisfiable
+        and None to send the whole file
+        """
+        range_header = request_headers.get("range")
+        if range_header is None or not range_header.startswith("bytes="):
+            return None
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range not in (self.etag, self.last_modified):
+            # the file changed since the client's copy, send all of it
+            return None
+        spec = range_header.partition("=")[2].strip()
+        if "," in spec or "-" not in spec:
+            # multiple ranges are allowed to be answered with the whole file
+            return None
+        first, last = (part.strip() for part in spec.split("-", 1))
+        try:
+            if first == "":
+                suffix = int(last)
+                if suffix <= 0 or self.size == 0:
+                    return (-1, -1)
+                return (max(0, self.size - suffix), self.size - 1)
+            start = int(first)
+            end = int(last) if last else self.size - 1
+        except ValueError:
+            return None
+        if start >= self.size:
+            return (-1, -1)
+        if start > end:
+            return None
+        return (start, min(end, self.size - 1))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.send_header_only or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        file = await run_in_threadpool(open, self.path, "rb")
+        try:
+            if ZERO_COPY_SEND in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": ZERO_COPY_SEND,
+                        "file": file.fileno(),
+                        "offset": self.start,
+                        "count": self.length,
+                        "more_body": False,
+                    }
+                )
+                return
+            offset, remaining = self.start, self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(
+                    os.pread, file.fileno(), min(self.chunk_size, remaining), offset
+                )
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    }
+                )
+            if remaining > 0:
+                # the file was truncated while it was sent
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await run_in_threadpool(file.close)
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional
+from uuid import uuid4
+
+from backend.auth.dependencies import TokenPurpose, create_signed_token
+from backend.main.storage.base import StorageBackend
+
+# uploads in parts are kept here until they are completed or aborted
+MULTIPART_DIR = ".multipart"
+
+
+class LocalStorage(StorageBackend):
+    """
+    Keeps the files under `root` on this server's disk, for self hosted and
+    offline deployments. In place of presigned urls it hands out links to the
+    /files routes carrying a signed token (see `create_signed_token`) that
+    names the object and expires like a presigned url would
+    """
+
+    def __init__(self, root: str, public_url: str):
+        self.root = Path(root).resolve()
+        # the main app as the browser sees it, the links point at /files
+        self.public_url = public_url.rstrip("/")
+
+    def path(self, object_name: str) -> Path:
+        """Where `object_name` is stored, never outside of `root`"""
+        path = self.root.joinpath(object_name).resolve()
+        if self.root not in path.parents or MULTIPART_DIR in path.parts:
+            raise ValueError(f"Invalid object name {object_name!r}")
+        return path
+
+    def upload_dir(self, upload_id: str) -> Path:
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id {upload_id!r}")
+        return self.root.joinpath(MULTIPART_DIR, upload_id)
+
+    def create_presigned_url(self, object_name: str, expiration=3600) -> Optional[str]:
+        try:
+            self.path(object_name)
+        except ValueError as e:
+            print("ERROR:", e)
+            return None
+        token = create_signed_token(
+            TokenPurpose.file_download, object_name, timedelta(seconds=expiration)
+        )
+        return f"{self.public_url}/files/{token}"
+
+    def create_presigned_post(
+        self, object_name: str, fields=None, conditions=None, expiration=3600
+    ) -> Optional[dict]:
+        """
+        Like S3, a key ending in ${filename} is completed with the name of the
+        uploaded file and a content-length-range condition limits the size
+        """
+        max_size = None
+        for condition in conditions or []:
+            if isinstance(condition, list) and condition[0] == "content-length-range":
+                max_size = condition[2]
+        try:
+            self.path(object_name.replace("${filename}", "filename"))
+        except ValueError as e:
+            print("ERROR:", e)
+            return None
+        token = create_signed_token(
+            TokenPurpose.file_upload,
+            object_name,
+            timedelta(seconds=expiration),
+            {"max_size": max_size},
+        )
+        return {
+            "url": f"{self.public_url}/files/upload",
+            "fields": {**(fields or {}), "key": object_name, "token": token},
+        }
+
+    def save(self, object_name: str, file: BinaryIO, max_size: int = None) -> bool:
+        """
+        Writes `file` to `object_name`, False if it is larger than `max_size`.
+        Copying stops one byte past `max_size`, so a file that is too large is
+        not read to the end
+        """
+        path = self.path(object_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{uuid4().hex}")
+        limit = None if max_size is None else max_size + 1
+        written = 0
+        try:
+            with open(temporary, "wb") as out:
+                while limit is None or written < limit:
+                    size = 1024 * 1024
+                    if limit is not None:
+                        size = min(size, limit - written)
+                    chunk = file.read(size)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    written += len(chunk)
+            if max_size is not None and written > max_size:
+                return False
+            # readers never see a partly written file
+            os.replace(temporary, path)
+            return True
+        finally:
+            temporary.unlink(missing_ok=True)
+
+    def create_multipart_upload(
+        self, object_name: str, content_type: str = None
+    ) -> Optional[str]:
+        try:
+            self.path(object_name)
+        except ValueError as e:
+            print("ERROR:", e)
+            return None
+        upload_id = uuid4().hex
+        upload_dir = self.upload_dir(upload_id)
+        upload_dir.mkdir(parents=True)
+        upload_dir.joinpath("upload.json").write_text(
+            json.dumps({"object_name": object_name})
+        )
+        return upload_id
+
+    def create_presigned_upload_part_urls(
+        self,
+        object_name: str,
+        upload_id: str,
+        part_numbers: Iterable[int],
+        expiration=3600,
+    ) -> Optional[List[dict]]:
+        return [
+            {
+                "part_number": part_number,
+                "url": f"{self.public_url}/files/parts/"
+                + create_signed_token(
+                    TokenPurpose.file_upload_part,
+                    object_name,
+                    timedelta(seconds=expiration),
+                    {"upload_id": upload_id, "part_number": part_number},
+                ),
+            }
+            for part_number in part_numbers
+        ]
+
+    def upload_matches(self, object_name: str, upload_id: str) -> bool:
+        try:
+            upload = json.loads(
+                self.upload_dir(upload_id).joinpath("upload.json").read_text()
+            )
+        except (ValueError, OSError):
+            return False
+        return upload["object_name"] == object_name
+
+    def save_part(
+        self, object_name: str, upload_id: str, part_number: int, file: BinaryIO
+    ) -> Optional[str]:
+        """Stores one part and returns its ETag, None if the upload is unknown"""
+        if not self.upload_matches(object_name, upload_id):
+            return None
+        part_path = self.upload_dir(upload_id).joinpath(str(part_number))
+        temporary = part_path.with_suffix(f".{uuid4().hex}")
+        md5 = hashlib.md5()
+        with open(temporary, "wb") as out:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                md5.update(chunk)
+                out.write(chunk)
+        os.replace(temporary, part_path)
+        return f'"{md5.hexdigest()}"'
+
+    def complete_multipart_upload(
+        self, object_name: str, upload_id: str, parts: List[Dict]
+    ) -> bool:
+        if not self.upload_matches(object_name, upload_id):
+            print("ERROR: no multipart upload", upload_id, "for", object_name)
+            return False
+        upload_dir = self.upload_dir(upload_id)
+        part_paths = []
+        for part in sorted(parts, key=lambda part: part["part_number"]):
+            part_path = upload_dir.joinpath(str(part["part_number"]))
+            if not part_path.exists() or _md5_etag(part_path) != part["etag"]:
+                print("ERROR: part", part["part_number"], "is missing or changed")
+                return False
+            part_paths.append(part_path)
+
+        assembled = upload_dir.joinpath("assembled")
+        with open(assembled, "wb") as out:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part_file:
+                    shutil.copyfileobj(part_file, out, 1024 * 1024)
+        path = self.path(object_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(assembled, path)
+        shutil.rmtree(upload_dir)
+        return True
+
+    def abort_multipart_upload(self, object_name: str, upload_id: str) -> bool:
+        if not self.upload_matches(object_name, upload_id):
+            return False
+        shutil.rmtree(self.upload_dir(upload_id))
+        return True
+
+
+def _md5_etag(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return f'"{md5.hexdigest()}"'
@@ -0,0 +1,47 @@
+from typing import Dict, Iterable, List, Optional
+
+from backend.auth.dependencies import (
+    create_presigned_url,
+    create_presigned_post,
+    create_multipart_upload,
+    create_presigned_upload_part_urls,
+    complete_multipart_upload,
+    abort_multipart_upload,
+)
+from backend.main.storage.base import StorageBackend
+
+
+class S3Storage(StorageBackend):
+    """The S3 bucket from aws-config.toml, see the helpers in auth.dependencies"""
+
+    def create_presigned_url(self, object_name: str, expiration=3600) -> Optional[str]:
+        return create_presigned_url(object_name, expiration)
+
+    def create_presigned_post(
+        self, object_name: str, fields=None, conditions=None, expiration=3600
+    ) -> Optional[dict]:
+        return create_presigned_post(object_name, fields, conditions, expiration)
+
+    def create_multipart_upload(
+        self, object_name: str, content_type: str = None
+    ) -> Optional[str]:
+        return create_multipart_upload(object_name, content_type)
+
+    def create_presigned_upload_part_urls(
+        self,
+        object_name: str,
+        upload_id: str,
+        part_numbers: Iterable[int],
+        expiration=3600,
+    ) -> Optional[List[dict]]:
+        return create_presigned_upload_part_urls(
+            object_name, upload_id, part_numbers, expiration
+        )
+
+    def complete_multipart_upload(
+        self, object_name: str, upload_id: str, parts: List[Dict]
+    ) -> bool:
+        return complete_multipart_upload(object_name, upload_id, parts)
+
+    def abort_multipart_upload(self, object_name: str, upload_id: str) -> bool:
+        return abort_multipart_upload(object_name, upload_id)
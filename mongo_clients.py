@@ -0,0 +1,145 @@
+import asyncio
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import motor.motor_asyncio
+from pymongo import monitoring
+
+from backend.settings import settings
+
+
+def pool_options() -> dict:
+    """Connection pool settings, every key is optional in db-config.toml"""
+    return {
+        "maxPoolSize": settings.get("max-pool-size", 50),
+        "minPoolSize": settings.get("min-pool-size", 5),
+        "maxIdleTimeMS": settings.get("max-idle-time-ms", 60000),
+        "serverSelectionTimeoutMS": settings.get("server-selection-timeout-ms", 5000),
+    }
+
+
+def compressors() -> str:
+    # e.g. "zstd,zlib", zstd and snappy need their python packages installed
+    return settings.get("compressors", "")
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server address for `pool_stats`"""
+
+    def __init__(self):
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+
+    def _count(self, event, **changes):
+        counter = self.stats["%s:%s" % event.address]
+        for key, change in changes.items():
+            counter[key] += change
+
+    def pool_created(self, event):
+        self._count(event, pools_created=1)
+
+    def pool_cleared(self, event):
+        self._count(event, pools_cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count(event, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count(event, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._count(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._count(event, waiting=-1, check_out_failed=1)
+
+    def connection_checked_out(self, event):
+        self._count(event, waiting=-1, in_use=1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._count(event, in_use=-1)
+
+
+# one listener per kind of client, so mongoengine and Motor are reported apart
+_listeners: Dict[str, List[PoolStatsListener]] = {}
+# Motor clients by cluster, shared by every database on that cluster
+_async_clients: Dict[str, motor.motor_asyncio.AsyncIOMotorClient] = {}
+
+
+def cluster_uri(database: str = "") -> str:
+    return settings["connection-uri"].format(
+        username=settings["atlas-username"],
+        password=settings["atlas-password"],
+        database=database,
+    )
+
+
+def _cluster_key(uri: str) -> str:
+    # the database in the path does not change which cluster a client talks to
+    return re.sub(r"(@[^/?]+)/[^?]*", r"\1/", uri)
+
+
+def client_options(kind: str) -> dict:
+    """MongoClient keyword arguments shared by mongoengine and Motor"""
+    if kind not in _listeners:
+        _listeners[kind] = [PoolStatsListener()]
+    options = {
+        **pool_options(),
+        "uuidRepresentation": "standard",
+        # the same list object every time, mongoengine only shares a client
+        # between aliases whose settings compare equal
+        "event_listeners": _listeners[kind],
+    }
+    if compressors():
+        options["compressors"] = compressors()
+    return options
+
+
+def get_async_client(uri: str = None) -> motor.motor_asyncio.AsyncIOMotorClient:
+    """Returns the Motor client for the cluster of `uri`, creating it on first use"""
+    uri = uri or cluster_uri()
+    key = _cluster_key(uri)
+    if key not in _async_clients:
+        _async_clients[key] = motor.motor_asyncio.AsyncIOMotorClient(
+            key, **client_options("motor")
+        )
+    return _async_clients[key]
+
+
+async def warm_pools():
+    """Opens `minPoolSize` connections on every Motor client before traffic arrives"""
+    for client in _async_clients.values():
+        try:
+            await asyncio.gather(
+                *[
+                    client.admin.command("ping")
+                    for _ in range(max(1, pool_options()["minPoolSize"]))
+                ]
+            )
+        except Exception as e:
+            print("ERROR: could not warm connection pool:", e)
+
+
+def pool_stats() -> dict:
+    return {
+        "options": {**pool_options(), "compressors": compressors()},
+        "clients": {
+            kind: {
+                address: dict(counter) for address, counter in listener.stats.items()
+            }
+            for kind, (listener,) in _listeners.items()
+        },
+    }
+
+
+def close_clients():
+    """Closes every Motor client, the next `get_async_client` call creates new ones"""
+    for client in _async_clients.values():
+        client.close()
+    _async_clients.clear()
@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import Any, Optional
+
+import toml
+
+# the config files live next to the auth server
+CONFIG_DIR = Path(__file__).resolve().parent.joinpath("auth")
+
+
+class Settings:
+    """
+    db-config.toml and the optional aws-config.toml.
+    Nothing is read until a setting is first used, and each file is read once,
+    so importing a module never touches the filesystem
+    """
+
+    def __init__(self, config_dir: Path = CONFIG_DIR):
+        self.config_path = config_dir.joinpath("db-config.toml")
+        self.aws_config_path = config_dir.joinpath("aws-config.toml")
+        self._config: Optional[dict] = None
+        self._aws: Optional[dict] = None
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            self._config = toml.load(str(self.config_path))
+        return self._config
+
+    @property
+    def aws(self) -> dict:
+        """The AWS settings, empty when there is no aws-config.toml"""
+        if self._aws is None:
+            if self.aws_config_path.exists():
+                self._aws = toml.load(str(self.aws_config_path))
+            else:
+                self._aws = {}
+        return self._aws
+
+    def __getitem__(self, key: str) -> Any:
+        return self.config[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.config.get(key, default)
+
+    def reload(self):
+        """Forgets what was read, the next access reads the files again"""
+        self._config = None
+        self._aws = None
+
+
+settings = Settings()
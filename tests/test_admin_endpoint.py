@@ -1,10 +1,12 @@
 from fastapi.testclient import TestClient
 import toml
 import pytest
+import requests
+from moto import mock_s3
 from pathlib import Path
 from json import JSONEncoder
-from uuid import UUID
-from datetime import datetime
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta
 
 # hack to add project directory to path and make modules work nicely
 import sys
@@ -36,7 +38,11 @@ from backend.main.db.models.student_profile_model import SessionLevel
 from backend.main.db.models.student_models import StudentVerification
 from backend.main.db.docs.student_doc import StudentDocument
 from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.docs.outbox_doc import OutboxEmailDocument
+from backend.main.db.docs.job_doc import JobDocument
 from backend.tests.pre_save_meetings import pre_save_meetings
+from backend.settings import settings
+from backend.auth.dependencies import get_presigner, get_s3_client
 
 CONFIG_PATH = Path(__file__).resolve().parents[1].joinpath("auth/db-config.toml")
 print("Using CONFIG_PATH:", CONFIG_PATH)
@@ -99,6 +105,26 @@ def mock_database():
     connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
 
 
+@pytest.fixture()
+def mock_s3_bucket(monkeypatch):
+    monkeypatch.setattr(
+        settings,
+        "_aws",
+        {
+            "aws-access-key-id": "testing",
+            "aws-secret-access-key": "testing",
+            "aws-bucket-name": "test-materials",
+        },
+    )
+    get_presigner.cache_clear()
+    get_s3_client.cache_clear()
+    with mock_s3():
+        get_s3_client().create_bucket(Bucket="test-materials")
+        yield get_s3_client()
+    get_presigner.cache_clear()
+    get_s3_client.cache_clear()
+
+
 client = TestClient(app)
 client2 = TestClient(auth_app)
 
@@ -264,3 +290,199 @@ def test_update_meeting(mock_database):
     assert meeting.miro_link == "test_miro_link"
     assert meeting.topic == "test_topic"
     assert meeting.zoom_link == "test_zoom_link"
+
+
+def test_multipart_materials_upload(mock_database, mock_s3_bucket):
+    pre_save_meetings()
+    id = MeetingDocument.objects()[0].uuid
+    response = client2.post(
+        "/token", data={"username": "admin@email.com", "password": "password"}
+    )
+    access_token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    object_name = f"meeting_materials/{id}/recording.mp4"
+
+    response = client.post(
+        "/admin/start_materials_upload",
+        json={"meeting_id": str(id), "object_name": object_name, "part_count": 2},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    upload = response.json()
+    assert [part["part_number"] for part in upload["parts"]] == [1, 2]
+
+    # every part but the last must be at least 5 MiB
+    contents = [b"a" * 5 * 1024 * 1024, b"b" * 1024]
+    parts = []
+    for part, content in zip(upload["parts"], contents):
+        put = requests.put(part["url"], data=content)
+        assert put.status_code == 200
+        parts.append({"part_number": part["part_number"], "etag": put.headers["ETag"]})
+
+    response = client.post(
+        "/admin/complete_materials_upload",
+        json={
+            "meeting_id": str(id),
+            "object_name": object_name,
+            "upload_id": upload["upload_id"],
+            "parts": parts,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["materials_uploaded"]
+    meeting = MeetingDocument.objects(uuid=id)[0]
+    assert meeting.materials_uploaded
+    assert meeting.materials_object_name == object_name
+    body = mock_s3_bucket.get_object(Bucket="test-materials", Key=object_name)["Body"]
+    assert body.read() == b"".join(contents)
+
+
+def test_abort_materials_upload(mock_database, mock_s3_bucket):
+    pre_save_meetings()
+    id = MeetingDocument.objects()[0].uuid
+    response = client2.post(
+        "/token", data={"username": "admin@email.com", "password": "password"}
+    )
+    access_token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    object_name = f"meeting_materials/{id}/packet.pdf"
+
+    response = client.post(
+        "/admin/start_materials_upload",
+        json={"meeting_id": str(id), "object_name": object_name, "part_count": 1},
+        headers=headers,
+    )
+    upload_id = response.json()["upload_id"]
+    response = client.post(
+        "/admin/abort_materials_upload",
+        json={
+            "meeting_id": str(id),
+            "object_name": object_name,
+            "upload_id": upload_id,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    uploads = mock_s3_bucket.list_multipart_uploads(Bucket="test-materials")
+    assert "Uploads" not in uploads
+    assert not MeetingDocument.objects(uuid=id)[0].materials_uploaded
+
+
+def test_send_new_meeting_email(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    OutboxEmailDocument.drop_collection()
+    meeting = MeetingDocument.objects(zoom_link="zoomlink").first()
+    response = client2.post(
+        "/token", data={"username": "admin@email.com", "password": "password"}
+    )
+    access_token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = client.post(
+        "/admin/send_new_meeting_email",
+        params={"meeting_id": str(meeting.uuid)},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    broadcast_id = response.json()["broadcast_id"]
+    # one personalized email per profile on the junior_a mailing list
+    emails = OutboxEmailDocument.objects()
+    assert sorted(email.receivers[0] for email in emails) == [
+        "jaketeststudent@email.com",
+        "jimmyteststudent@email.com",
+        "johnnyteststudent@email.com",
+    ]
+    body = OutboxEmailDocument.objects(receivers="johnnyteststudent@email.com")[0].body
+    assert "Dear jimmy," in body
+    assert "for johhny." in body
+    assert "Zoom Link: zoomlink<br>" in body.replace("\n", "")
+    assert "06:00 PM-07:00 PM" in body
+    # sent in waves, the first one is released by the email worker
+    response = client.get(
+        "/admin/get_broadcast_progress",
+        params={"broadcast_id": broadcast_id},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["total"] == 3
+    assert response.json()["counts"] == {"held": 3}
+
+    response = client.post(
+        "/admin/send_new_meeting_email",
+        params={"meeting_id": str(uuid4())},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_send_reminder_email(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    OutboxEmailDocument.drop_collection()
+    # starts in an hour, the other meetings are long over
+    meeting = MeetingDocument.objects(zoom_link="zoomlink").first()
+    meeting.date_and_time = datetime.utcnow() + timedelta(hours=1)
+    meeting.save()
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    student_id = (
+        StudentProfileDocument.objects(email="jimmyteststudent@email.com")[0]
+        .students[0]
+        .id
+    )
+    client.post(
+        "/student/update_student_for_meeting",
+        json=StudentMeetingRegistration(
+            meeting_id=meeting.uuid, student_id=student_id, registered=True
+        ).dict(),
+        headers={"Authorization": f"Bearer {response.json()['access_token']}"},
+    )
+
+    response = client2.post(
+        "/token", data={"username": "admin@email.com", "password": "password"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post("/admin/send_reminder_email", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"meetings": 1, "emails": 1}
+    email = OutboxEmailDocument.objects().get()
+    assert email.receivers == ["jimmyteststudent@email.com"]
+    assert "jimmy is registered" in email.body
+
+    # already sent
+    response = client.post("/admin/send_reminder_email", headers=headers)
+    assert response.json() == {"meetings": 0, "emails": 0}
+
+
+def test_enqueue_job(mock_database):
+    pre_save_user_auths()
+    JobDocument.drop_collection()
+    response = client2.post(
+        "/token", data={"username": "admin@email.com", "password": "password"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.post(
+        "/admin/enqueue_job",
+        json={"name": "rebuild_mailing_lists", "payload": {"levels": ["senior"]}},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    job = JobDocument.objects.get()
+    assert str(job.id) == response.json()["job_id"]
+    assert job.payload == {"levels": ["senior"]}
+
+    response = client.post(
+        "/admin/enqueue_job", json={"name": "no_such_job"}, headers=headers
+    )
+    assert response.status_code == 400
+
+    response = client.get("/admin/get_job_stats", headers=headers)
+    assert response.json()["counts"]["queued"] == 1
+    assert response.json()["due"] == 1
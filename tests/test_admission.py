@@ -0,0 +1,141 @@
+import asyncio
+import json
+import pytest
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from starlette.responses import JSONResponse
+
+from backend.admission import (
+    ADMIN,
+    AUTH,
+    READS,
+    WRITES,
+    AdmissionMiddleware,
+    AdmissionQueue,
+    route_class,
+)
+
+
+def test_route_class():
+    assert route_class("POST", "/token") == AUTH
+    assert route_class("PUT", "/student/update_password") == AUTH
+    assert route_class("GET", "/admin/get_meetings") == ADMIN
+    assert route_class("POST", "/admin/send_new_meeting_email") == ADMIN
+    assert route_class("GET", "/student/dashboard") == READS
+    assert route_class("POST", "/student/get_meetings") == READS
+    assert route_class("POST", "/student/update_student_for_meeting") == WRITES
+
+
+def test_queue_limits():
+    queue = AdmissionQueue(limit=1, queue=1, timeout=0.05)
+
+    async def check():
+        assert await queue.acquire()
+        waiting = asyncio.ensure_future(queue.acquire())
+        await asyncio.sleep(0)
+        assert queue.waiting == 1
+        # the queue is full
+        assert not await queue.acquire()
+        queue.release()
+        assert await waiting
+        assert (queue.active, queue.waiting) == (1, 0)
+
+        # nobody releases in time
+        assert not await queue.acquire()
+        queue.release()
+        assert queue.active == 0
+
+    asyncio.run(check())
+    stats = queue.stats()
+    assert (stats["admitted"], stats["queued"], stats["rejected"]) == (2, 2, 1)
+    assert (stats["timed_out"], stats["max_waiting"]) == (1, 1)
+
+
+def test_queue_cancelled_waiter():
+    queue = AdmissionQueue(limit=1, queue=2, timeout=1)
+
+    async def check():
+        assert await queue.acquire()
+        gone = asyncio.ensure_future(queue.acquire())
+        waiting = asyncio.ensure_future(queue.acquire())
+        await asyncio.sleep(0)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        assert queue.waiting == 1
+        queue.release()
+        assert await waiting
+        queue.release()
+        assert (queue.active, queue.waiting) == (0, 0)
+
+    asyncio.run(check())
+
+
+def test_shed_when_busy():
+    queue = AdmissionQueue(limit=1, queue=4, timeout=1, shed_when_busy=True)
+
+    async def check():
+        # free slots are still used while busy
+        assert await queue.acquire(busy=True)
+        assert not await queue.acquire(busy=True)
+        waiting = asyncio.ensure_future(queue.acquire(busy=False))
+        await asyncio.sleep(0)
+        queue.release()
+        assert await waiting
+
+    asyncio.run(check())
+
+
+def test_middleware_sheds_one_class():
+    running = {"max": 0, "now": 0}
+
+    async def app(scope, receive, send):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.05)
+        running["now"] -= 1
+        await JSONResponse({"ok": True})(scope, receive, send)
+
+    queues = {
+        ADMIN: AdmissionQueue(limit=1, queue=1, timeout=1, retry_after=10),
+        READS: AdmissionQueue(limit=8, queue=8, timeout=1),
+    }
+    middleware = AdmissionMiddleware(
+        app, queues=queues, classify=lambda method, path: path.strip("/")
+    )
+
+    async def request(path: str):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+        await middleware(scope, receive, send)
+        headers = dict(messages[0]["headers"])
+        return messages[0]["status"], headers.get(b"retry-after"), messages[-1]
+
+    async def burst():
+        return await asyncio.gather(
+            *(request(f"/{ADMIN}") for _ in range(4)),
+            *(request(f"/{READS}") for _ in range(8)),
+        )
+
+    responses = asyncio.run(burst())
+    admin, reads = responses[:4], responses[4:]
+    assert [status for status, _, _ in admin] == [200, 200, 503, 503]
+    assert {retry_after for status, retry_after, _ in admin if status == 503} == {b"10"}
+    assert json.loads(admin[2][2]["body"])["detail"]
+    assert {status for status, _, _ in reads} == {200}
+    assert running["max"] == 9
+    assert queues[ADMIN].stats()["rejected"] == 2
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi.testclient import TestClient
 import toml
 
@@ -10,7 +11,8 @@ print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
 sys.path.append(str(PROJECTS_DIR))
 
 from backend.auth.main import app
-from backend.auth.db.main import connect_to_db
+from backend.auth.db.main import connect_to_db, get_user_by_email
+from backend.auth.dependencies import create_password_reset_token
 
 # get the config file path
 CONFIG_PATH = Path(__file__).resolve().parents[1].joinpath("auth/db-config.toml")
@@ -135,3 +137,81 @@ def test_student_me():
     assert response.status_code == 200
     assert json["email"] == "student2@email.com"
     assert json["role"] == "student"
+
+
+def test_student_refresh_token():
+    response = client.post(
+        "/token", data={"username": "student@email.com", "password": "password"}
+    )
+    assert response.status_code == 200
+    json = response.json()
+    refresh_token = json["refresh_token"]
+    response = client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+    json = response.json()
+    assert "access_token" in json
+    assert json["refresh_token"] != refresh_token
+    response = client.get(
+        "/student/me",
+        headers={"Authorization": f"Bearer {json['access_token']}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["email"] == "student@email.com"
+
+
+# check that replaying a used refresh token revokes the rotated one too
+def test_refresh_token_reuse():
+    response = client.post(
+        "/token", data={"username": "student@email.com", "password": "password"}
+    )
+    old_refresh_token = response.json()["refresh_token"]
+    response = client.post("/token/refresh", json={"refresh_token": old_refresh_token})
+    assert response.status_code == 200
+    new_refresh_token = response.json()["refresh_token"]
+    response = client.post("/token/refresh", json={"refresh_token": old_refresh_token})
+    assert response.status_code == 401
+    response = client.post("/token/refresh", json={"refresh_token": new_refresh_token})
+    assert response.status_code == 401
+
+
+def test_student_revoke_token():
+    response = client.post(
+        "/token", data={"username": "student@email.com", "password": "password"}
+    )
+    access_token = response.json()["access_token"]
+    response = client.post(
+        "/token/revoke",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/student/me",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 401
+
+
+# a password reset logs out every access token issued before it
+def test_student_reset_password_revokes_tokens():
+    response = client.post(
+        "/token", data={"username": "student@email.com", "password": "password"}
+    )
+    access_token = response.json()["access_token"]
+    # the test client runs the app on this loop, so Motor can be used here too
+    user = asyncio.get_event_loop().run_until_complete(
+        get_user_by_email("student@email.com")
+    )
+    response = client.put(
+        "/student/reset_password",
+        json={"token": create_password_reset_token(user), "password": "password"},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        "/student/me",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 401
+    response = client.post(
+        "/token", data={"username": "student@email.com", "password": "password"}
+    )
+    assert response.status_code == 200
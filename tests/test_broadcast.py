@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from mongoengine import disconnect_all, connect
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.db.docs.broadcast_doc import BroadcastDocument
+from backend.main.db.docs.outbox_doc import HELD, QUEUED, OutboxEmailDocument
+from backend.main.db.repositories import broadcast_repo
+from backend.main.email_handler.outbox_worker import OutboxWorker, SMTPPool
+from backend.main.src.load_monitor import LoadMiddleware, LoadMonitor
+
+NOW = datetime(2021, 3, 20, 12, 0)
+
+
+@pytest.fixture()
+def mock_database():
+    disconnect_all()
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
+    OutboxEmailDocument.drop_collection()
+    BroadcastDocument.drop_collection()
+
+
+def create_broadcast(count: int, wave_size: int, window: timedelta) -> dict:
+    emails = [
+        {"receivers": [f"family{i}@email.com"], "subject": "New meeting", "body": "b"}
+        for i in range(count)
+    ]
+    return asyncio.run(broadcast_repo.create_broadcast(emails, wave_size, window, NOW))
+
+
+def statuses() -> dict:
+    counts = {}
+    for email in OutboxEmailDocument.objects():
+        counts[email.status] = counts.get(email.status, 0) + 1
+    return counts
+
+
+def make_worker(overloaded=lambda: False) -> OutboxWorker:
+    # nothing is sent, so the pool never connects
+    return OutboxWorker(
+        SMTPPool("127.0.0.1", 1, start_tls=False),
+        "admin@email.com",
+        is_overloaded=overloaded,
+        load_backoff=timedelta(minutes=2),
+    )
+
+
+def test_create_broadcast_holds_waves(mock_database):
+    broadcast = create_broadcast(250, 100, timedelta(minutes=10))
+    assert broadcast["waves"] == 3
+    # the last wave goes out at the end of the window
+    assert broadcast["interval_seconds"] == 300
+    assert statuses() == {HELD: 250}
+    waves = [email.wave for email in OutboxEmailDocument.objects()]
+    assert [waves.count(wave) for wave in range(3)] == [100, 100, 50]
+
+
+def test_waves_are_released_on_schedule(mock_database):
+    broadcast = create_broadcast(250, 100, timedelta(minutes=10))
+    worker = make_worker()
+
+    assert asyncio.run(worker.release_waves(NOW)) == 1
+    assert statuses() == {QUEUED: 100, HELD: 150}
+    # the next wave is not due yet
+    assert asyncio.run(worker.release_waves(NOW + timedelta(minutes=4))) == 0
+    assert asyncio.run(worker.release_waves(NOW + timedelta(minutes=5))) == 1
+    assert asyncio.run(worker.release_waves(NOW + timedelta(minutes=10))) == 1
+    assert statuses() == {QUEUED: 250}
+
+    progress = asyncio.run(broadcast_repo.get_broadcast_progress(broadcast["_id"]))
+    assert progress["waves_released"] == 3
+    assert progress["next_wave_at"] is None
+    assert progress["finished_at"] == NOW + timedelta(minutes=10)
+    assert progress["counts"] == {QUEUED: 250}
+    assert asyncio.run(worker.release_waves(NOW + timedelta(hours=1))) == 0
+
+
+def test_releasing_a_wave_twice(mock_database):
+    broadcast = create_broadcast(20, 10, timedelta(minutes=10))
+    # two workers found the broadcast due at the same time
+    assert asyncio.run(broadcast_repo.release_wave(broadcast, NOW))
+    assert not asyncio.run(broadcast_repo.release_wave(broadcast, NOW))
+    assert statuses() == {QUEUED: 10, HELD: 10}
+
+
+def test_high_load_postpones_waves(mock_database):
+    broadcast = create_broadcast(30, 10, timedelta(minutes=10))
+    busy = True
+    worker = make_worker(lambda: busy)
+
+    assert asyncio.run(worker.release_waves(NOW)) == 0
+    assert statuses() == {HELD: 30}
+    progress = asyncio.run(broadcast_repo.get_broadcast_progress(broadcast["_id"]))
+    assert progress["next_wave_at"] == NOW + timedelta(minutes=2)
+    assert progress["postponed"] == 1
+
+    busy = False
+    assert asyncio.run(worker.release_waves(NOW + timedelta(minutes=1))) == 0
+    assert asyncio.run(worker.release_waves(NOW + timedelta(minutes=2))) == 1
+    # the later waves keep their spacing from the delayed one
+    progress = asyncio.run(broadcast_repo.get_broadcast_progress(broadcast["_id"]))
+    assert progress["next_wave_at"] == NOW + timedelta(minutes=7)
+    assert worker.waves_postponed == 1
+    assert worker.waves_released == 1
+
+
+def test_load_monitor():
+    monitor = LoadMonitor(max_in_flight=2, max_latency=0.5, stale_after=60)
+    app = FastAPI()
+
+    @app.get("/check")
+    async def check():
+        return monitor.stats()
+
+    client = TestClient(LoadMiddleware(app, monitor))
+    assert client.get("/check").json()["in_flight"] == 1
+    assert monitor.in_flight == 0
+    assert monitor.requests == 1
+    assert not monitor.is_high()
+
+    monitor.started()
+    monitor.started()
+    assert monitor.is_high()
+    monitor.finished(0.01)
+    monitor.finished(0.01)
+    assert not monitor.is_high()
+
+    # slow requests raise the average
+    for _ in range(30):
+        monitor.started()
+        monitor.finished(2.0)
+    assert monitor.is_high()
+    # until it is too old to say anything about now
+    monitor.last_finished -= 61
+    assert not monitor.is_high()
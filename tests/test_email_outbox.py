@@ -0,0 +1,283 @@
+import asyncio
+import socket
+import pytest
+from datetime import datetime, timedelta
+from aiosmtpd.controller import Controller
+from mongoengine import disconnect_all, connect
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.db.docs.outbox_doc import (
+    FAILED,
+    HELD,
+    QUEUED,
+    SENDING,
+    SENT,
+    OutboxEmailDocument,
+)
+from backend.main.db.repositories import outbox_repo
+from backend.main.email_handler.email_handler import EmailSchema, email_handler
+from backend.main.email_handler.outbox_worker import OutboxWorker, SMTPPool
+
+SENDER = "admin@email.com"
+
+
+class RecordingHandler:
+    """aiosmtpd handler that keeps the messages and can be told to refuse them"""
+
+    def __init__(self):
+        self.messages = []
+        self.data_replies = []
+        self.refused = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refused:
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.data_replies:
+            return self.data_replies.pop(0)
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture()
+def mock_database():
+    disconnect_all()
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
+    OutboxEmailDocument.drop_collection()
+
+
+@pytest.fixture()
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+def make_worker(controller: Controller, **kwargs) -> OutboxWorker:
+    pool = SMTPPool(
+        controller.hostname,
+        controller.port,
+        start_tls=False,
+        size=kwargs.pop("size", 2),
+    )
+    return OutboxWorker(pool, SENDER, **kwargs)
+
+
+def enqueue(count: int, receivers=None):
+    async def add():
+        return [
+            await outbox_repo.enqueue_email(
+                receivers or [f"student{i}@email.com"], f"Subject {i}", f"<p>{i}</p>"
+            )
+            for i in range(count)
+        ]
+
+    return asyncio.run(add())
+
+
+def drain(worker: OutboxWorker) -> int:
+    async def drain_and_close():
+        try:
+            return await worker.drain_once()
+        finally:
+            await worker.pool.close()
+
+    return asyncio.run(drain_and_close())
+
+
+def test_email_handler_writes_to_outbox(mock_database):
+    email = EmailSchema(
+        receivers=["student@email.com"], subject="Verify Email", body="<p>hi</p>"
+    )
+    response = asyncio.run(email_handler(email))
+    assert response.status_code == 200
+    doc = OutboxEmailDocument.objects.get()
+    assert doc.status == QUEUED
+    assert doc.receivers == ["student@email.com"]
+    assert doc.attempts == 0
+
+
+def test_worker_sends_batch_on_pooled_connections(mock_database, smtp_server):
+    enqueue(10)
+    worker = make_worker(smtp_server, size=2)
+    assert drain(worker) == 10
+
+    messages = smtp_server.handler.messages
+    assert sorted(m.rcpt_tos[0] for m in messages) == sorted(
+        f"student{i}@email.com" for i in range(10)
+    )
+    assert all(m.mail_from == SENDER for m in messages)
+    # ten messages, at most one connection per pool slot
+    assert worker.pool.connections_opened == 2
+    for doc in OutboxEmailDocument.objects():
+        assert doc.status == SENT
+        assert doc.sent_at is not None
+        assert doc.attempts == 1
+    # nothing left to send
+    assert drain(worker) == 0
+
+
+def test_batch_size_limits_claim(mock_database, smtp_server):
+    enqueue(5)
+    worker = make_worker(smtp_server, batch_size=3)
+    assert drain(worker) == 3
+    assert OutboxEmailDocument.objects(status=QUEUED).count() == 2
+    assert drain(worker) == 2
+    assert OutboxEmailDocument.objects(status=SENT).count() == 5
+
+
+def test_temporary_failure_backs_off(mock_database, smtp_server):
+    (email_id,) = enqueue(1)
+    smtp_server.handler.data_replies = ["451 4.3.0 Try again later"]
+    worker = make_worker(smtp_server, backoff=timedelta(minutes=10))
+    before = datetime.utcnow()
+    assert drain(worker) == 1
+
+    doc = OutboxEmailDocument.objects.get(id=email_id)
+    assert doc.status == QUEUED
+    assert doc.attempts == 1
+    assert "451" in doc.last_error
+    delay = doc.next_attempt_at - before
+    assert timedelta(minutes=7) < delay <= timedelta(minutes=10, seconds=1)
+    # not due yet
+    assert drain(worker) == 0
+
+    # the second attempt waits twice as long
+    doc.update(next_attempt_at=datetime.utcnow() - timedelta(seconds=1))
+    smtp_server.handler.data_replies = ["451 4.3.0 Try again later"]
+    before = datetime.utcnow()
+    assert drain(worker) == 1
+    doc.reload()
+    assert doc.attempts == 2
+    assert doc.next_attempt_at - before > timedelta(minutes=15)
+
+    doc.update(next_attempt_at=datetime.utcnow() - timedelta(seconds=1))
+    assert drain(worker) == 1
+    doc.reload()
+    assert doc.status == SENT
+    assert len(smtp_server.handler.messages) == 1
+
+
+def test_permanent_failure_and_max_attempts(mock_database, smtp_server):
+    rejected, retried = enqueue(2)
+    smtp_server.handler.data_replies = ["554 5.7.1 Rejected"]
+    worker = make_worker(smtp_server, size=1, max_attempts=1)
+    assert drain(worker) == 2
+    # the 5xx fails right away, the other was accepted
+    assert OutboxEmailDocument.objects.get(id=rejected).status == FAILED
+    assert OutboxEmailDocument.objects.get(id=retried).status == SENT
+
+    (email_id,) = enqueue(1)
+    smtp_server.handler.data_replies = ["451 4.3.0 Try again later"]
+    assert drain(worker) == 1
+    doc = OutboxEmailDocument.objects.get(id=email_id)
+    assert doc.status == FAILED
+    assert "451" in doc.last_error
+
+
+def test_finished_emails_expire(mock_database, smtp_server):
+    rejected, accepted, waiting = enqueue(3)
+    OutboxEmailDocument.objects(id=waiting).update(
+        next_attempt_at=datetime.utcnow() + timedelta(hours=1)
+    )
+    smtp_server.handler.data_replies = ["554 5.7.1 Rejected"]
+    worker = make_worker(smtp_server, size=1, retention=timedelta(days=2))
+    before = datetime.utcnow()
+    assert drain(worker) == 2
+
+    for email_id in (rejected, accepted):
+        doc = OutboxEmailDocument.objects.get(id=email_id)
+        assert doc.expires_at - before >= timedelta(days=2) - timedelta(seconds=1)
+        assert doc.expires_at - before < timedelta(days=2, seconds=5)
+    assert OutboxEmailDocument.objects.get(id=waiting).expires_at is None
+    indexes = OutboxEmailDocument._get_collection().index_information()
+    assert any(
+        index["key"] == [("expires_at", 1)] and index["expireAfterSeconds"] == 0
+        for index in indexes.values()
+    )
+
+
+def test_refused_receivers(mock_database, smtp_server):
+    smtp_server.handler.refused = {"gone@email.com"}
+    (partly,) = enqueue(1, ["student@email.com", "gone@email.com"])
+    worker = make_worker(smtp_server)
+    assert drain(worker) == 1
+    doc = OutboxEmailDocument.objects.get(id=partly)
+    assert doc.status == SENT
+    assert doc.refused == ["gone@email.com"]
+
+    (refused,) = enqueue(1, ["gone@email.com"])
+    assert drain(worker) == 1
+    assert OutboxEmailDocument.objects.get(id=refused).status == FAILED
+
+
+def test_unreachable_server_is_retried(mock_database):
+    (email_id,) = enqueue(1)
+    pool = SMTPPool("127.0.0.1", free_port(), start_tls=False, timeout=2)
+    assert drain(OutboxWorker(pool, SENDER)) == 1
+    doc = OutboxEmailDocument.objects.get(id=email_id)
+    assert doc.status == QUEUED
+    assert doc.last_error
+
+
+def test_expired_lease_is_claimed_again(mock_database, smtp_server):
+    stuck, busy = enqueue(2)
+    now = datetime.utcnow()
+    OutboxEmailDocument.objects(id=stuck).update(
+        status=SENDING, attempts=1, lease_expires_at=now - timedelta(seconds=1)
+    )
+    OutboxEmailDocument.objects(id=busy).update(
+        status=SENDING, attempts=1, lease_expires_at=now + timedelta(minutes=5)
+    )
+    worker = make_worker(smtp_server)
+    assert drain(worker) == 1
+    assert OutboxEmailDocument.objects.get(id=stuck).status == SENT
+    assert OutboxEmailDocument.objects.get(id=busy).status == SENDING
+
+
+def test_outbox_stats(mock_database, smtp_server):
+    enqueue(3)
+    smtp_server.handler.data_replies = ["554 5.7.1 Rejected"]
+    drain(make_worker(smtp_server, size=1, batch_size=2))
+    stats = asyncio.run(outbox_repo.get_outbox_stats())
+    assert stats["counts"] == {HELD: 0, QUEUED: 1, SENDING: 0, SENT: 1, FAILED: 1}
+    assert stats["oldest_queued_seconds"] >= 0
+    failed = asyncio.run(outbox_repo.get_failed_emails())
+    assert [email["subject"] for email in failed] == ["Subject 0"]
+
+
+def test_run_until_stopped(mock_database, smtp_server):
+    enqueue(3)
+    worker = make_worker(smtp_server, batch_size=2, poll_interval=0.05)
+
+    async def run_briefly():
+        task = asyncio.get_event_loop().create_task(worker.run())
+        for _ in range(100):
+            if OutboxEmailDocument.objects(status=SENT).count() == 3:
+                break
+            await asyncio.sleep(0.05)
+        worker.stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(run_briefly())
+    assert len(smtp_server.handler.messages) == 3
+    # the connections were closed when it stopped
+    assert worker.pool._idle == []
@@ -0,0 +1,95 @@
+from datetime import datetime
+from markupsafe import Markup
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.email_handler.email_templates import (
+    TemplateRegistry,
+    meeting_details,
+)
+
+meeting = {
+    "date_and_time": datetime(2021, 3, 20, 18, 0),
+    "duration": 90,
+    "topic": "Graphs & <trees>",
+    "zoom_link": "zoom_link",
+    "password": "secret",
+    "miro_link": "miro_link",
+    "session_level": "junior_a",
+}
+
+
+def test_load_compiles_every_template():
+    registry = TemplateRegistry().load()
+    assert {
+        "base.html",
+        "meeting_details.html",
+        "new_meeting.html",
+        "password_reset.html",
+        "verify_email.html",
+    } <= set(registry.templates)
+
+
+def test_render_escapes_values():
+    registry = TemplateRegistry().load()
+    body = registry.render("password_reset.html", reset_url="https://x/?a=1&b=<2>")
+    assert "https://x/?a=1&amp;b=&lt;2&gt;" in body
+    assert body.strip().startswith("<html>")
+
+
+def test_meeting_details():
+    details = meeting_details(meeting)
+    assert isinstance(details, Markup)
+    assert "Date: Saturday, March 20, 2021" in details
+    assert "Time: 06:00 PM-07:30 PM" in details
+    assert "Topic: Graphs &amp; &lt;trees&gt;" in details
+
+
+def test_render_shared_is_cached():
+    registry = TemplateRegistry(shared_cache_size=2).load()
+    first = registry.render_shared(
+        "meeting_details.html", start=datetime(2021, 1, 1), end=datetime(2021, 1, 1)
+    )
+    again = registry.render_shared(
+        "meeting_details.html", start=datetime(2021, 1, 1), end=datetime(2021, 1, 1)
+    )
+    assert first is again
+    assert (registry.shared_hits, registry.shared_misses) == (1, 1)
+
+    for day in (2, 3):
+        registry.render_shared(
+            "meeting_details.html",
+            start=datetime(2021, 1, day),
+            end=datetime(2021, 1, day),
+        )
+    # the least recently used entry was dropped
+    registry.render_shared(
+        "meeting_details.html", start=datetime(2021, 1, 1), end=datetime(2021, 1, 1)
+    )
+    assert registry.shared_misses == 4
+
+
+def test_render_each_personalizes():
+    registry = TemplateRegistry().load()
+    details = registry.render_shared(
+        "meeting_details.html", start=datetime(2021, 1, 1), end=datetime(2021, 1, 1)
+    )
+    recipients = [
+        {"guardian_name": "Ann", "student_names": ["Bo", "Cy"]},
+        {"guardian_name": None, "student_names": []},
+    ]
+    first, second = registry.render_each(
+        "new_meeting.html", recipients, meeting_details=details
+    )
+    assert "Dear Ann," in first
+    assert "for Bo, Cy." in first
+    assert "Dear Tucson Math Circle family," in second
+    assert "website." in second
+    # the shared part is included as is, not escaped again
+    assert "<br>Topic:" in first and "<br>Topic:" in second
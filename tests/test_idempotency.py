@@ -0,0 +1,188 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.src.app import app
+from backend.auth.main import app as auth_app
+from backend.main.db.docs.idempotency_doc import IdempotencyRecordDocument
+from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.repositories import idempotency_repo
+from backend.main.src.idempotency import IdempotencyMiddleware
+from backend.tests.test_student_endpoint import (
+    mock_database,
+    pre_save_user_auths,
+    student,
+)
+
+client = TestClient(app)
+client2 = TestClient(auth_app)
+
+
+def test_add_profile_replayed(mock_database):
+    IdempotencyRecordDocument.drop_collection()
+    pre_save_user_auths()
+    response = client2.post(
+        "/token", data={"username": "jaketeststudent@email.com", "password": "password"}
+    )
+    headers = {
+        "Authorization": f"Bearer {response.json()['access_token']}",
+        "Idempotency-Key": "add-profile-1",
+    }
+    first = client.post("/student/add_profile", json=student.dict(), headers=headers)
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+
+    retry = client.post("/student/add_profile", json=student.dict(), headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    # the refreshed token is not stored with the response
+    assert "X-Access-Token" in first.headers
+    assert "X-Access-Token" not in retry.headers
+    stored = IdempotencyRecordDocument.objects.get()
+    assert all(name.lower() != "x-access-token" for name, _ in stored.headers)
+
+    # a retry after the client refreshed its token is still the same request
+    response = client2.post(
+        "/token", data={"username": "jaketeststudent@email.com", "password": "password"}
+    )
+    refreshed = {
+        **headers,
+        "Authorization": f"Bearer {response.json()['access_token']}",
+    }
+    assert refreshed["Authorization"] != headers["Authorization"]
+    retry = client.post("/student/add_profile", json=student.dict(), headers=refreshed)
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(StudentProfileDocument.objects(email="jaketeststudent@email.com")) == 1
+
+    other = student.copy(update={"email": "other@email.com"})
+    response = client.post("/student/add_profile", json=other.dict(), headers=headers)
+    assert response.status_code == 422
+
+
+def echo_app(calls):
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        await asyncio.sleep(0.05)
+        status_code = 500 if message["body"] == b"fail" else 201
+        response = JSONResponse({"calls": len(calls)}, status_code=status_code)
+        await response(scope, receive, send)
+
+    return app
+
+
+def call(middleware, body: bytes, key: bytes = b"key-1"):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/student/update_student_for_meeting",
+        "query_string": b"",
+        "headers": [(b"authorization", b"Bearer t"), (b"idempotency-key", key)],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await middleware(scope, receive, send)
+        headers = dict(messages[0]["headers"])
+        return messages[0]["status"], json.loads(messages[-1]["body"]), headers
+
+    return run()
+
+
+def test_concurrent_duplicates_coalesced(mock_database):
+    IdempotencyRecordDocument.drop_collection()
+    calls = []
+    middleware = IdempotencyMiddleware(echo_app(calls), ttl=timedelta(hours=1))
+
+    async def duplicates():
+        return await asyncio.gather(*(call(middleware, b"body") for _ in range(5)))
+
+    responses = asyncio.run(duplicates())
+    assert len(calls) == 1
+    assert {(status, body["calls"]) for status, body, _ in responses} == {(201, 1)}
+    assert sum(b"idempotent-replayed" in headers for _, _, headers in responses) == 4
+
+    # a later retry is one lookup
+    status, body, headers = asyncio.run(call(middleware, b"body"))
+    assert (status, body["calls"], len(calls)) == (201, 1, 1)
+    assert headers[b"idempotent-replayed"] == b"true"
+
+
+def test_failed_request_runs_again(mock_database):
+    IdempotencyRecordDocument.drop_collection()
+    calls = []
+    middleware = IdempotencyMiddleware(echo_app(calls), ttl=timedelta(hours=1))
+    assert asyncio.run(call(middleware, b"fail"))[0] == 500
+    assert asyncio.run(call(middleware, b"fail"))[0] == 500
+    assert len(calls) == 2
+    assert IdempotencyRecordDocument.objects.count() == 0
+
+
+def test_claim_lease(mock_database):
+    IdempotencyRecordDocument.drop_collection()
+    lease, ttl = timedelta(seconds=30), timedelta(hours=1)
+    # not in the past, the TTL index would remove the records
+    now = datetime.utcnow()
+
+    async def check():
+        assert await idempotency_repo.claim("k", "f", lease, ttl, now) is None
+        pending = await idempotency_repo.claim("k", "f", lease, ttl, now)
+        assert pending["status"] == "pending"
+        # the first caller died, its lease ran out
+        later = now + timedelta(minutes=1)
+        assert await idempotency_repo.claim("k", "f", lease, ttl, later) is None
+        await idempotency_repo.complete("k", 200, [("content-type", "x")], b"ok")
+        done = await idempotency_repo.claim("k", "f", lease, ttl, later)
+        assert (done["status"], done["body"]) == ("done", b"ok")
+
+    asyncio.run(check())
+
+
+def test_claim_when_records_vanish(mock_database, monkeypatch):
+    IdempotencyRecordDocument.drop_collection()
+    lease, ttl = timedelta(seconds=30), timedelta(hours=1)
+    now = datetime.utcnow()
+    collection = idempotency_repo.records_collection()
+    competitor = {"key": "k", "fingerprint": "other", "status": "pending"}
+
+    class Racing:
+        # twice another caller inserts the key first, and its record expires
+        # before the lookup
+        inserts = 0
+
+        async def insert_one(self, document):
+            Racing.inserts += 1
+            if Racing.inserts <= 2:
+                await collection.insert_one(dict(competitor))
+            return await collection.insert_one(document)
+
+        async def find_one(self, query):
+            await collection.delete_one(query)
+            return None
+
+    monkeypatch.setattr(idempotency_repo, "records_collection", Racing)
+
+    async def check():
+        # None only once this caller's own record is in
+        assert await idempotency_repo.claim("k", "f", lease, ttl, now) is None
+        assert Racing.inserts == 3
+        assert (await collection.find_one({"key": "k"}))["fingerprint"] == "f"
+
+    asyncio.run(check())
@@ -0,0 +1,243 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from mongoengine import disconnect_all, connect
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.db.docs.job_doc import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    JobDocument,
+)
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.docs.student_doc import StudentDocument
+from backend.main.db.repositories import job_repo
+from backend.main.jobs.registry import job
+from backend.main.jobs.worker import JobWorker
+
+calls = []
+
+
+@job("test_record")
+async def record(payload: dict) -> dict:
+    calls.append(payload["n"])
+    return {"n": payload["n"]}
+
+
+@job("test_flaky")
+async def flaky(payload: dict):
+    raise RuntimeError("not this time")
+
+
+@pytest.fixture()
+def mock_database():
+    disconnect_all()
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="student-db")
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="meeting-db")
+    JobDocument.drop_collection()
+    calls.clear()
+
+
+def enqueue(*args, **kwargs):
+    return asyncio.run(job_repo.enqueue(*args, **kwargs))
+
+
+def run_all(worker: JobWorker) -> int:
+    async def drain():
+        ran = 0
+        while await worker.run_one():
+            ran += 1
+        return ran
+
+    return asyncio.run(drain())
+
+
+def test_priority_then_run_at(mock_database):
+    now = datetime.utcnow()
+    enqueue("test_record", {"n": 1}, run_at=now - timedelta(minutes=2))
+    enqueue("test_record", {"n": 2}, priority=5, run_at=now - timedelta(minutes=1))
+    enqueue("test_record", {"n": 3}, run_at=now - timedelta(minutes=3))
+    # scheduled for later
+    enqueue("test_record", {"n": 4}, priority=9, run_at=now + timedelta(hours=1))
+
+    assert run_all(JobWorker()) == 3
+    assert calls == [2, 3, 1]
+    done = JobDocument.objects(status=DONE)
+    assert sorted(doc.result["n"] for doc in done) == [1, 2, 3]
+    assert all(doc.wait_ms >= 60000 for doc in done)
+    assert JobDocument.objects(status=QUEUED).get().payload == {"n": 4}
+
+
+def test_claim_is_exclusive(mock_database):
+    enqueue("test_record", {"n": 1})
+    lease = timedelta(minutes=1)
+    first = asyncio.run(job_repo.claim("a", lease))
+    assert first["status"] == RUNNING
+    assert first["attempts"] == 1
+    assert asyncio.run(job_repo.claim("b", lease)) is None
+
+
+def test_retry_then_fail(mock_database):
+    enqueue("test_flaky", max_attempts=2)
+    worker = JobWorker(backoff=timedelta(seconds=30))
+    assert run_all(worker) == 1
+    doc = JobDocument.objects.get()
+    assert doc.status == QUEUED
+    assert doc.last_error == "RuntimeError: not this time"
+    assert doc.run_at > datetime.utcnow() + timedelta(seconds=20)
+
+    doc.update(run_at=datetime.utcnow())
+    assert run_all(worker) == 1
+    doc.reload()
+    assert doc.status == FAILED
+    assert doc.attempts == 2
+    assert (worker.retried, worker.failed) == (1, 1)
+
+
+def test_unknown_job_fails(mock_database):
+    enqueue("no_such_job")
+    assert run_all(JobWorker()) == 1
+    assert JobDocument.objects.get().status == FAILED
+
+
+def test_expired_lease_is_requeued(mock_database):
+    enqueue("test_record", {"n": 1})
+    now = datetime.utcnow()
+    claimed = asyncio.run(job_repo.claim("dead", timedelta(minutes=1), now))
+    assert asyncio.run(job_repo.requeue_expired(now)) == 0
+    assert asyncio.run(job_repo.requeue_expired(now + timedelta(minutes=1))) == 1
+
+    assert run_all(JobWorker()) == 1
+    assert calls == [1]
+    # the dead worker coming back cannot overwrite the result
+    asyncio.run(job_repo.fail(claimed, "late"))
+    assert JobDocument.objects.get().status == DONE
+
+
+def test_expired_lease_uses_up_attempts(mock_database):
+    enqueue("test_record", {"n": 1}, max_attempts=3)
+    now = datetime.utcnow()
+    lease = timedelta(minutes=1)
+    for attempt in range(1, 4):
+        claimed = asyncio.run(job_repo.claim("dead", lease, now))
+        assert claimed["attempts"] == attempt
+        now += lease
+        assert asyncio.run(job_repo.requeue_expired(now)) == 1
+        assert JobDocument.objects.get().status == (QUEUED if attempt < 3 else FAILED)
+
+    doc = JobDocument.objects.get()
+    assert doc.last_error == "worker lease expired"
+    assert doc.expires_at == doc.finished_at + job_repo.RETENTION
+    assert asyncio.run(job_repo.claim("next", lease, now)) is None
+    assert calls == []
+
+
+def test_finished_jobs_expire(mock_database):
+    enqueue("test_record", {"n": 1})
+    enqueue("no_such_job")
+    enqueue("test_record", {"n": 2}, run_at=datetime.utcnow() + timedelta(hours=1))
+    before = datetime.utcnow()
+    assert run_all(JobWorker(retention=timedelta(days=2))) == 2
+
+    for doc in JobDocument.objects(status__in=[DONE, FAILED]):
+        assert doc.expires_at - before >= timedelta(days=2) - timedelta(seconds=1)
+        assert doc.expires_at - before < timedelta(days=2, seconds=5)
+    assert JobDocument.objects.get(status=QUEUED).expires_at is None
+    indexes = JobDocument._get_collection().index_information()
+    assert any(
+        index["key"] == [("expires_at", 1)] and index["expireAfterSeconds"] == 0
+        for index in indexes.values()
+    )
+
+
+def test_job_stats(mock_database):
+    now = datetime.utcnow()
+    enqueue("test_record", {"n": 1}, run_at=now - timedelta(seconds=5))
+    enqueue("test_record", {"n": 2}, run_at=now + timedelta(hours=1))
+    stats = asyncio.run(job_repo.get_job_stats())
+    assert stats["counts"][QUEUED] == 2
+    assert (stats["due"], stats["scheduled"]) == (1, 1)
+    assert stats["oldest_due_seconds"] >= 5
+
+    run_all(JobWorker())
+    stats = asyncio.run(job_repo.get_job_stats())
+    assert stats["counts"][DONE] == 1
+    assert stats["latency"]["test_record"]["count"] == 1
+    assert stats["latency"]["test_record"]["max_wait_ms"] >= 5000
+
+
+def test_run_until_stopped(mock_database):
+    worker = JobWorker(concurrency=2, poll_interval=0.05)
+
+    async def run_briefly():
+        task = asyncio.get_event_loop().create_task(worker.run())
+        await job_repo.enqueue("test_record", {"n": 1})
+        await job_repo.enqueue("test_record", {"n": 2})
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if worker.completed == 2:
+                break
+        worker.stop()
+        await task
+
+    asyncio.run(run_briefly())
+    assert sorted(calls) == [1, 2]
+
+
+def test_reconcile_meeting_counts(mock_database):
+    StudentDocument.drop_collection()
+    MeetingDocument.drop_collection()
+    meetings = [uuid4(), uuid4()]
+    MeetingDocument._get_collection().insert_many(
+        [
+            {"uuid": meetings[0], "session_level": "junior_a"},
+            {"uuid": meetings[1], "session_level": "senior"},
+        ]
+    )
+    zero = {"registered": 0, "attended": 0}
+    right = {
+        "junior_a": {"registered": 1, "attended": 1},
+        "junior_b": zero,
+        "senior": zero,
+    }
+    StudentDocument._get_collection().insert_many(
+        [
+            # counts match
+            {"meetings_registered": {str(meetings[0]): True}, "meeting_counts": right},
+            # missed the attended increment, and a deleted meeting
+            {
+                "meetings_registered": {
+                    str(meetings[0]): True,
+                    str(meetings[1]): False,
+                    str(uuid4()): True,
+                },
+                "meeting_counts": {
+                    "junior_a": {"registered": 1, "attended": 0},
+                    "junior_b": zero,
+                    "senior": {"registered": 1, "attended": 0},
+                },
+            },
+        ]
+    )
+    enqueue("reconcile_meeting_counts", {"chunk_size": 1})
+    assert run_all(JobWorker()) == 1
+    assert JobDocument.objects.get().result == {"checked": 2, "fixed": 1}
+    fixed = StudentDocument._get_collection().find_one(
+        {f"meetings_registered.{meetings[1]}": False}
+    )
+    assert fixed["meeting_counts"] == {
+        "junior_a": {"registered": 1, "attended": 1},
+        "junior_b": zero,
+        "senior": {"registered": 1, "attended": 0},
+    }
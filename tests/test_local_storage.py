@@ -0,0 +1,174 @@
+from fastapi.testclient import TestClient
+import pytest
+from io import BytesIO
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.src.app import app
+from backend.main.storage.base import get_storage
+from backend.main.storage.local_storage import LocalStorage
+from backend.settings import settings
+
+CONTENT = b"0123456789abcdef"
+
+
+@pytest.fixture()
+def local_storage(monkeypatch, tmp_path):
+    monkeypatch.setitem(settings.config, "storage-backend", "local")
+    monkeypatch.setitem(settings.config, "storage-path", str(tmp_path))
+    monkeypatch.setitem(settings.config, "public-url", "http://testserver")
+    get_storage.cache_clear()
+    yield get_storage()
+    get_storage.cache_clear()
+
+
+client = TestClient(app)
+
+
+def upload(storage: LocalStorage, object_name: str, content: bytes, conditions=None):
+    post = storage.create_presigned_post(object_name, conditions=conditions)
+    return client.post(
+        post["url"], data=post["fields"], files={"file": ("packet.pdf", content)}
+    )
+
+
+def test_upload_and_download(local_storage):
+    assert isinstance(local_storage, LocalStorage)
+    response = upload(local_storage, "consent_forms/form.pdf", CONTENT)
+    assert response.status_code == 204
+    assert local_storage.path("consent_forms/form.pdf").read_bytes() == CONTENT
+
+    url = local_storage.create_presigned_url("consent_forms/form.pdf")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.headers["accept-ranges"] == "bytes"
+
+    response = client.head(url)
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(CONTENT))
+    assert response.content == b""
+
+
+def test_upload_with_filename_and_size_limit(local_storage):
+    response = upload(local_storage, "materials/${filename}", CONTENT)
+    assert response.status_code == 204
+    assert local_storage.path("materials/packet.pdf").read_bytes() == CONTENT
+
+    conditions = [["content-length-range", 0, 4]]
+    response = upload(local_storage, "materials/small.pdf", CONTENT, conditions)
+    assert response.status_code == 400
+    assert not local_storage.path("materials/small.pdf").exists()
+
+    # a ${filename} key needs a file name
+    post = local_storage.create_presigned_post("materials/${filename}")
+    response = client.post(
+        post["url"], data=post["fields"], files={"file": ("", CONTENT)}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "File name is required"
+
+
+def test_save_stops_past_size_limit(local_storage):
+    file = BytesIO(CONTENT * 1000)
+    assert not local_storage.save("materials/large.pdf", file, max_size=10)
+    # no more than one byte past the limit was read
+    assert file.tell() == 11
+    assert not local_storage.path("materials/large.pdf").exists()
+    assert list(local_storage.path("materials").iterdir()) == []
+
+    assert local_storage.save("materials/exact.pdf", BytesIO(CONTENT), len(CONTENT))
+    assert local_storage.path("materials/exact.pdf").read_bytes() == CONTENT
+
+
+def test_range_and_conditional_requests(local_storage):
+    upload(local_storage, "form.pdf", CONTENT)
+    url = local_storage.create_presigned_url("form.pdf")
+
+    response = client.get(url, headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[2:6]
+    assert response.headers["content-range"] == f"bytes 2-5/{len(CONTENT)}"
+
+    response = client.get(url, headers={"Range": "bytes=-3"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-3:]
+
+    response = client.get(url, headers={"Range": "bytes=100-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    etag = client.get(url).headers["etag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # a stale If-Range gets the whole file
+    response = client.get(url, headers={"Range": "bytes=2-5", "If-Range": '"old"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_invalid_links(local_storage):
+    response = client.get("/files/not-a-token")
+    assert response.status_code == 400
+
+    url = local_storage.create_presigned_url("missing.pdf")
+    assert client.get(url).status_code == 404
+
+    assert local_storage.create_presigned_url("../outside.pdf") is None
+    assert local_storage.create_presigned_post("../outside.pdf") is None
+    with pytest.raises(ValueError):
+        local_storage.path(".multipart/upload.json")
+
+
+def test_files_routes_need_local_storage():
+    get_storage.cache_clear()
+    response = client.get("/files/any-token")
+    assert response.status_code == 404
+
+
+def test_multipart_upload(local_storage):
+    upload_id = local_storage.create_multipart_upload("recordings/meeting.mp4")
+    parts = local_storage.create_presigned_upload_part_urls(
+        "recordings/meeting.mp4", upload_id, [1, 2]
+    )
+    etags = []
+    for part, content in zip(parts, [CONTENT, CONTENT[::-1]]):
+        response = client.put(part["url"], data=content)
+        assert response.status_code == 200
+        etags.append(
+            {"part_number": part["part_number"], "etag": response.headers["etag"]}
+        )
+
+    assert not local_storage.complete_multipart_upload(
+        "recordings/other.mp4", upload_id, etags
+    )
+    assert local_storage.complete_multipart_upload(
+        "recordings/meeting.mp4", upload_id, etags
+    )
+    path = local_storage.path("recordings/meeting.mp4")
+    assert path.read_bytes() == CONTENT + CONTENT[::-1]
+    assert not local_storage.upload_dir(upload_id).exists()
+
+
+def test_abort_multipart_upload(local_storage):
+    upload_id = local_storage.create_multipart_upload("recordings/meeting.mp4")
+    assert local_storage.save_part(
+        "recordings/meeting.mp4", upload_id, 1, BytesIO(CONTENT)
+    )
+    assert local_storage.abort_multipart_upload("recordings/meeting.mp4", upload_id)
+    assert not local_storage.upload_dir(upload_id).exists()
+    assert (
+        local_storage.save_part(
+            "recordings/meeting.mp4", upload_id, 1, BytesIO(CONTENT)
+        )
+        is None
+    )
@@ -0,0 +1,117 @@
+import asyncio
+from copy import deepcopy
+from uuid import uuid4
+from fastapi.testclient import TestClient
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.src.app import app
+from backend.auth.main import app as auth_app
+from backend.main.db.docs.mailing_list_doc import MailingListRecipientDocument
+from backend.main.db.repositories import mailing_list_repo
+from backend.tests.test_student_endpoint import (
+    mock_database,
+    pre_save_user_auths,
+    pre_save_profile_docs,
+    student_extra_student,
+)
+
+client = TestClient(app)
+client2 = TestClient(auth_app)
+
+
+def junior_a_recipients():
+    return asyncio.run(mailing_list_repo.get_recipients("junior_a"))
+
+
+def test_recipient_entries():
+    profile = {
+        "uuid": uuid4(),
+        "email": "Parent@Email.com",
+        "guardians": [
+            {"first_name": "Ann", "email": "parent@email.com"},
+            {"first_name": "Bo", "email": "bo@email.com"},
+        ],
+        "mailing_lists": ["junior_a", "senior"],
+    }
+    entries = mailing_list_repo.recipient_entries(
+        profile, [{"first_name": "Cy"}, {"first_name": "Di"}]
+    )
+    # the account email is also Ann's, so two addresses on each of two lists
+    assert sorted((e["level"], e["email"], e["name"]) for e in entries) == [
+        ("junior_a", "bo@email.com", "Bo"),
+        ("junior_a", "parent@email.com", "Ann"),
+        ("senior", "bo@email.com", "Bo"),
+        ("senior", "parent@email.com", "Ann"),
+    ]
+    assert all(e["student_names"] == ["Cy", "Di"] for e in entries)
+
+
+def test_profile_changes_update_recipients(mock_database):
+    MailingListRecipientDocument.drop_collection()
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    recipients = junior_a_recipients()
+    assert [r["email"] for r in recipients] == [
+        "jaketeststudent@email.com",
+        "jimmyteststudent@email.com",
+        "johnnyteststudent@email.com",
+    ]
+    assert recipients[0] == {
+        "email": "jaketeststudent@email.com",
+        "guardian_name": "jimmy",
+        "student_names": ["jake"],
+    }
+
+    # jimmy's profile gets a guardian with jake's address and a second student
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.get("/student/get_my_profile", headers=headers)
+    update = deepcopy(student_extra_student)
+    update.students[0].id = response.json()["student_list"][0]["id"]
+    response = client.put(
+        "/student/update_profile", json=update.dict(), headers=headers
+    )
+    assert response.status_code == 200
+
+    recipients = junior_a_recipients()
+    # still one email per address, with the students of both profiles
+    assert [r["email"] for r in recipients] == [
+        "jaketeststudent@email.com",
+        "jimmyteststudent@email.com",
+        "johnnyteststudent@email.com",
+    ]
+    assert recipients[0]["student_names"] == ["jake", "jimmy"]
+    assert recipients[1]["student_names"] == ["jake", "jimmy"]
+
+    update.mailing_lists = []
+    client.put("/student/update_profile", json=update.dict(), headers=headers)
+    assert [r["email"] for r in junior_a_recipients()] == [
+        "jaketeststudent@email.com",
+        "johnnyteststudent@email.com",
+    ]
+
+
+def test_rebuild(mock_database):
+    MailingListRecipientDocument.drop_collection()
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    expected = junior_a_recipients()
+
+    MailingListRecipientDocument.drop_collection()
+    assert junior_a_recipients() == []
+    assert asyncio.run(mailing_list_repo.rebuild()) == 3
+    assert junior_a_recipients() == expected
+
+    # rebuilding another level leaves junior_a alone
+    assert asyncio.run(mailing_list_repo.rebuild(["senior"])) == 0
+    assert junior_a_recipients() == expected
@@ -0,0 +1,167 @@
+import asyncio
+import json
+from fastapi.encoders import jsonable_encoder
+import pytest
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.docs.student_doc import StudentDocument
+from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.main.db.models.student_profile_model import SessionLevel
+from backend.main.db.repositories import meeting_repo
+from backend.main.db.repositories import student_profile_repo as profile_repo
+from backend.main.src.meeting_catalog import (
+    ERROR,
+    REVALIDATING,
+    MeetingCatalog,
+    SingleFlight,
+)
+from backend.main.src.routers.student import meeting_info
+from backend.tests.pre_save_meetings import pre_save_meetings
+from backend.tests.test_student_endpoint import (
+    mock_database,
+    pre_save_user_auths,
+    pre_save_profile_docs,
+)
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    runs = []
+
+    async def compute(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        if value == "bad":
+            raise ValueError(value)
+        return value
+
+    async def check():
+        results = await asyncio.gather(
+            *(flight.do("a", lambda: compute("a")) for _ in range(4)),
+            flight.do("b", lambda: compute("b")),
+        )
+        assert results == ["a", "a", "a", "a", "b"]
+        assert runs == ["a", "b"]
+        # nothing is kept after the run
+        assert await flight.do("a", lambda: compute("a")) == "a"
+        assert runs == ["a", "b", "a"]
+
+        results = await asyncio.gather(
+            *(flight.do("bad", lambda: compute("bad")) for _ in range(2)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(check())
+    assert flight.stats() == {
+        "calls": 8,
+        "runs": 4,
+        "coalesced": 4,
+        "in_flight": 0,
+        "coalescing_ratio": 0.5,
+    }
+
+
+def test_catalog_listing(mock_database):
+    MeetingDocument.drop_collection()
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    profile = StudentProfileDocument.objects(email="jimmyteststudent@email.com")[0]
+    student_id = str(profile.students[0].id)
+    registered = MeetingDocument.objects(topic="topic2")[0]
+    registered.update(push__students={"student_id": student_id})
+    StudentDocument.objects(id=student_id).update(
+        **{f"set__meetings_registered__{registered.uuid}": False}
+    )
+    levels = [SessionLevel("junior_b"), SessionLevel("junior_a")]
+    catalog = MeetingCatalog()
+
+    async def check():
+        students = await profile_repo.get_profile_students(
+            await profile_repo.get_profile_by_uuid(profile.uuid)
+        )
+        results = await asyncio.gather(*(catalog.get(levels) for _ in range(3)))
+        assert catalog.stats()["flight"]["runs"] == 1
+        listings = [listing for listing, _, _ in results]
+        assert listings[0] is listings[1] is listings[2]
+
+        # the same bytes get_meetings sent when each meeting was encoded per request
+        expected = [
+            meeting_info(meeting, students)
+            for meeting in await meeting_repo.get_meetings_by_session_levels(levels)
+        ]
+        listing = json.loads(listings[0].listing(students))
+        assert listing == jsonable_encoder(expected)
+        assert [m["topic"] for m in listing] == ["topic3", "topic", "topic2"]
+        assert [m["registrations"][0]["registered"] for m in listing] == [
+            False,
+            False,
+            True,
+        ]
+
+    asyncio.run(check())
+
+
+def test_catalog_stale_while_revalidate(mock_database, monkeypatch):
+    MeetingDocument.drop_collection()
+    pre_save_meetings()
+    now = [0.0]
+    catalog = MeetingCatalog(
+        soft_ttl=2, hard_ttl=60, retry_interval=1, clock=lambda: now[0]
+    )
+    levels = [SessionLevel("junior_a")]
+
+    async def get():
+        listing, age, stale = await catalog.get(levels)
+        # lets a background refresh run
+        await asyncio.sleep(0.05)
+        return len(listing.meetings), age, stale
+
+    async def failing(levels):
+        raise ConnectionError("cluster unreachable")
+
+    async def check():
+        assert await get() == (2, 0.0, None)
+        now[0] = 1
+        assert await get() == (2, 1, None)
+
+        # past the soft TTL the old copy is served while it is refreshed
+        MeetingDocument.objects(topic="topic").delete()
+        now[0] = 3
+        assert await get() == (2, 3, REVALIDATING)
+        assert await get() == (1, 0, None)
+
+        # the database fails, the last good copy is served until the hard TTL
+        monkeypatch.setattr(meeting_repo, "get_meetings_by_session_levels", failing)
+        now[0] = 6
+        assert await get() == (1, 3, REVALIDATING)
+        assert await get() == (1, 3, ERROR)
+        now[0] = 64
+        with pytest.raises(ConnectionError):
+            await catalog.get(levels)
+
+    asyncio.run(check())
+    assert catalog.stats() == {
+        "hits": 2,
+        "stale": 2,
+        "stale_if_error": 1,
+        "misses": 2,
+        "refresh_errors": 1,
+        "refreshing": 0,
+        "flight": {
+            "calls": 4,
+            "runs": 4,
+            "coalesced": 0,
+            "in_flight": 0,
+            "coalescing_ratio": 0.0,
+        },
+    }
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.src.app import app
+from backend.auth.main import app as auth_app
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.docs.sync_docs import MeetingTombstoneDocument, SequenceDocument
+from backend.main.db.models.meeting_model import MeetingSearchModel
+from backend.main.db.models.student_profile_model import SessionLevel
+from backend.main.db.repositories import meeting_repo
+from backend.main.db.repositories.meeting_repo import sync_cursor
+from backend.tests.test_student_endpoint import (
+    mock_database,
+    pre_save_user_auths,
+    pre_save_profile_docs,
+)
+from backend.tests.pre_save_meetings import meeting1, meeting2, meeting3
+
+client = TestClient(app)
+client2 = TestClient(auth_app)
+
+NOW = datetime(2021, 3, 20, 12, 0)
+OLD = NOW - timedelta(minutes=1)
+RECENT = NOW - timedelta(seconds=1)
+
+
+def test_sync_cursor():
+    assert sync_cursor(3, [], NOW) == 3
+    assert sync_cursor(3, [(4, OLD), (6, OLD)], NOW) == 6
+    # 7 may have been written before a 5 still in flight, so it comes again
+    assert sync_cursor(3, [(4, OLD), (7, RECENT)], NOW) == 4
+    assert sync_cursor(3, [(4, RECENT), (6, OLD)], NOW) == 3
+
+
+def settle_changes():
+    """Makes every change older than SETTLE_TIME"""
+    for collection, field in (
+        (MeetingDocument._get_collection(), "updated_at"),
+        (MeetingTombstoneDocument._get_collection(), "deleted_at"),
+    ):
+        collection.update_many({}, {"$set": {field: OLD}})
+
+
+def reset_sync():
+    MeetingDocument.drop_collection()
+    MeetingTombstoneDocument.drop_collection()
+    SequenceDocument.drop_collection()
+
+
+def test_meeting_changes(mock_database):
+    reset_sync()
+
+    async def check():
+        first = await meeting_repo.add_meeting(meeting1)
+        second = await meeting_repo.add_meeting(meeting2)
+        assert (first["updated_seq"], second["updated_seq"]) == (1, 2)
+        settle_changes()
+        assert await meeting_repo.get_meetings_cursor() == 2
+
+        await meeting_repo.update_meeting(first["uuid"], {"topic": "new topic"})
+        await meeting_repo.delete_meeting(second["uuid"])
+        settle_changes()
+        changed, deleted, cursor = await meeting_repo.get_meeting_changes(2)
+        assert [m["topic"] for m in changed] == ["new topic"]
+        assert deleted == [str(second["uuid"])]
+        assert cursor == 4
+        assert await meeting_repo.get_meeting_changes(4) == ([], [], 4)
+
+        # registrations change the meeting too, only when something changed
+        info = {"student_id": "5f0c6a2e9d1b2c3d4e5f6a7b"}
+        assert await meeting_repo.add_student_to_meeting(first["uuid"], info)
+        assert not await meeting_repo.add_student_to_meeting(first["uuid"], info)
+        assert not await meeting_repo.remove_student_from_meeting(
+            second["uuid"], info["student_id"]
+        )
+        changed, _, cursor = await meeting_repo.get_meeting_changes(4)
+        assert len(changed) == 1
+        # just written, so the cursor stays put
+        assert cursor == 4
+
+    asyncio.run(check())
+
+
+def test_get_meetings_since(mock_database):
+    reset_sync()
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    junior_a = asyncio.run(meeting_repo.add_meeting(meeting1))
+    moving = asyncio.run(meeting_repo.add_meeting(meeting2))
+    asyncio.run(meeting_repo.add_meeting(meeting3))
+    settle_changes()
+
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    search = MeetingSearchModel(session_levels=[SessionLevel("junior_a")]).dict()
+    response = client.post("/student/get_meetings", json=search, headers=headers)
+    assert len(response.json()) == 2
+    cursor = response.headers["X-Meetings-Cursor"]
+    assert cursor == "3"
+
+    # nothing changed
+    response = client.post(
+        "/student/get_meetings", json=search, params={"since": cursor}, headers=headers
+    )
+    assert response.json() == {"meetings": [], "deleted": [], "cursor": 3}
+
+    asyncio.run(meeting_repo.update_meeting(junior_a["uuid"], {"topic": "changed"}))
+    asyncio.run(
+        meeting_repo.update_meeting(moving["uuid"], {"session_level": "junior_b"})
+    )
+    settle_changes()
+    response = client.post(
+        "/student/get_meetings", json=search, params={"since": cursor}, headers=headers
+    )
+    body = response.json()
+    assert [m["topic"] for m in body["meetings"]] == ["changed"]
+    assert body["meetings"][0]["registrations"][0]["first_name"] == "jimmy"
+    # no longer junior_a
+    assert body["deleted"] == [str(moving["uuid"])]
+    assert body["cursor"] == 5
+    assert response.headers["X-Meetings-Cursor"] == "5"
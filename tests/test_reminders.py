@@ -0,0 +1,211 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from uuid import uuid4
+from mongoengine import disconnect_all, connect
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.db.docs.lease_doc import LeaseDocument
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.docs.outbox_doc import OutboxEmailDocument
+from backend.main.db.docs.student_doc import StudentDocument
+from backend.main.db.repositories import meeting_repo
+from backend.main.email_handler.reminder_scheduler import (
+    ReminderScheduler,
+    reminder_emails,
+    send_all_due_reminders,
+    send_due_reminders,
+)
+
+NOW = datetime(2021, 3, 20, 12, 0)
+WINDOW = timedelta(hours=24)
+SMITHS = uuid4()
+JONES = uuid4()
+
+
+@pytest.fixture()
+def mock_database():
+    disconnect_all()
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="student-db")
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="meeting-db")
+    connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
+    for document in (
+        LeaseDocument,
+        MeetingDocument,
+        OutboxEmailDocument,
+        StudentDocument,
+    ):
+        document.drop_collection()
+
+
+def registration(student_id, account_uuid, email, guardians):
+    return {
+        "student_id": student_id,
+        "account_uuid": account_uuid,
+        "email": email,
+        "guardians": guardians,
+        "attended": False,
+    }
+
+
+def save_students(*first_names):
+    result = StudentDocument._get_collection().insert_many(
+        [{"first_name": name, "last_name": "L"} for name in first_names]
+    )
+    return [str(student_id) for student_id in result.inserted_ids]
+
+
+def save_meeting(starts_in: timedelta, students=()):
+    meeting = {
+        "uuid": uuid4(),
+        "date_and_time": NOW + starts_in,
+        "duration": 60,
+        "zoom_link": "zoomlink",
+        "topic": "topic",
+        "session_level": "junior_a",
+        "miro_link": "miro_link",
+        "password": "password",
+        "students": list(students),
+    }
+    MeetingDocument._get_collection().insert_one(meeting)
+    return meeting
+
+
+def family_registrations():
+    ann, bo, cy = save_students("Ann", "Bo", "Cy")
+    smiths = [{"first_name": "Sam", "email": "sam@email.com"}]
+    jones = [
+        {"first_name": "Jo", "email": "Jones@email.com"},
+        {"first_name": "Al", "email": "al@email.com"},
+    ]
+    return [
+        registration(ann, SMITHS, "smiths@email.com", smiths),
+        registration(bo, SMITHS, "smiths@email.com", smiths),
+        registration(cy, JONES, "jones@email.com", jones),
+    ]
+
+
+def reminder_receivers():
+    return sorted(email.receivers[0] for email in OutboxEmailDocument.objects())
+
+
+def test_reminder_emails(mock_database):
+    meeting = save_meeting(timedelta(hours=1), family_registrations())
+    students = {str(st["_id"]): st for st in StudentDocument._get_collection().find()}
+    emails = {
+        email["receivers"][0]: email for email in reminder_emails(meeting, students)
+    }
+    # one email per address of each family, the account email of the Jones is
+    # also Jo's so it is not repeated
+    assert sorted(emails) == [
+        "al@email.com",
+        "jones@email.com",
+        "sam@email.com",
+        "smiths@email.com",
+    ]
+    assert "Dear Sam," in emails["smiths@email.com"]["body"]
+    assert "Ann, Bo are registered" in emails["smiths@email.com"]["body"]
+    assert "Dear Al," in emails["al@email.com"]["body"]
+    assert "Cy is registered" in emails["al@email.com"]["body"]
+    assert emails["al@email.com"]["key"] == (
+        f"reminder:{meeting['uuid']}:2021-03-20T13:00:00:al@email.com"
+    )
+
+
+def test_send_due_reminders_once(mock_database):
+    soon = save_meeting(timedelta(hours=1), family_registrations())
+    save_meeting(timedelta(days=2), family_registrations())
+    save_meeting(timedelta(hours=-1), family_registrations())
+
+    sent = asyncio.run(send_due_reminders(WINDOW, 10, NOW))
+    assert sent == {"meetings": 1, "emails": 4}
+    assert len(reminder_receivers()) == 4
+    assert asyncio.run(send_due_reminders(WINDOW, 10, NOW)) == {
+        "meetings": 0,
+        "emails": 0,
+    }
+
+    # queued but not marked, e.g. the process died in between
+    MeetingDocument._get_collection().update_one(
+        {"uuid": soon["uuid"]}, {"$unset": {"reminder_sent_at": ""}}
+    )
+    sent = asyncio.run(send_due_reminders(WINDOW, 10, NOW))
+    assert sent == {"meetings": 1, "emails": 0}
+    assert len(reminder_receivers()) == 4
+
+    # moving the meeting sends a reminder for the new time
+    asyncio.run(
+        meeting_repo.update_meeting(
+            soon["uuid"], {"date_and_time": NOW + timedelta(hours=3)}
+        )
+    )
+    sent = asyncio.run(send_due_reminders(WINDOW, 10, NOW))
+    assert sent == {"meetings": 1, "emails": 4}
+    assert len(reminder_receivers()) == 8
+
+
+def test_send_due_reminders_batches(mock_database):
+    for hours in range(1, 6):
+        save_meeting(timedelta(hours=hours))
+    assert asyncio.run(send_due_reminders(WINDOW, 2, NOW)) == {
+        "meetings": 2,
+        "emails": 0,
+    }
+    # soonest first
+    marked = MeetingDocument._get_collection().find({"reminder_sent_at": {"$ne": None}})
+    assert sorted(m["date_and_time"] for m in marked) == [
+        NOW + timedelta(hours=1),
+        NOW + timedelta(hours=2),
+    ]
+    assert asyncio.run(send_due_reminders(WINDOW, 2, NOW))["meetings"] == 2
+    assert asyncio.run(send_due_reminders(WINDOW, 2, NOW))["meetings"] == 1
+    assert asyncio.run(send_due_reminders(WINDOW, 2, NOW))["meetings"] == 0
+
+
+def test_send_all_due_reminders(mock_database):
+    for hours in range(1, 6):
+        save_meeting(timedelta(hours=hours), family_registrations())
+    assert asyncio.run(send_all_due_reminders(WINDOW, 2, NOW)) == {
+        "meetings": 5,
+        "emails": 20,
+    }
+    assert asyncio.run(send_all_due_reminders(WINDOW, 2, NOW)) == {
+        "meetings": 0,
+        "emails": 0,
+    }
+
+
+def test_scheduler_lease(mock_database):
+    save_meeting(timedelta(hours=1), family_registrations())
+    first = ReminderScheduler(window=WINDOW, interval=10)
+    second = ReminderScheduler(window=WINDOW, interval=10)
+
+    assert asyncio.run(first.tick(NOW)) == {"meetings": 1, "emails": 4}
+    # held by the first scheduler until it expires
+    assert asyncio.run(second.tick(NOW + timedelta(seconds=20))) is None
+    assert asyncio.run(first.tick(NOW + timedelta(seconds=20))) is not None
+    assert asyncio.run(second.tick(NOW + timedelta(seconds=40))) is None
+    assert asyncio.run(second.tick(NOW + timedelta(seconds=51))) is not None
+    assert asyncio.run(first.tick(NOW + timedelta(seconds=52))) is None
+    assert len(reminder_receivers()) == 4
+
+
+def test_scheduler_run_releases_lease(mock_database):
+    scheduler = ReminderScheduler(window=WINDOW, interval=10)
+
+    async def run_briefly():
+        task = asyncio.get_event_loop().create_task(scheduler.run())
+        await asyncio.sleep(0.2)
+        assert LeaseDocument.objects(owner=scheduler.owner).count() == 1
+        scheduler.stop()
+        await task
+
+    asyncio.run(run_briefly())
+    assert LeaseDocument.objects().count() == 0
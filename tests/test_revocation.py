@@ -0,0 +1,65 @@
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+sys.path.append(str(PROJECTS_DIR))
+
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from jose import jwt
+
+from backend.auth import dependencies, revocation
+from backend.auth.revocation import BloomFilter, RevocationList, jti_key, user_key
+
+
+def test_bloom_filter_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [jti_key(uuid4().hex) for _ in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(bloom.might_contain(key) for key in keys)
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for _ in range(1000):
+        bloom.add(user_key(uuid4()))
+    false_positives = sum(
+        bloom.might_contain(jti_key(uuid4().hex)) for _ in range(10000)
+    )
+    # allow some slack over the configured 1%
+    assert false_positives < 300
+
+
+# a token minted right after a user revocation, e.g. the login after a password
+# reset, has an `iat` in the same second and must not be revoked with the others
+def test_token_issued_in_revocation_second_is_valid(monkeypatch):
+    stored = {}
+
+    async def add_revocation(revoked):
+        stored[revoked.key] = revoked
+
+    async def get_revocation(key):
+        return stored.get(key, False)
+
+    monkeypatch.setattr(dependencies, "add_revocation", add_revocation)
+    monkeypatch.setattr(dependencies, "revocation_list", RevocationList())
+    monkeypatch.setattr(revocation, "get_revocation", get_revocation)
+    user_id = uuid4()
+
+    async def check():
+        await dependencies.revoke_user_tokens(user_id)
+        token = dependencies.create_access_token({"sub": str(user_id)})
+        issued_at = datetime.utcfromtimestamp(jwt.get_unverified_claims(token)["iat"])
+        revoked_at = stored[user_key(user_id)].revoked_at
+        assert revoked_at.microsecond == 0
+        revocations = dependencies.revocation_list
+        assert not await revocations.is_revoked(user_id, None, issued_at)
+        assert await revocations.is_revoked(
+            user_id, None, revoked_at - timedelta(seconds=1)
+        )
+
+    asyncio.run(check())
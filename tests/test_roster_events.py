@@ -0,0 +1,238 @@
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+import json
+from uuid import uuid4
+from fastapi.testclient import TestClient
+
+# hack to add project directory to path and make modules work nicely
+import sys
+from pathlib import Path
+
+PROJECTS_DIR = Path(__file__).resolve().parents[2]
+print("Appending PROJECTS_DIR to PATH:", PROJECTS_DIR)
+sys.path.append(str(PROJECTS_DIR))
+
+from backend.main.src.app import app
+from backend.auth.main import app as auth_app
+from backend.main.db.docs.meeting_doc import MeetingDocument
+from backend.main.db.models.meeting_model import StudentMeetingAttendance
+from backend.main.src.roster_events import (
+    REDIS_CHANNEL,
+    EventHub,
+    RedisBridge,
+    event_stream,
+    get_event_hub,
+    roster_event,
+)
+from backend.tests.test_admin_endpoint import add_student_to_meeting
+from backend.tests.test_student_endpoint import (
+    mock_database,
+    pre_save_user_auths,
+    pre_save_profile_docs,
+)
+from backend.tests.pre_save_meetings import pre_save_meetings
+
+client = TestClient(app)
+client2 = TestClient(auth_app)
+
+MEETING = uuid4()
+
+
+def event(kind="registered", meeting_id=MEETING, level="junior_a"):
+    return roster_event(kind, meeting_id, level, "5f0c6a2e9d1b2c3d4e5f6a7b")
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def test_hub_delivers_by_meeting_and_level():
+    async def check():
+        hub = EventHub()
+        both = hub.subscribe([f"meeting:{MEETING}", "level:junior_a"])
+        level = hub.subscribe(["level:junior_a"])
+        other = hub.subscribe(["level:senior"])
+
+        await hub.publish(event())
+        await hub.publish(event(meeting_id=uuid4()))
+        # once, although both of its topics match
+        assert both.queue.qsize() == 2
+        assert level.queue.qsize() == 2
+        assert other.queue.empty()
+        assert hub.stats()["delivered"] == 4
+
+        both.close()
+        level.close()
+        other.close()
+        assert hub.subscriptions == {}
+
+    asyncio.run(check())
+
+
+def test_slow_subscriber_drops_oldest():
+    async def check():
+        hub = EventHub()
+        subscription = hub.subscribe(["level:junior_a"], max_queued=2)
+        for kind in ("registered", "unregistered", "attended"):
+            await hub.publish(event(kind))
+        assert subscription.dropped == 1
+        assert (await subscription.get(1))["type"] == "unregistered"
+        assert (await subscription.get(1))["type"] == "attended"
+        assert await subscription.get(0.01) is None
+
+    asyncio.run(check())
+
+
+def test_event_stream():
+    async def check():
+        hub = EventHub()
+        request = FakeRequest()
+        subscription = hub.subscribe([f"meeting:{MEETING}"])
+        stream = event_stream(request, subscription, heartbeat=0.01)
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        assert await stream.__anext__() == ": keepalive\n\n"
+
+        await hub.publish(event("attended"))
+        chunk = await stream.__anext__()
+        assert chunk.startswith("event: attended\ndata: ")
+        assert json.loads(chunk.split("data: ")[1])["meeting_id"] == str(MEETING)
+
+        request.disconnected = True
+        assert [chunk async for chunk in stream] == []
+        assert hub.subscriptions == {}
+
+    asyncio.run(check())
+
+
+def test_redis_bridge_fans_out_across_workers():
+    async def check():
+        server = fakeredis.FakeServer()
+        hubs = [EventHub(), EventHub()]
+        bridges = [
+            RedisBridge(
+                hub,
+                lambda: fakeredis.aioredis.create_redis_pool(server=server),
+            )
+            for hub in hubs
+        ]
+        for bridge in bridges:
+            await bridge.start()
+        subscriptions = [hub.subscribe(["level:junior_a"]) for hub in hubs]
+
+        await hubs[0].publish(event())
+        for subscription in subscriptions:
+            assert (await subscription.get(1))["student_id"] == event()["student_id"]
+        # the publishing worker does not get its own event back from Redis
+        assert await subscriptions[0].get(0.05) is None
+
+        for bridge in bridges:
+            await bridge.stop()
+        assert hubs[0].bridge is None
+
+    asyncio.run(check())
+
+
+def test_redis_bridge_skips_bad_messages():
+    async def check():
+        server = fakeredis.FakeServer()
+        hub = EventHub()
+        bridge = RedisBridge(
+            hub, lambda: fakeredis.aioredis.create_redis_pool(server=server)
+        )
+        await bridge.start()
+        subscription = hub.subscribe(["level:junior_a"])
+        other = await fakeredis.aioredis.create_redis_pool(server=server)
+        for message in (
+            "not json",
+            {"origin": "other"},
+            {"origin": "other", "event": {"type": "registered"}},
+            {"origin": "other", "event": event()},
+        ):
+            if not isinstance(message, str):
+                message = json.dumps(message)
+            await other.publish(REDIS_CHANNEL, message)
+
+        # the listener is still running after the bad ones
+        assert (await subscription.get(1))["student_id"] == event()["student_id"]
+        assert bridge.bad_messages == 3
+        other.close()
+        await other.wait_closed()
+        await bridge.stop()
+
+    asyncio.run(check())
+
+
+def test_redis_bridge_reconnects():
+    async def check():
+        server = fakeredis.FakeServer()
+        hub = EventHub()
+        bridge = RedisBridge(
+            hub,
+            lambda: fakeredis.aioredis.create_redis_pool(server=server),
+            backoff=0.01,
+        )
+        await bridge.start()
+        subscription = hub.subscribe(["level:junior_a"])
+
+        # Redis goes away, the subscription and the first attempts fail
+        server.connected = False
+        bridge._subscriber.close()
+        await asyncio.sleep(0.1)
+        assert bridge.reconnects == 0
+        server.connected = True
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if bridge.reconnects:
+                break
+        assert bridge.reconnects == 1
+
+        other = await fakeredis.aioredis.create_redis_pool(server=server)
+        await other.publish(
+            REDIS_CHANNEL, json.dumps({"origin": "other", "event": event()})
+        )
+        assert (await subscription.get(1))["student_id"] == event()["student_id"]
+        other.close()
+        await other.wait_closed()
+        await bridge.stop()
+
+    asyncio.run(check())
+
+
+def test_routes_publish_roster_events(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    meeting = MeetingDocument.objects().first()
+    subscription = get_event_hub().subscribe([f"meeting:{meeting.uuid}"])
+    try:
+        student_id = add_student_to_meeting()
+        registered = subscription.queue.get_nowait()
+        assert registered["type"] == "registered"
+        assert registered["student_id"] == str(student_id)
+        assert registered["session_level"] == "junior_a"
+        assert registered["first_name"] == "jimmy"
+
+        response = client2.post(
+            "/token", data={"username": "admin@email.com", "password": "password"}
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        client.put(
+            "/admin/update_student_attendance",
+            json=StudentMeetingAttendance(
+                meeting_id=meeting.uuid, student_id=student_id, attended=True
+            ).dict(),
+            headers=headers,
+        )
+        attended = subscription.queue.get_nowait()
+        assert (attended["type"], attended["attended"]) == ("attended", True)
+        assert subscription.queue.empty()
+
+        response = client.get("/admin/roster_events", headers=headers)
+        assert response.status_code == 400
+    finally:
+        subscription.close()
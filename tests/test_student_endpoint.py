@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
 import toml
 import pytest
+from datetime import datetime, timedelta
 from json import JSONEncoder
 from pathlib import Path
 from uuid import UUID
@@ -12,6 +13,7 @@ from backend.tests.pre_save_meetings import pre_save_meetings
 from backend.main.db.models.meeting_model import (
     MeetingSearchModel,
     StudentMeetingRegistration,
+    StudentMeetingRegistrationBatch,
 )
 from backend.main.db.docs.meeting_doc import MeetingDocument
 from backend.main.db.models.student_models import StudentCreateModel, StudentGrade
@@ -21,7 +23,12 @@ from backend.main.db.models.student_profile_model import (
     SessionLevel,
     StudentUpdateModel,
 )
+from backend.main.db.docs.student_doc import StudentDocument
 from backend.main.db.docs.student_profile_doc import StudentProfileDocument
+from backend.auth.dependencies import create_email_verification_token
+from backend.main.src.meeting_catalog import get_meeting_catalog
+from backend.main.src.routers import student as student_router
+from backend.main.db.repositories import meeting_repo
 
 CONFIG_PATH = Path(__file__).resolve().parents[1].joinpath("auth/db-config.toml")
 print("Using CONFIG_PATH:", CONFIG_PATH)
@@ -210,6 +217,8 @@ def mock_database():
     connect(host="mongomock://localhost", db="mongoenginetest", alias="student-db")
     connect(host="mongomock://localhost", db="mongoenginetest", alias="meeting-db")
     connect(host="mongomock://localhost", db="mongoenginetest", alias="admin-db")
+    # cached listings of the previous test's meetings
+    get_meeting_catalog.cache_clear()
 
 
 client = TestClient(app)
@@ -345,3 +354,248 @@ def test_update_student_for_meeting(mock_database):
     )
     meetings = MeetingDocument.objects(uuid=meeting.uuid)[0]
     assert len(meetings.students) == 0
+
+
+def test_update_student_for_meeting_without_profile(mock_database):
+    pre_save_user_auths()
+    pre_save_meetings()
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    access_token = response.json()["access_token"]
+    response = client.post(
+        "/student/update_student_for_meeting",
+        json=StudentMeetingRegistration(
+            meeting_id=MeetingDocument.objects()[0].uuid,
+            student_id="5f0c6a2e9d1b2c3d4e5f6a7b",
+            registered=True,
+        ).dict(),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "This account has no profile"
+
+
+def test_update_student_for_meeting_other_account(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    other_doc = StudentProfileDocument.objects(email="jaketeststudent@email.com")[0]
+    student_id = other_doc.students[0].id
+    meeting = MeetingDocument.objects()[0]
+    access_token = response.json()["access_token"]
+    response = client.post(
+        "/student/update_student_for_meeting",
+        json=StudentMeetingRegistration(
+            meeting_id=meeting.uuid,
+            student_id=student_id,
+            registered=True,
+        ).dict(),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.status_code == 400
+    meetings = MeetingDocument.objects(uuid=meeting.uuid)[0]
+    assert len(meetings.students) == 0
+
+
+def test_add_profile_refreshes_token(mock_database):
+    pre_save_user_auths()
+    response = client2.post(
+        "/token",
+        data={"username": "johnnyteststudent@email.com", "password": "password"},
+    )
+    access_token = response.json()["access_token"]
+    response = client.post(
+        "/student/add_profile",
+        json=student3.dict(),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert "X-Access-Token" in response.headers
+    access_token = response.headers["X-Access-Token"]
+    student_id = response.json()["student_list"][0]["id"]
+    response = client.get(
+        "/student/get_consent_form_url",
+        params={"student_id": student_id},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert response.json()["detail"] == "Student has not uploaded consent form yet"
+
+
+def test_verify_email(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    profile = StudentProfileDocument.objects(email="jaketeststudent@email.com")[0]
+    token = create_email_verification_token(profile.uuid, profile.email)
+    response = client.put("/student/verify_email", params={"token": "not a token"})
+    assert response.status_code == 400
+    response = client.put("/student/verify_email", params={"token": token})
+    assert response.status_code == 200
+    profile.reload()
+    assert profile.email_verified
+
+
+def test_get_dashboard(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    # one meeting of each level in the future, the other junior_a one is past
+    next_week = datetime.utcnow() + timedelta(days=7)
+    upcoming = MeetingDocument.objects(topic="topic")[0]
+    upcoming.update(set__date_and_time=next_week)
+    other_level = MeetingDocument.objects(topic="topic3")[0]
+    other_level.update(set__date_and_time=next_week)
+
+    profile = StudentProfileDocument.objects(email="jimmyteststudent@email.com")[0]
+    student_id = str(profile.students[0].id)
+    other_id = str(
+        StudentProfileDocument.objects(email="jaketeststudent@email.com")[0]
+        .students[0]
+        .id
+    )
+    upcoming.update(push__students={"student_id": student_id})
+    other_level.update(
+        push_all__students=[{"student_id": student_id}, {"student_id": other_id}]
+    )
+
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    access_token = response.json()["access_token"]
+    response = client.get(
+        "/student/dashboard", headers={"Authorization": f"Bearer {access_token}"}
+    )
+    json = response.json()
+    assert json["profile"]["email"] == "jimmyteststudent@email.com"
+    assert json["profile"]["student_list"][0]["id"] == student_id
+    assert list(json["meetings"]) == ["junior_a"]
+    [meeting] = json["meetings"]["junior_a"]
+    assert meeting["topic"] == "topic"
+    assert meeting["registrations"][0]["registered"]
+    assert [r["topic"] for r in json["registrations"]] == ["topic", "topic3"]
+    # the other family's student is left out
+    assert json["registrations"][1]["student_ids"] == [student_id]
+
+
+def test_update_students_for_meetings(mock_database):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    access_token = response.json()["access_token"]
+    student_id = (
+        StudentProfileDocument.objects(email="jimmyteststudent@email.com")[0]
+        .students[0]
+        .id
+    )
+    other_id = (
+        StudentProfileDocument.objects(email="jaketeststudent@email.com")[0]
+        .students[0]
+        .id
+    )
+    first, second, third = MeetingDocument.objects()
+
+    def send(*registrations):
+        batch = StudentMeetingRegistrationBatch(
+            registrations=[
+                StudentMeetingRegistration(
+                    meeting_id=meeting_id, student_id=sid, registered=registered
+                )
+                for meeting_id, sid, registered in registrations
+            ]
+        )
+        response = client.post(
+            "/student/update_students_for_meetings",
+            json=batch.dict(),
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        assert response.status_code == 200
+        return [result["status"] for result in response.json()]
+
+    statuses = send(
+        (first.uuid, student_id, True),
+        (second.uuid, student_id, True),
+        (first.uuid, student_id, True),
+        (third.uuid, other_id, True),
+        (third.uuid, student_id, False),
+    )
+    assert statuses == ["registered", "registered", "error", "error", "unchanged"]
+    first.reload()
+    assert [st["student_id"] for st in first.students] == [str(student_id)]
+    assert first.students[0]["email"] == "jimmyteststudent@email.com"
+    third.reload()
+    assert third.students == []
+    student = StudentDocument.objects(id=student_id)[0]
+    assert set(student.meetings_registered) == {str(first.uuid), str(second.uuid)}
+    assert student.meeting_counts["junior_a"]["registered"] == 2
+
+    statuses = send((first.uuid, student_id, False), (second.uuid, student_id, True))
+    assert statuses == ["unregistered", "unchanged"]
+    first.reload()
+    assert first.students == []
+    student.reload()
+    assert set(student.meetings_registered) == {str(second.uuid)}
+    assert student.meeting_counts["junior_a"]["registered"] == 1
+
+
+# a registration a concurrent request applied first is reported as unchanged
+def test_update_students_for_meetings_concurrent(mock_database, monkeypatch):
+    pre_save_user_auths()
+    pre_save_profile_docs()
+    pre_save_meetings()
+    response = client2.post(
+        "/token",
+        data={"username": "jimmyteststudent@email.com", "password": "password"},
+    )
+    access_token = response.json()["access_token"]
+    student_id = (
+        StudentProfileDocument.objects(email="jimmyteststudent@email.com")[0]
+        .students[0]
+        .id
+    )
+    first, second, _ = MeetingDocument.objects()
+    first.update(push__students={"student_id": str(student_id)})
+
+    # the route reads the rosters from before the other request's write
+    get_meetings = meeting_repo.get_meetings_by_uuids
+
+    async def stale_meetings(*args, **kwargs):
+        meetings = await get_meetings(*args, **kwargs)
+        for meeting in meetings.values():
+            meeting["students"] = []
+        return meetings
+
+    events = []
+
+    async def record_event(event, meeting_id, *args, **kwargs):
+        events.append((event, meeting_id))
+
+    monkeypatch.setattr(meeting_repo, "get_meetings_by_uuids", stale_meetings)
+    monkeypatch.setattr(student_router, "publish_roster_event", record_event)
+    batch = StudentMeetingRegistrationBatch(
+        registrations=[
+            StudentMeetingRegistration(
+                meeting_id=meeting.uuid, student_id=student_id, registered=True
+            )
+            for meeting in (first, second)
+        ]
+    )
+    response = client.post(
+        "/student/update_students_for_meetings",
+        json=batch.dict(),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert [r["status"] for r in response.json()] == ["unchanged", "registered"]
+    assert events == [("registered", second.uuid)]
+    first.reload()
+    assert len(first.students) == 1
+    student = StudentDocument.objects(id=student_id)[0]
+    assert set(student.meetings_registered) == {str(second.uuid)}